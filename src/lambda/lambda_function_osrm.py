@@ -1,8 +1,19 @@
 import boto3
 import os
 import json
+from datetime import datetime, timezone
 from botocore.exceptions import ClientError
 
+# --- BACKLOG (mesmos buckets/chaves do pipeline em src/python/config.py) ---
+SOURCE_BUCKET = os.environ.get('SOURCE_BUCKET', '50-ze-datalake-refined')
+SOURCE_PREFIX = os.environ.get('SOURCE_PREFIX', 'data_mesh/vw_antifraud_fact_distances')
+CONTROL_BUCKET = os.environ.get('CONTROL_BUCKET', '20-ze-datalake-landing')
+BOOKMARK_KEY = os.environ.get('BOOKMARK_KEY', 'osrm_distance/control/bookmark.json')
+RUN_PLAN_KEY = os.environ.get('RUN_PLAN_KEY', 'osrm_distance/control/run_plan.json')
+# Gravado pelo osrm_run.sh logo antes de se auto-hibernar e apagado na retomada
+HIBERNATE_MARKER_KEY = os.environ.get('HIBERNATE_MARKER_KEY', 'osrm_distance/control/hibernate_marker.json')
+BACKLOG_CHECK = os.environ.get('BACKLOG_CHECK', '1') == '1'
+
 # --- FUNÇÃO HELPER PARA VERIFICAR O STATUS ---
 def get_instance_status(ec2_client, instance_id):
     """
@@ -18,6 +29,91 @@ def get_instance_status(ec2_client, instance_id):
             return "not_found"
         raise
 
+def is_hibernated(ec2_client, instance_id):
+    """
+    True se a instância parada foi hibernada (RAM salva no EBS): o próximo START é uma retomada.
+    """
+    response = ec2_client.describe_instances(InstanceIds=[instance_id])
+    instance = response['Reservations'][0]['Instances'][0]
+    return instance.get('StateReason', {}).get('Code') == 'Client.UserInitiatedHibernate'
+
+def hibernation_configured(ec2_client, instance_id):
+    """
+    True se a instância foi lançada com hibernação habilitada (HibernationOptions.Configured).
+    """
+    response = ec2_client.describe_instances(InstanceIds=[instance_id])
+    instance = response['Reservations'][0]['Instances'][0]
+    return instance.get('HibernationOptions', {}).get('Configured', False)
+
+def self_hibernation_pending(s3_client):
+    """
+    True se o osrm_run.sh está (ou vai ficar) congelado esperando a retomada (marcador no S3). Sem o marcador,
+    a última execução não terminou em auto-hibernação: uma VM hibernada agora retomaria sem ninguém rodar o pipeline.
+    Qualquer erro na leitura conta como ausente (o caminho seguro é o stop/boot normal).
+    """
+    try:
+        s3_client.head_object(Bucket=CONTROL_BUCKET, Key=HIBERNATE_MARKER_KEY)
+        return True
+    except ClientError:
+        return False
+
+def read_bookmark(s3_client):
+    """
+    Bookmark do pipeline (partições concluídas e watermark do delta do mês corrente).
+    """
+    try:
+        obj = s3_client.get_object(Bucket=CONTROL_BUCKET, Key=BOOKMARK_KEY)
+        return json.loads(obj['Body'].read().decode('utf-8'))
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return {"completed_partitions": [], "delta_timestamps": {}}
+        raise
+
+def estimate_backlog(s3_client):
+    """
+    Mesma fila do pipeline (work_plan.py): partições 2025+ não concluídas, só com os .parquet posteriores ao
+    watermark do delta (quando houver) e fora dos já concluídos num checkpoint. Só listagens e o bookmark.
+    """
+    bookmark = read_bookmark(s3_client)
+    completed = set(bookmark.get("completed_partitions", []))
+    current_month = datetime.now(timezone.utc).strftime('%Y-%m')
+    paginator = s3_client.get_paginator('list_objects_v2')
+    
+    partitions = set()
+    for page in paginator.paginate(Bucket=SOURCE_BUCKET, Prefix=f"{SOURCE_PREFIX}/", Delimiter='/'):
+        for common_prefix in page.get('CommonPrefixes', []):
+            name = common_prefix['Prefix'].split('/')[-2]
+            if len(name) == 7 and name[4] == '-' and name.startswith('2025-'):
+                partitions.add(name)
+    pending = sorted(p for p in partitions if p not in completed)
+    
+    plan = []
+    for partition in pending:
+        watermark = bookmark.get("delta_timestamps", {}).get(partition)
+        done_files = set(bookmark.get("checkpoints", {}).get(partition, {}).get("done_files", []))
+        watermark = datetime.fromisoformat(watermark) if watermark else None
+        if watermark and watermark.tzinfo is None:
+            watermark = watermark.replace(tzinfo=timezone.utc)
+        files, size = 0, 0
+        for page in paginator.paginate(Bucket=SOURCE_BUCKET, Prefix=f"{SOURCE_PREFIX}/{partition}"):
+            for obj in page.get('Contents', []):
+                if not obj['Key'].endswith('.parquet'):
+                    continue
+                if (watermark and obj['LastModified'] <= watermark) or obj['Key'] in done_files:
+                    continue
+                files += 1
+                size += obj['Size']
+        if files:
+            plan.append({"partition": partition, "files": files, "bytes": size})
+    
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "current_month": current_month,
+        "partitions": plan,
+        "total_files": sum(p["files"] for p in plan),
+        "total_bytes": sum(p["bytes"] for p in plan),
+    }
+
 # --- HANDLER PRINCIPAL ---
 def lambda_handler(event, context):
     ec2 = boto3.client('ec2')
@@ -37,7 +133,42 @@ def lambda_handler(event, context):
         }
     
     try:
-        if action == 'stop':
+        if action == 'hibernate':
+            # Mantém o osrm-routed e o mapa em RAM entre as execuções (o START seguinte retoma em vez de dar boot)
+            current_state = get_instance_status(ec2, instance_id)
+            
+            if current_state == 'stopped':
+                print(f"Instância {instance_id} já está parada. Nenhuma ação necessária.")
+            elif current_state == 'stopping':
+                print(f"Instância {instance_id} já está parando (hibernação pedida pela própria VM?). Aguardando.")
+                waiter = ec2.get_waiter('instance_stopped')
+                waiter.wait(InstanceIds=[instance_id], WaiterConfig={'Delay': 15, 'MaxAttempts': 40})
+            else:
+                hibernate = hibernation_configured(ec2, instance_id)
+                if not hibernate:
+                    print(f"AVISO: Instância {instance_id} sem hibernação habilitada. Fazendo STOP normal.")
+                elif not self_hibernation_pending(boto3.client('s3')):
+                    # Execução falhou, foi drenada ou ainda roda: só um boot normal dispara o @reboot no próximo START
+                    hibernate = False
+                    print(f"Instância {instance_id} não se auto-hibernou (sem marcador). Fazendo STOP normal.")
+                print(f"Instância {instance_id} em estado {current_state}. Tentando {'HIBERNAR' if hibernate else 'PARAR'}.")
+                ec2.stop_instances(InstanceIds=[instance_id], Hibernate=hibernate)
+                
+                # A gravação da RAM no EBS demora mais que um stop normal
+                waiter = ec2.get_waiter('instance_stopped')
+                print("Aguardando status 'stopped' (máximo 10 minutos)...")
+                waiter.wait(
+                    InstanceIds=[instance_id],
+                    WaiterConfig={'Delay': 15, 'MaxAttempts': 40} # ~10 minutos
+                )
+                print("Sucesso! Instância confirmada como parada.")
+            
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': f'Instância {instance_id} hibernada/parada e status verificado com sucesso.'})
+            }
+        
+        elif action == 'stop':
             # === ALTERAÇÃO 2: Verificar e Esperar o Stop ===
             
             # Garante que a instância está ou será desligada
@@ -71,6 +202,31 @@ def lambda_handler(event, context):
             }
         
         else: # action == 'start'
+            # Backlog: sem arquivo novo, a VM nem sobe; com trabalho, a estimativa vai para o S3 (run_plan.json)
+            # e o pipeline dimensiona a execução por ela. Falha na checagem não impede o START
+            if BACKLOG_CHECK and not event.get('force', False):
+                s3 = boto3.client('s3')
+                try:
+                    run_plan = estimate_backlog(s3)
+                except Exception as e:
+                    run_plan = None
+                    print(f"AVISO: Checagem de backlog falhou ({e}). Iniciando mesmo assim.")
+                
+                if run_plan is not None:
+                    print(f"Backlog: {run_plan['total_files']} arquivo(s), {run_plan['total_bytes'] / 1024**2:.1f}MB "
+                          f"em {[p['partition'] for p in run_plan['partitions']]}")
+                    if not run_plan['total_files']:
+                        print(f"Nenhum arquivo novo desde o bookmark. Instância {instance_id} não será iniciada.")
+                        return {
+                            'statusCode': 200,
+                            'body': json.dumps({'message': 'Sem backlog: START ignorado.', 'skipped': True})
+                        }
+                    try:
+                        s3.put_object(Bucket=CONTROL_BUCKET, Key=RUN_PLAN_KEY, Body=json.dumps(run_plan, indent=2),
+                                      ContentType='application/json')
+                    except Exception as e:
+                        print(f"AVISO: run_plan.json não gravado ({e}). A VM roda sem a estimativa.")
+            
             # === ALTERAÇÃO 1: Verificar e Parar antes de Iniciar ===
             current_state = get_instance_status(ec2, instance_id)
 
@@ -95,20 +251,29 @@ def lambda_handler(event, context):
                 }
 
             
-            # Executa o START
-            print(f"Tentando INICIAR instância: {instance_id}")
+            # Executa o START (numa instância hibernada, retoma com o OSRM já em memória)
+            resumed = current_state == 'stopped' and is_hibernated(ec2, instance_id)
+            orphan_resume = resumed and not self_hibernation_pending(boto3.client('s3'))
+            print(f"Tentando {'RETOMAR (hibernada)' if resumed else 'INICIAR'} instância: {instance_id}")
             response = ec2.start_instances(InstanceIds=[instance_id])
             
             # Opcional: Esperar até que esteja rodando (para evitar que o EventBridge dispare a próxima regra antes)
             waiter = ec2.get_waiter('instance_running')
             waiter.wait(InstanceIds=[instance_id])
             
+            # Hibernada sem o script esperando a retomada (ex.: hibernação manual): reinicia para o @reboot rodar
+            if orphan_resume:
+                print(f"AVISO: Instância {instance_id} hibernada sem marcador de auto-hibernação. Reiniciando.")
+                ec2.reboot_instances(InstanceIds=[instance_id])
+                resumed = False
+            
             print(f"Sucesso! Instância {instance_id} iniciada e status verificado.")
             
             return {
                 'statusCode': 200,
                 'body': json.dumps({
                     'message': f'Instância {instance_id} iniciada com sucesso e status verificado',
+                    'resumed': resumed,
                     'startingInstances': response['StartingInstances']
                 })
             }
@@ -0,0 +1,115 @@
+# autotune.py - Calibração de NUM_PROCESSES / MAX_CONCURRENT na partida do pipeline
+
+import itertools
+import json
+import logging
+import os
+import timeit
+from datetime import datetime
+
+from config import SETUP
+from drain import DRAIN
+from metrics import METRICS, RunMetrics
+from processing import parallel_osrm_requests, get_instance_type, get_map_version
+
+
+def _cache_key() -> str:
+    return f"{get_instance_type()}|{get_map_version()}"
+
+def _read_cache() -> dict:
+    try:
+        with open(SETUP["AUTOTUNE_CACHE_PATH"]) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _write_cache(key: str, choice: dict):
+    cache = _read_cache()
+    cache[key] = choice
+    tmp_path = f"{SETUP['AUTOTUNE_CACHE_PATH']}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, SETUP["AUTOTUNE_CACHE_PATH"])
+
+def _apply(choice: dict, source: str):
+    SETUP["NUM_PROCESSES"] = choice["NUM_PROCESSES"]
+    SETUP["MAX_CONCURRENT"] = choice["MAX_CONCURRENT"]
+    METRICS.incr(f"autotune_{source}")
+    logging.info(f"🎛️  Tuning ({source}): NUM_PROCESSES={choice['NUM_PROCESSES']}, "
+                 f"MAX_CONCURRENT={choice['MAX_CONCURRENT']} "
+                 f"({choice.get('throughput_rps', 0):.0f} req/s, p95 {choice.get('p95_ms', 0):.0f}ms)")
+
+
+def load_cached_tuning() -> bool:
+    """Aplica a escolha em cache para esta instância/mapa. Retorna False se for preciso calibrar."""
+    if not SETUP["AUTOTUNE"]:
+        return True
+    choice = _read_cache().get(_cache_key())
+    if choice:
+        _apply(choice, "cache")
+        return True
+    return False
+
+
+def calibrate(points: list, failures: list = None, progress=None, budget=None) -> tuple:
+    """Varre AUTOTUNE_GRID no próprio bloco e aplica a combinação de maior vazão com p95 dentro do limite.
+
+    Cada combinação roteia uma fatia diferente de `points` (AUTOTUNE_TRIAL_ROWS linhas), então nada do que a
+    calibração roteia é descartado. Com drenagem ou sem prazo (`budget`) a varredura para, nada é aplicado nem
+    gravado em cache, e o resto do bloco segue com o tuning atual.
+    Retorna (resultados das fatias roteadas, nº de linhas de `points` consumidas, calibração concluída).
+    """
+    grid = SETUP["AUTOTUNE_GRID"]
+    combinations = list(itertools.product(grid["NUM_PROCESSES"], grid["MAX_CONCURRENT"]))
+    trial_rows = min(SETUP["AUTOTUNE_TRIAL_ROWS"], len(points) // len(combinations))
+    if trial_rows < SETUP["AUTOTUNE_MIN_TRIAL_ROWS"]:
+        logging.info(f"🎛️  Bloco com {len(points):,} linhas não basta para calibrar; fica para o próximo.")
+        return [], 0, False
+    logging.info(f"🎛️  Calibrando concorrência em {trial_rows:,} linhas reais por combinação "
+                 f"({len(combinations)} combinações)...")
+
+    outputs, results, consumed = [], [], 0
+    with METRICS.timer("autotune"):
+        for num_processes, max_concurrent in combinations:
+            if DRAIN.requested or (budget is not None and not budget.has_time_for_block()):
+                break
+            trial = points[consumed:consumed + trial_rows]
+            consumed += len(trial)
+            trial_metrics = RunMetrics()
+            start = timeit.default_timer()
+            outputs += parallel_osrm_requests(trial, num_processes=num_processes, max_concurrent=max_concurrent,
+                                              progress=progress, metrics=trial_metrics, failures=failures)
+            elapsed = timeit.default_timer() - start
+            METRICS.merge(trial_metrics.snapshot())
+            if DRAIN.requested:
+                # Combinação cortada pela drenagem: a medida não vale
+                break
+            latency = trial_metrics.histograms["osrm_request_ms"]
+            result = {
+                "NUM_PROCESSES": num_processes, "MAX_CONCURRENT": max_concurrent,
+                "throughput_rps": trial_rows / elapsed, "p95_ms": latency.percentile(95),
+            }
+            results.append(result)
+            logging.info(f"   p={num_processes:>3} c={max_concurrent:>3}: "
+                         f"{result['throughput_rps']:,.0f} req/s, p95 {result['p95_ms']:.0f}ms")
+
+    if len(results) < len(combinations):
+        logging.warning(f"⚠️  Calibração interrompida ({len(results)}/{len(combinations)} combinações): "
+                        f"tuning atual mantido, sem cache.")
+        METRICS.incr("autotune_aborted")
+        return outputs, consumed, False
+
+    within_bound = [r for r in results if r["p95_ms"] <= SETUP["AUTOTUNE_P95_BOUND_MS"]]
+    if within_bound:
+        choice = max(within_bound, key=lambda r: r["throughput_rps"])
+    else:
+        logging.warning(f"⚠️  Nenhuma combinação com p95 <= {SETUP['AUTOTUNE_P95_BOUND_MS']}ms; usando a de menor p95.")
+        choice = min(results, key=lambda r: r["p95_ms"])
+
+    choice = {**choice, "tuned_at": datetime.now().isoformat(), "trial_rows": trial_rows, "trials": results}
+    try:
+        _write_cache(_cache_key(), choice)
+    except Exception as e:
+        logging.warning(f"⚠️  Falha ao gravar cache de tuning: {e}")
+    _apply(choice, "calibrated")
+    return outputs, consumed, True
@@ -0,0 +1,203 @@
+# backends.py - Balanceamento client-side entre vários osrm-routed (least-outstanding + health check)
+
+import asyncio
+import logging
+import time
+
+import aiohttp
+import osrm
+
+from config import SETUP
+from failures import classify_failure, CONNECTION
+from hedging import HedgePolicy
+
+
+def new_client(host: str) -> osrm.AioHTTPClient:
+    """Cliente osrm-py sem retry interno: tentativas e backoff seguem failures.RETRY_POLICY.
+
+    O timeout do cliente fica acima de OSRM_REQUEST_TIMEOUT_S para o `wait_for` de `_attempt` disparar
+    antes (o cliente dorme um backoff antes de levantar o próprio timeout).
+    """
+    return osrm.AioHTTPClient(host=host, max_retries=1, timeout=SETUP["OSRM_REQUEST_TIMEOUT_S"] + 1)
+
+
+class Backend:
+    """Um osrm-routed: cliente HTTP próprio, requisições em aberto e estado de saúde."""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.client = None
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return self.ejected_until <= time.monotonic()
+
+    def __repr__(self):
+        return f"Backend({self.host}, outstanding={self.outstanding})"
+
+
+class BackendPool:
+    """Distribui requisições pelo backend saudável com menos requisições em aberto.
+
+    Um backend com OSRM_EJECT_AFTER falhas de conexão seguidas sai do rodízio por
+    OSRM_EJECT_SECONDS; o health check em segundo plano o readmite quando /status responder.
+    """
+
+    def __init__(self, hosts: list = None, eject_after: int = None, eject_seconds: float = None):
+        self.backends = [Backend(h) for h in (hosts or SETUP["OSRM_HOSTS"])]
+        self.eject_after = eject_after or SETUP["OSRM_EJECT_AFTER"]
+        self.eject_seconds = eject_seconds or SETUP["OSRM_EJECT_SECONDS"]
+        self._health_task = None
+        self._retired_clients = []
+
+    @property
+    def available(self) -> bool:
+        return any(b.healthy for b in self.backends)
+
+    async def open(self):
+        for backend in self.backends:
+            backend.client = new_client(backend.host)
+        if len(self.backends) > 1:
+            self._health_task = asyncio.create_task(self._health_loop())
+        return self
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+        for client in [b.client for b in self.backends if b.client] + self._retired_clients:
+            await client.close()
+
+    def acquire(self, exclude: Backend = None) -> Backend:
+        """Escolhe o backend saudável com menos requisições em aberto (`exclude` evita repetir o anterior)."""
+        candidates = [b for b in self.backends if b.healthy and b is not exclude]
+        if not candidates:
+            candidates = [b for b in self.backends if b.healthy] or \
+                         [min(self.backends, key=lambda b: b.ejected_until)]
+        backend = min(candidates, key=lambda b: b.outstanding)
+        backend.outstanding += 1
+        return backend
+
+    def release(self, backend: Backend, ok: bool = True, connection_error: bool = False):
+        backend.outstanding -= 1
+        if ok:
+            backend.consecutive_failures = 0
+        elif connection_error:
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.eject_after and backend.healthy:
+                backend.ejected_until = time.monotonic() + self.eject_seconds
+                logging.warning(f"⚠️  Backend {backend.host} removido do rodízio por {self.eject_seconds}s "
+                                f"({backend.consecutive_failures} falhas de conexão seguidas)")
+
+    def reconnect(self, backend: Backend):
+        """Recria a sessão HTTP de um backend após desconexão.
+
+        A sessão antiga só é fechada em close(): outras requisições ainda podem estar nela.
+        """
+        self._retired_clients.append(backend.client)
+        backend.client = new_client(backend.host)
+
+    async def _attempt(self, backend: Backend, coordinates: list, **route_kwargs):
+        """Uma chamada /route num backend. Em erro, anota o backend na exceção (`osrm_backend`)."""
+        ok, connection_error = False, False
+        try:
+            response = await asyncio.wait_for(
+                backend.client.route(coordinates=coordinates, overview=osrm.overview.false, **route_kwargs),
+                timeout=SETUP["OSRM_REQUEST_TIMEOUT_S"])
+            ok = True
+            return response
+        except asyncio.CancelledError:
+            ok = True  # perdeu a corrida para o hedge: não é falha do backend
+            raise
+        except Exception as e:
+            connection_error = classify_failure(e) == CONNECTION
+            e.osrm_backend = backend
+            if isinstance(e, aiohttp.ServerDisconnectedError):
+                self.reconnect(backend)
+            raise
+        finally:
+            self.release(backend, ok=ok, connection_error=connection_error)
+
+    async def route(self, coordinates: list, hedge: HedgePolicy = None, avoid: Backend = None, **route_kwargs):
+        """Roteia num backend; com `hedge`, duplica a requisição que passar do p95 e fica com a primeira resposta."""
+        primary = self.acquire(exclude=avoid)
+        if hedge is not None:
+            hedge.record_request()
+        delay = hedge.delay_s() if hedge is not None else None
+        if delay is None:
+            return await self._attempt(primary, coordinates, **route_kwargs)
+
+        tasks = [asyncio.ensure_future(self._attempt(primary, coordinates, **route_kwargs))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not hedge.try_fire():
+                return await tasks[0]
+
+            secondary = self.acquire(exclude=primary)
+            tasks.append(asyncio.ensure_future(self._attempt(secondary, coordinates, **route_kwargs)))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is tasks[1]:
+                            hedge.record_win()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def probe(self, backend: Backend) -> bool:
+        try:
+            async with backend.client.session.get(f"{backend.host}/status", timeout=2) as response:
+                return response.status == 200
+        except Exception:
+            return False
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(SETUP["OSRM_HEALTH_INTERVAL_SECONDS"])
+            for backend in self.backends:
+                if backend.ejected_until and await self.probe(backend):
+                    if not backend.healthy:
+                        logging.info(f"✅ Backend {backend.host} respondeu ao health check. Readmitido.")
+                    backend.ejected_until = 0.0
+                    backend.consecutive_failures = 0
+
+
+class ShardRouter:
+    """Escolhe o pool de backends de cada linha: shard regional (`_shard`) ou instância nacional.
+
+    Um shard sem backend saudável cai para a instância nacional, que atende também os pares entre shards.
+    """
+
+    def __init__(self, shard_hosts: dict = None):
+        self.national = BackendPool()
+        self.shards = {name: BackendPool(hosts) for name, hosts in (shard_hosts or {}).items()}
+
+    async def open(self):
+        for pool in [self.national, *self.shards.values()]:
+            await pool.open()
+        return self
+
+    async def close(self):
+        for pool in [self.national, *self.shards.values()]:
+            await pool.close()
+
+    def reset_health(self):
+        """Readmite todos os backends (ex.: depois que o circuit breaker confirmou a volta do OSRM)."""
+        for pool in [self.national, *self.shards.values()]:
+            for backend in pool.backends:
+                backend.ejected_until = 0.0
+                backend.consecutive_failures = 0
+
+    def pool_for(self, shard: str = None, fallback: bool = False) -> BackendPool:
+        pool = self.shards.get(shard) if shard else None
+        if pool is None or fallback or not pool.available:
+            return self.national
+        return pool
@@ -0,0 +1,66 @@
+# benchmark_routing.py - Compara variantes de despacho ao OSRM numa amostra real
+#
+# Uso (na instância, com o osrm-routed no ar):
+#   python benchmark_routing.py amostra.parquet --rows 200000
+#   python benchmark_routing.py amostra.parquet --backends http,libosrm   (libosrm: mapa no osrm-datastore)
+
+import argparse
+import logging
+import timeit
+
+import pandas as pd
+
+from config import SETUP
+from geo import sort_spatially
+from metrics import RunMetrics
+from processing import parallel_osrm_requests, parse_df, make_list_of_coords
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def run_variant(name: str, df: pd.DataFrame, num_processes: int, max_concurrent: int, backend: str = "http") -> dict:
+    """Roteia `df` uma vez pelo motor `backend` e devolve vazão e percentis de latência por requisição."""
+    SETUP["ROUTING_BACKEND"] = backend
+    points = make_list_of_coords(df)
+    metrics = RunMetrics()
+    start = timeit.default_timer()
+    output = parallel_osrm_requests(points, num_processes=num_processes, max_concurrent=max_concurrent,
+                                    metrics=metrics)
+    elapsed = timeit.default_timer() - start
+    latency = metrics.histograms["osrm_request_ms"].summary()
+    return {
+        "variant": name, "backend": backend, "rows": len(points), "routed": len(output), "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(points) / elapsed, 1),
+        "p50_ms": latency.get("p50_ms"), "p95_ms": latency.get("p95_ms"), "p99_ms": latency.get("p99_ms"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de despacho ao OSRM")
+    parser.add_argument("parquet", help="Arquivo parquet de entrada (mesmo schema do datalake)")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--processes", type=int, default=SETUP["NUM_PROCESSES"])
+    parser.add_argument("--concurrent", type=int, default=SETUP["MAX_CONCURRENT"])
+    parser.add_argument("--backends", default="http", help="Motores a comparar, separados por vírgula (http,libosrm)")
+    parser.add_argument("--repeat", type=int, default=2, help="Rodadas por variante (a primeira aquece o cache)")
+    args = parser.parse_args()
+
+    df = parse_df(pd.read_parquet(args.parquet).head(args.rows))
+    df = df.dropna(subset=SETUP["start_coordinates"] + SETUP["end_coordinates"])
+    variants = {
+        "ordem_do_arquivo": df,
+        "hilbert": sort_spatially(df),
+    }
+
+    results = []
+    for _ in range(args.repeat):
+        for backend in args.backends.split(","):
+            for name, variant_df in variants.items():
+                results.append(run_variant(name, variant_df, args.processes, args.concurrent, backend))
+                logging.info(f"📊 {results[-1]}")
+
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# boot.py - Partida do pipeline em paralelo com o carregamento do osrm-routed
+
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+
+from config import SOURCE_BUCKET, DESTINATION_BUCKET, SETUP
+from metrics import METRICS
+from s3_io import get_processed_bookmark, get_run_plan, list_s3_partitions, list_s3_objects, download_partition_file
+from tracing import stage
+from work_plan import plan_partitions, select_new_files, last_processed_timestamp, partition_checkpoint
+
+
+class OSRMNotReadyError(RuntimeError):
+    """O osrm-routed não respondeu /status dentro de BOOT_OSRM_TIMEOUT_SECONDS (ou o container está em restart)."""
+
+
+class BootCoordinator:
+    """Faz o trabalho de S3 da partida enquanto o osrm-routed ainda carrega o mapa.
+
+    Em threads: listagem das partições, leitura do bookmark e da estimativa de backlog da Lambda e, com a fila
+    montada, listagem da primeira partição e download/leitura do primeiro arquivo. Em paralelo, uma thread
+    consulta /status de todos os hosts a cada BOOT_POLL_INTERVAL_SECONDS e marca o OSRM como pronto no
+    primeiro 200 de todos.
+    O `run_pipeline` só bloqueia em `wait_osrm()`, imediatamente antes do primeiro roteamento.
+    """
+
+    def __init__(self, current_month_partition: str, hosts: list = None, containers: list = None):
+        self.current_month_partition = current_month_partition
+        self.hosts = hosts or SETUP["OSRM_HOSTS"] + [h for hs in SETUP["OSRM_SHARD_HOSTS"].values() for h in hs]
+        self.containers = SETUP["OSRM_CONTAINERS"] if containers is None else containers
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="boot")
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._error = None
+        self._started_at = time.monotonic()
+        self._prefetched = {}
+        self._listings = {}
+        self._lock = threading.Lock()
+        self._first_route_marked = False
+
+    def start(self):
+        self._partitions = self._executor.submit(self._list_partitions)
+        self._bookmark = self._executor.submit(self._read_bookmark)
+        self._run_plan = self._executor.submit(get_run_plan, DESTINATION_BUCKET, SETUP["run_plan_s3_key"],
+                                               SETUP["RUN_PLAN_MAX_AGE_HOURS"])
+        self._prefetch = self._executor.submit(self._prefetch_first_file)
+        threading.Thread(target=self._poll_osrm, name="boot-osrm-ready", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        # Arquivo pré-buscado que o loop não pegou (fila mudou, modo daemon/distribuído): não fica no disco
+        with self._lock:
+            unclaimed, self._prefetched = list(self._prefetched), {}
+        for file_key in unclaimed:
+            self._discard(file_key)
+
+    @staticmethod
+    def _discard(file_key: str):
+        try:
+            os.remove(os.path.basename(file_key))
+        except FileNotFoundError:
+            pass
+
+    # --- S3 ---
+
+    def _list_partitions(self):
+        with stage("list_partitions"):
+            return list_s3_partitions(SOURCE_BUCKET, SETUP["input_s3_base_prefix"])
+
+    def _read_bookmark(self):
+        with stage("bookmark_read"):
+            return get_processed_bookmark(DESTINATION_BUCKET, SETUP["bookmark_s3_key"])
+
+    def plan(self):
+        """(partições disponíveis, bookmark) - bloqueia só o que faltar da listagem/leitura."""
+        return self._partitions.result(), self._bookmark.result()
+
+    def run_plan(self):
+        """Estimativa de backlog da Lambda ({"total_files", "total_bytes", "partitions": [...]}) ou None."""
+        return self._run_plan.result()
+
+    def _prefetch_first_file(self):
+        # No modo distribuído o worker pega unidades por lease e baixa por conta própria
+        if SETUP["DISTRIBUTED"]:
+            return
+        try:
+            available_partitions, bookmark = self.plan()
+            partitions = plan_partitions(available_partitions, bookmark, self.current_month_partition, verbose=False)
+            if not partitions or self._stop.is_set():
+                return
+            partition = partitions[0]
+            input_key = os.path.join(SETUP["input_s3_base_prefix"], partition)
+            with stage("list_files"):
+                listing = list_s3_objects(SOURCE_BUCKET, input_key)
+            with self._lock:
+                self._listings[partition] = listing
+            files = select_new_files(listing, last_processed_timestamp(bookmark, partition),
+                                     partition_checkpoint(bookmark, partition).get("done_files", []))
+            if not files or self._stop.is_set():
+                return
+            file_key = files[0]['Key']
+            local_file_path = os.path.basename(file_key)
+            with stage("download", file=local_file_path):
+                if not download_partition_file(SOURCE_BUCKET, file_key, local_file_path):
+                    return
+            with stage("read_parquet"):
+                df_full = pd.read_parquet(local_file_path)
+                df_full = df_full.drop_duplicates(subset=['order_number'], keep='first')
+            with self._lock:
+                if self._stop.is_set():
+                    self._discard(file_key)
+                    return
+                self._prefetched[file_key] = df_full
+            logging.info(f"📥 Primeiro arquivo pronto durante a partida: {local_file_path} ({len(df_full):,} linhas)")
+        except Exception as e:
+            # O loop principal refaz o que faltar pelo caminho normal
+            logging.warning(f"⚠️  Pré-busca da partida falhou: {e}")
+
+    def listing_for(self, partition: str):
+        """Listagem de arquivos já feita na partida (None se a partição não foi pré-buscada)."""
+        self._prefetch.result()
+        with self._lock:
+            return self._listings.pop(partition, None)
+
+    def take_file(self, file_key: str):
+        """DataFrame do arquivo já baixado e lido na partida (None se não foi pré-buscado)."""
+        self._prefetch.result()
+        with self._lock:
+            return self._prefetched.pop(file_key, None)
+
+    def peek_file(self):
+        """DataFrame pré-buscado sem retirá-lo da fila (amostra para o aquecimento; None se não houver)."""
+        self._prefetch.result()
+        with self._lock:
+            return next(iter(self._prefetched.values()), None)
+
+    # --- OSRM ---
+
+    def _container_restarting(self) -> str:
+        for name in self.containers:
+            try:
+                state = subprocess.run(['sudo', 'docker', 'inspect', '-f', '{{.State.Status}}', name],
+                                       capture_output=True, text=True, timeout=5).stdout.strip()
+            except Exception:
+                continue
+            if state == "restarting":
+                return name
+        return None
+
+    def _poll_osrm(self):
+        last_container_check = 0.0
+        while not self._stop.is_set():
+            pending = [h for h in self.hosts if not self._status_ok(h)]
+            elapsed = time.monotonic() - self._started_at
+            if not pending:
+                METRICS.add_time("boot_osrm_load", elapsed)
+                logging.info(f"✅ Servidor OSRM está pronto ({elapsed:.1f}s após a partida do Python).")
+                self._ready.set()
+                return
+            if time.monotonic() - last_container_check >= 5:
+                last_container_check = time.monotonic()
+                restarting = self._container_restarting()
+                if restarting:
+                    self._error = OSRMNotReadyError(f"container {restarting} em estado 'restarting'")
+                    self._ready.set()
+                    return
+            if elapsed > SETUP["BOOT_OSRM_TIMEOUT_SECONDS"]:
+                self._error = OSRMNotReadyError(f"sem resposta de /status após {elapsed:.0f}s: {pending}")
+                self._ready.set()
+                return
+            self._stop.wait(SETUP["BOOT_POLL_INTERVAL_SECONDS"])
+
+    @staticmethod
+    def _status_ok(host: str) -> bool:
+        try:
+            return requests.get(f"{host}/status", timeout=1).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def mark_first_route(self):
+        """Registra, uma vez por execução, o tempo do boot da VM (ou da retomada da hibernação) até a 1ª rota."""
+        if self._first_route_marked or not SETUP["BOOT_EPOCH"]:
+            return
+        self._first_route_marked = True
+        elapsed = time.time() - SETUP["BOOT_EPOCH"]
+        METRICS.add_time("boot_to_first_route", elapsed)
+        METRICS.incr(f"boot_{SETUP['BOOT_KIND']}")
+        logging.info(f"⏱️  Boot → primeira rota: {elapsed:.1f}s (partida: {SETUP['BOOT_KIND']})")
+
+    def wait_osrm(self):
+        """Bloqueia até todos os hosts responderem /status. Levanta OSRMNotReadyError em timeout/restart."""
+        if not self._ready.is_set():
+            logging.info(f"⏳ Aguardando o(s) servidor(es) OSRM: {','.join(self.hosts)}...")
+        with stage("wait_osrm"):
+            self._ready.wait()
+        if self._error:
+            raise self._error
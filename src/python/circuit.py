@@ -0,0 +1,101 @@
+# circuit.py - Circuit breaker compartilhado entre os workers para quedas do osrm-routed
+
+import asyncio
+import logging
+import threading
+import time
+from multiprocessing.sharedctypes import RawValue
+
+import requests
+
+from config import SETUP
+from metrics import METRICS
+
+
+class OSRMUnavailableError(RuntimeError):
+    """O OSRM não voltou dentro de CIRCUIT_MAX_OPEN_SECONDS; o bloco não pode ser concluído."""
+
+
+class SharedCircuit:
+    """Estado do circuito em memória compartilhada (passado aos workers pelo initializer do Pool).
+
+    CLOSED: despacho normal. OPEN: queda detectada, todos os workers seguram as requisições.
+    FAILED: o OSRM não voltou a tempo; os workers desistem e o pai aborta o bloco.
+    """
+
+    CLOSED, OPEN, FAILED = 0, 1, 2
+
+    def __init__(self):
+        self._state = RawValue('i', self.CLOSED)
+        self._opened_at = RawValue('d', 0.0)
+
+    @property
+    def state(self) -> int:
+        return self._state.value
+
+    @property
+    def is_open(self) -> bool:
+        return self._state.value == self.OPEN
+
+    @property
+    def opened_at(self) -> float:
+        return self._opened_at.value
+
+    def trip(self, reason: str):
+        if self._state.value == self.CLOSED:
+            self._opened_at.value = time.time()
+            self._state.value = self.OPEN
+            logging.warning(f"🔌 Circuito ABERTO: {reason}. Despacho pausado até o OSRM responder /status.")
+
+    def close(self):
+        self._state.value = self.CLOSED
+
+    def fail(self):
+        self._state.value = self.FAILED
+
+    async def wait_closed(self, poll_s: float = 0.5) -> bool:
+        """Segura a coroutine enquanto o circuito estiver aberto. False se o circuito falhou de vez."""
+        while self._state.value == self.OPEN:
+            await asyncio.sleep(poll_s)
+        return self._state.value == self.CLOSED
+
+
+class CircuitMonitor:
+    """Thread do processo pai: enquanto o circuito está aberto, testa /status até o OSRM voltar."""
+
+    def __init__(self, circuit: SharedCircuit, hosts: list = None):
+        self.circuit = circuit
+        self.hosts = hosts or SETUP["OSRM_HOSTS"]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="circuit-monitor", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _probe(self) -> bool:
+        for host in self.hosts:
+            try:
+                if requests.get(f"{host}/status", timeout=2).status_code == 200:
+                    return True
+            except requests.exceptions.RequestException:
+                pass
+        return False
+
+    def _run(self):
+        while not self._stop.wait(SETUP["CIRCUIT_PROBE_INTERVAL_SECONDS"]):
+            if not self.circuit.is_open:
+                continue
+            open_s = time.time() - self.circuit.opened_at
+            if self._probe():
+                self.circuit.close()
+                METRICS.incr("circuit_trips")
+                METRICS.add_time("circuit_open", open_s)
+                logging.info(f"✅ Circuito FECHADO: OSRM respondeu /status após {open_s:.0f}s. Retomando o bloco.")
+            elif open_s > SETUP["CIRCUIT_MAX_OPEN_SECONDS"]:
+                self.circuit.fail()
+                logging.error(f"❌ OSRM fora do ar há {open_s:.0f}s. Desistindo do bloco.")
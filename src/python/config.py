@@ -12,6 +12,10 @@ SETUP = {
     "input_s3_base_prefix": 'data_mesh/vw_antifraud_fact_distances',
     "output_s3_base_prefix": 'osrm_distance/osrm_landing',
     "bookmark_s3_key": 'osrm_distance/control/bookmark.json',
+    "run_plan_s3_key": 'osrm_distance/control/run_plan.json',
+    "unroutable_s3_base_prefix": 'osrm_distance/osrm_unroutable',
+    "metrics_s3_success_prefix": 'osrm_distance/osrm_success',
+    "metrics_s3_failed_prefix": 'osrm_distance/osrm_failed',
     "LOCAL_TEMP_DIR": '/home/ubuntu/osrm_temp_parts',
     "start_coordinates": ["poc_longitude", "poc_latitude"],
     "end_coordinates": ["order_longitude", "order_latitude"],
@@ -21,6 +25,137 @@ SETUP = {
     "MAX_CONCURRENT": 30,
     "BLOCK_SIZE": 1_500_000,
     "skip_download": False,
+    # Status ao vivo: arquivo reescrito a cada STATUS_INTERVAL_SECONDS (None desativa) e porta HTTP opcional
+    "STATUS_FILE": os.environ.get("OSRM_STATUS_FILE", 'osrm_status.json'),
+    "STATUS_HTTP_PORT": int(os.environ.get("OSRM_STATUS_PORT", 0)) or None,
+    "STATUS_INTERVAL_SECONDS": 5,
+    # Trace Chrome/Perfetto da execução (opt-in)
+    "TRACE_ENABLED": os.environ.get("OSRM_TRACE", "0") == "1",
+    "TRACE_DIR": '/home/ubuntu/osrm_traces',
+    # Profiling por etapa: parse_df, batch_request, dataframe_build, consolidation_dedupe
+    # (ex.: OSRM_PROFILE_STAGES=parse_df,batch_request)
+    "PROFILE_STAGES": [s for s in os.environ.get("OSRM_PROFILE_STAGES", "").split(",") if s],
+    "PROFILE_DIR": os.environ.get("OSRM_PROFILE_DIR", "/home/ubuntu/osrm_profiles"),
+    "PROFILE_MAX_REPORTS": 3,
+    # Arquivos do mapa servidos pelo osrm-routed (versão do mapa = fingerprint destes arquivos)
+    "OSRM_MAP_DIR": '/home/ubuntu/osrm-brazil-files',
+    # Partida: /status consultado a cada BOOT_POLL_INTERVAL_SECONDS enquanto listagem/bookmark/1º arquivo correm em paralelo.
+    # OSRM_CONTAINERS (exportado pelo osrm_run.sh) permite abortar cedo se um container entrar em 'restarting'
+    "BOOT_POLL_INTERVAL_SECONDS": 0.2,
+    "BOOT_OSRM_TIMEOUT_SECONDS": 300,
+    "OSRM_CONTAINERS": [c for c in os.environ.get("OSRM_CONTAINERS", "").split(",") if c],
+    # Fim da execução: "stop" (o Python desliga a VM) ou "hibernate" (o osrm_run.sh hiberna a VM depois do dedupe
+    # e, na retomada, roda de novo com o osrm-routed ainda em memória). OSRM_BOOT_EPOCH/OSRM_BOOT_KIND vêm do
+    # osrm_run.sh e alimentam o timer boot_to_first_route (partida a frio x retomada)
+    "SHUTDOWN_MODE": os.environ.get("OSRM_SHUTDOWN_MODE", "stop"),
+    "BOOT_EPOCH": float(os.environ.get("OSRM_BOOT_EPOCH", "0")),
+    "BOOT_KIND": os.environ.get("OSRM_BOOT_KIND", "cold"),
+    # Aquecimento antes do roteamento cronometrado: leitura paralela dos arquivos do mapa (dispensável com
+    # osrm-datastore, que já carrega tudo em RAM) e rodadas de requisições espalhadas até o p95 estabilizar
+    "WARMUP": os.environ.get("OSRM_WARMUP", "1") == "1",
+    "WARMUP_PRELOAD_FILES": os.environ.get("OSRM_WARMUP_PRELOAD", "1") == "1",
+    "WARMUP_ROUND_SIZE": 2_000,
+    "WARMUP_MAX_ROUNDS": 10,
+    "WARMUP_STEADY_ROUNDS": 2,
+    "WARMUP_STEADY_TOLERANCE": 0.15,
+    "WARMUP_MIN_OK_RATIO": 0.5,
+    # Estimativa de backlog gravada pela Lambda antes do START (ignorada se mais velha que RUN_PLAN_MAX_AGE_HOURS,
+    # ex.: VM ligada à mão). Backlog abaixo de RUN_PLAN_SMALL_MB não compensa o aquecimento
+    "RUN_PLAN_MAX_AGE_HOURS": 2,
+    "RUN_PLAN_SMALL_MB": 5,
+    # Prazo da execução em lote, contado do boot/retomada da VM (a Lambda para a VM 30 min após o start; 0 desliga).
+    # Blocos novos só começam se couberem antes de prazo - margem; o restante fica em checkpoint no bookmark
+    "RUN_DEADLINE_MINUTES": float(os.environ.get("OSRM_RUN_DEADLINE_MINUTES", "25")),
+    "RUN_CHECKPOINT_MARGIN_MINUTES": 4,
+    # Modo daemon (OSRM_DAEMON=1): depois da fila normal, segue rodando e roteia cada arquivo novo da source assim
+    # que chega - notificações do S3 via SQS ou, localmente, um diretório observado. Micro-lotes fecham em
+    # DAEMON_BATCH_MAX_FILES arquivos ou DAEMON_BATCH_MAX_WAIT_SECONDS após o primeiro arquivo do lote
+    "DAEMON": os.environ.get("OSRM_DAEMON", "0") == "1",
+    "DAEMON_SOURCE": os.environ.get("OSRM_DAEMON_SOURCE", "sqs"),
+    "DAEMON_SQS_QUEUE_URL": os.environ.get("OSRM_DAEMON_QUEUE_URL", ""),
+    "DAEMON_SQS_VISIBILITY_SECONDS": 900,
+    "DAEMON_WATCH_DIR": os.environ.get("OSRM_DAEMON_WATCH_DIR", "/home/ubuntu/osrm_inbox"),
+    "DAEMON_WATCH_SETTLE_SECONDS": 2,
+    "DAEMON_POLL_SECONDS": 2,
+    "DAEMON_BATCH_MAX_FILES": 20,
+    "DAEMON_BATCH_MAX_WAIT_SECONDS": 30,
+    "DAEMON_METRICS_INTERVAL_SECONDS": 300,
+    # O watermark do mês corrente gravado pelo daemon fica pelo menos isso atrás do relógio (entrega S3 → SQS fora
+    # de ordem; ver daemon_watermark)
+    "DAEMON_WATERMARK_LAG_SECONDS": 600,
+    # Modo distribuído (OSRM_DISTRIBUTED=1): o backfill histórico vira unidades (arquivo + faixa de DIST_UNIT_ROWS
+    # linhas) disputadas por lease entre várias VMs; DIST_STORE "s3" (escrita condicional no bucket de destino)
+    # ou "dir" (diretório compartilhado, vários processos na mesma máquina)
+    "DISTRIBUTED": os.environ.get("OSRM_DISTRIBUTED", "0") == "1",
+    "DIST_STORE": os.environ.get("OSRM_DIST_STORE", "s3"),
+    "DIST_S3_PREFIX": 'osrm_distance/osrm_distributed',
+    "DIST_LOCAL_DIR": os.environ.get("OSRM_DIST_DIR", "/home/ubuntu/osrm_distributed"),
+    "DIST_UNIT_ROWS": 200_000,
+    "DIST_LEASE_TTL_SECONDS": 120,
+    "DIST_IDLE_POLL_SECONDS": 15,
+    # Execução em lote reserva cada partição histórica (lease `_batch`) e pula as que o modo distribuído já pegou
+    "DIST_BATCH_GUARD": os.environ.get("OSRM_DIST_BATCH_GUARD", "1") == "1",
+    # Drenagem (drain.py): em SIGTERM ou aviso de interrupção spot, as requisições em voo têm DRAIN_GRACE_SECONDS
+    # para terminar antes de o bloco ser cortado; SPOT_NOTICE_POLL_SECONDS = 0 desliga a consulta ao aviso spot
+    "DRAIN_GRACE_SECONDS": float(os.environ.get("OSRM_DRAIN_GRACE_SECONDS", "20")),
+    "SPOT_NOTICE_POLL_SECONDS": 5,
+    # Origem dos arquivos do mapa no S3 (map_sync.py: só baixa o que falta/diverge do ETag, em faixas paralelas)
+    "MAP_S3_BUCKET": DESTINATION_BUCKET,
+    "MAP_S3_PREFIX": 'territory_osrm/osrm-brazil-files/',
+    "MAP_SYNC_WORKERS": 16,
+    "MAP_SYNC_RANGE_MB": 64,
+    # Chave SSE-C (base64) do mapa, se os objetos estiverem criptografados com chave do cliente
+    "MAP_SSE_C_KEY": os.environ.get("OSRM_MAP_SSE_C_KEY"),
+    # Auto-tuning de NUM_PROCESSES/MAX_CONCURRENT (cache por tipo de instância + versão do mapa)
+    "AUTOTUNE": os.environ.get("OSRM_AUTOTUNE", "1") == "1",
+    "AUTOTUNE_GRID": {"NUM_PROCESSES": [8, 15, 24], "MAX_CONCURRENT": [15, 30, 60]},
+    # Linhas do bloco roteadas por combinação na calibração (a saída é aproveitada); bloco menor que
+    # AUTOTUNE_MIN_TRIAL_ROWS por combinação adia a calibração para o próximo
+    "AUTOTUNE_TRIAL_ROWS": 2_000,
+    "AUTOTUNE_MIN_TRIAL_ROWS": 200,
+    "AUTOTUNE_P95_BOUND_MS": 250,
+    "AUTOTUNE_CACHE_PATH": '/home/ubuntu/osrm_autotune.json',
+    # Backends osrm-routed (OSRM_HOSTS exportado pelo osrm_run.sh), balanceados por menor nº de requisições em aberto
+    "OSRM_HOSTS": os.environ.get("OSRM_HOSTS", 'http://localhost:5000').split(","),
+    "OSRM_EJECT_AFTER": 5,
+    "OSRM_EJECT_SECONDS": 30,
+    "OSRM_HEALTH_INTERVAL_SECONDS": 5,
+    # Circuit breaker: N falhas de conexão/timeout seguidas num worker pausam todos até /status responder
+    "CIRCUIT_TRIP_AFTER": 20,
+    "CIRCUIT_PROBE_INTERVAL_SECONDS": 2,
+    "CIRCUIT_MAX_OPEN_SECONDS": 900,
+    # Erros do hot path: resumo agregado por worker a cada N segundos (com amostras), em vez de uma linha por falha
+    "ERROR_SUMMARY_INTERVAL_SECONDS": 30,
+    # Cache de hints do OSRM por POC (por versão do mapa): pula o snap da origem nas requisições seguintes
+    "HINT_CACHE": os.environ.get("OSRM_HINT_CACHE", "1") == "1",
+    "HINT_CACHE_DIR": '/home/ubuntu/osrm_hint_cache',
+    # Timeout por tentativa; retries por classe de falha em failures.RETRY_POLICY
+    "OSRM_REQUEST_TIMEOUT_S": 10,
+    # Cache negativo: pares sem rota (NoRoute/NoSegment/InvalidValue) por versão do mapa, pulados nas próximas execuções
+    "NEGATIVE_CACHE": os.environ.get("OSRM_NEGATIVE_CACHE", "1") == "1",
+    "NEGATIVE_CACHE_DIR": '/home/ubuntu/osrm_negative_cache',
+    # Motor de roteamento: "http" (osrm-routed via osrm-py) ou "libosrm" (in-process, osrm-bindings sobre o osrm-datastore)
+    "ROUTING_BACKEND": os.environ.get("OSRM_ROUTING_BACKEND", "http"),
+    "LIBOSRM_PACKAGE_DIR": os.environ.get("OSRM_LIBOSRM_PACKAGE_DIR", '/home/ubuntu/libosrm/osrm'),
+    "LIBOSRM_DATASET": os.environ.get("OSRM_DATASET", 'brazil'),
+    "LIBOSRM_STORAGE": '/home/ubuntu/osrm-brazil-files/brazil-latest.osrm',
+    "LIBOSRM_ALGORITHM": 'MLD',
+    # Hedging: duplica requisições acima do p95 dinâmico em outro backend/conexão (carga extra <= HEDGE_MAX_PCT%)
+    "HEDGE_ENABLED": os.environ.get("OSRM_HEDGE", "0") == "1",
+    "HEDGE_MAX_PCT": 5,
+    "HEDGE_MIN_SAMPLES": 200,
+    "HEDGE_MIN_DELAY_MS": 20,
+    # Validação vetorizada das coordenadas (zeradas, invertidas, fora do Brasil, POC == pedido) antes do OSRM
+    "VALIDATE_COORDINATES": os.environ.get("OSRM_VALIDATE", "1") == "1",
+    # Ordena cada bloco pela curva de Hilbert (POC, depois pedido) antes de despachar ao OSRM
+    "SPATIAL_SORT": os.environ.get("OSRM_SPATIAL_SORT", "0") == "1",
+    # Shards regionais: polígonos [{"name", "polygon": [[lon, lat], ...]}] e hosts exportados pelo osrm_run.sh
+    # (OSRM_SHARD_HOSTS="sudeste=http://localhost:5100;sul=http://localhost:5101"). Pares entre shards vão para OSRM_HOSTS.
+    "OSRM_SHARDS_FILE": os.environ.get("OSRM_SHARDS_FILE", '/home/ubuntu/osrm-brazil-files/shards/shards.json'),
+    "OSRM_SHARD_HOSTS": {
+        name: hosts.split("|")
+        for name, hosts in (item.split("=", 1) for item in os.environ.get("OSRM_SHARD_HOSTS", "").split(";") if item)
+    },
 }
 
 processing_date = datetime.now().strftime('%Y-%m-%d')
\ No newline at end of file
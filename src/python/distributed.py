@@ -0,0 +1,356 @@
+# distributed.py - Backfill distribuído: unidades de trabalho disputadas por lease em armazenamento compartilhado
+#
+# Layout (no S3 em DIST_S3_PREFIX, ou num diretório local compartilhado entre processos):
+#   plan/<partição>.json                  unidades da partição (arquivo + faixa de linhas), gravado uma única vez
+#   leases/<partição>/<unidade>.json      {"owner", "expires_at", "attempt"}: quem está com a unidade
+#   staging/<partição>/<unidade>.parquet  saída da unidade, em chave determinística (regravar é idempotente)
+#   done/<partição>/<unidade>             marcador criado depois da saída gravada
+#   done/<partição>/_partition            partição consolidada e marcada no bookmark
+#   leases/<partição>/_batch.json         partição histórica reservada pela execução em lote (fica fora do modo
+#                                         distribuído enquanto existir, mesmo devolvido: a execução retoma do checkpoint)
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass, asdict
+
+import boto3
+from botocore.exceptions import ClientError as BotoClientError
+
+from config import DESTINATION_BUCKET, SETUP
+from metrics import METRICS
+from s3_io import CONDITIONAL_WRITE_CONFLICTS
+
+PARTITION_DONE = "_partition"
+
+
+def batch_lease_key(partition: str) -> str:
+    return f"leases/{partition}/_batch.json"
+
+
+class S3Store:
+    """Objetos no S3 com escrita condicional (If-None-Match / If-Match) para criar e trocar leases."""
+
+    def __init__(self, bucket: str = DESTINATION_BUCKET, prefix: str = None):
+        self.bucket = bucket
+        self.prefix = (prefix or SETUP["DIST_S3_PREFIX"]).rstrip('/')
+        self.s3 = boto3.client('s3')
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}"
+
+    def get(self, key: str):
+        """(conteúdo, versão) ou (None, None)."""
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=self._key(key))
+        except BotoClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None, None
+            raise
+        return obj['Body'].read(), obj['ETag']
+
+    def put(self, key: str, body: bytes):
+        self.s3.put_object(Bucket=self.bucket, Key=self._key(key), Body=body)
+
+    def _conditional_put(self, key: str, body: bytes, **condition):
+        try:
+            return self.s3.put_object(Bucket=self.bucket, Key=self._key(key), Body=body, **condition)['ETag']
+        except BotoClientError as e:
+            if e.response['Error']['Code'] in CONDITIONAL_WRITE_CONFLICTS:
+                return None
+            raise
+
+    def create(self, key: str, body: bytes):
+        """Grava só se a chave não existir. Retorna a nova versão (None se já existia)."""
+        return self._conditional_put(key, body, IfNoneMatch='*')
+
+    def replace(self, key: str, body: bytes, version: str):
+        """Grava só se a chave ainda estiver na versão lida. Retorna a nova versão (None se mudou)."""
+        return self._conditional_put(key, body, IfMatch=version)
+
+    def list(self, prefix: str) -> set:
+        keys = set()
+        for page in self.s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            keys.update(obj['Key'][len(self.prefix) + 1:] for obj in page.get('Contents', []))
+        return keys
+
+    def delete(self, key: str):
+        self.s3.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+class LocalStore:
+    """Substituto local do S3Store: diretório compartilhado entre processos da mesma máquina.
+
+    Criação e troca condicionais sob `flock` de um arquivo de trava; a versão é o MD5 do conteúdo.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root or SETUP["DIST_LOCAL_DIR"]
+        os.makedirs(self.root, exist_ok=True)
+        self._lock_path = os.path.join(self.root, ".lock")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _locked(self):
+        lock_file = open(self._lock_path, "a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _read(self, key: str):
+        try:
+            with open(self._path(key), "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None, None
+        return body, hashlib.md5(body).hexdigest()
+
+    def get(self, key: str):
+        return self._read(key)
+
+    def put(self, key: str, body: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+    def create(self, key: str, body: bytes):
+        with self._locked():
+            if os.path.exists(self._path(key)):
+                return None
+            self.put(key, body)
+            return hashlib.md5(body).hexdigest()
+
+    def replace(self, key: str, body: bytes, version: str):
+        with self._locked():
+            if self._read(key)[1] != version:
+                return None
+            self.put(key, body)
+            return hashlib.md5(body).hexdigest()
+
+    def list(self, prefix: str) -> set:
+        base = self._path(prefix)
+        directory = base if os.path.isdir(base) else os.path.dirname(base)
+        keys = set()
+        for root, _, files in os.walk(directory):
+            for name in files:
+                key = os.path.relpath(os.path.join(root, name), self.root)
+                if key.startswith(prefix) and not name.endswith(".tmp"):
+                    keys.add(key)
+        return keys
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+def lease_store():
+    """Armazenamento configurado em DIST_STORE ("s3" ou "dir")."""
+    return LocalStore() if SETUP["DIST_STORE"] == "dir" else S3Store()
+
+
+@dataclass
+class WorkUnit:
+    """Faixa [start_row, end_row) das linhas brutas de um arquivo da source."""
+    partition: str
+    file_key: str
+    start_row: int
+    end_row: int
+
+    @property
+    def unit_id(self) -> str:
+        file_id = hashlib.md5(self.file_key.encode()).hexdigest()[:12]
+        return f"{file_id}-{self.start_row:010d}-{self.end_row:010d}"
+
+    @property
+    def output_key(self) -> str:
+        return f"staging/{self.partition}/{self.unit_id}.parquet"
+
+    @property
+    def unroutable_key(self) -> str:
+        return f"staging/{self.partition}/unroutable-{self.unit_id}.parquet"
+
+    @property
+    def done_key(self) -> str:
+        return f"done/{self.partition}/{self.unit_id}"
+
+    @property
+    def lease_key(self) -> str:
+        return f"leases/{self.partition}/{self.unit_id}.json"
+
+
+def build_units(partition: str, file_rows: dict, unit_rows: int) -> list:
+    """Unidades de `unit_rows` linhas por arquivo ({file_key: nº de linhas}), em ordem determinística."""
+    units = []
+    for file_key in sorted(file_rows):
+        for start in range(0, file_rows[file_key], unit_rows):
+            units.append(WorkUnit(partition, file_key, start, min(start + unit_rows, file_rows[file_key])))
+    return units
+
+
+def verify_coverage(plan: dict) -> list:
+    """Confere que as unidades cobrem cada arquivo exatamente uma vez (faixas contíguas, sem sobreposição).
+
+    Levanta ValueError com o primeiro buraco/sobreposição; retorna as unidades.
+    """
+    units = [WorkUnit(**u) for u in plan["units"]]
+    by_file = {}
+    for unit in units:
+        by_file.setdefault(unit.file_key, []).append(unit)
+    if set(by_file) - set(plan["file_rows"]):
+        raise ValueError(f"unidades de arquivos fora do plano: {sorted(set(by_file) - set(plan['file_rows']))}")
+    for file_key, num_rows in plan["file_rows"].items():
+        position = 0
+        for unit in sorted(by_file.get(file_key, []), key=lambda u: u.start_row):
+            if unit.start_row != position or unit.end_row <= unit.start_row:
+                raise ValueError(f"cobertura inválida em {file_key}: esperado início {position}, "
+                                 f"unidade {unit.start_row}-{unit.end_row}")
+            position = unit.end_row
+        if position != num_rows:
+            raise ValueError(f"cobertura inválida em {file_key}: {position}/{num_rows} linhas")
+    if len({u.unit_id for u in units}) != len(units):
+        raise ValueError("unit_id duplicado no plano")
+    return units
+
+
+class LeaseManager:
+    """Leases com expiração sobre o armazenamento compartilhado.
+
+    `acquire` cria o lease (se livre) ou toma o de um worker que deixou expirar (troca condicional sobre a versão
+    lida, então só um vence a disputa). Uma thread renova os leases em mãos a cada DIST_LEASE_TTL_SECONDS/3;
+    lease perdido na renovação (outro worker assumiu) fica em `lost`, e o dono não marca a unidade como concluída.
+    """
+
+    def __init__(self, store, worker_id: str = None, ttl: float = None):
+        self.store = store
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.ttl = ttl or SETUP["DIST_LEASE_TTL_SECONDS"]
+        self._held = {}
+        self.lost = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._renewer = threading.Thread(target=self._renew_loop, name="lease-renewer", daemon=True)
+
+    def start(self):
+        self._renewer.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _body(self, attempt: int) -> bytes:
+        return json.dumps({"owner": self.worker_id, "expires_at": time.time() + self.ttl,
+                           "attempt": attempt}).encode()
+
+    def acquire(self, key: str) -> bool:
+        body, version = self.store.get(key)
+        if body is None:
+            attempt = 1
+            new_version = self.store.create(key, self._body(attempt))
+        else:
+            lease = json.loads(body)
+            if lease["owner"] != self.worker_id and lease["expires_at"] > time.time():
+                return False
+            attempt = lease["attempt"] + 1
+            new_version = self.store.replace(key, self._body(attempt), version)
+            if new_version and lease["owner"] != self.worker_id and lease["expires_at"]:
+                logging.warning(f"♻️  Lease {key} assumido de {lease['owner']} (expirado; tentativa {attempt}).")
+                METRICS.incr("dist_leases_taken_over")
+        if not new_version:
+            return False
+        with self._lock:
+            self._held[key] = (new_version, attempt)
+            self.lost.discard(key)
+        return True
+
+    def release(self, key: str):
+        """Devolve o lease já expirado (outro worker pode pegá-lo na hora)."""
+        with self._lock:
+            held = self._held.pop(key, None)
+        if held:
+            version, attempt = held
+            body = json.dumps({"owner": self.worker_id, "expires_at": 0, "attempt": attempt}).encode()
+            try:
+                self.store.replace(key, body, version)
+            except Exception as e:
+                logging.warning(f"⚠️  Falha ao devolver o lease {key} (expira sozinho): {e}")
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.ttl / 3):
+            with self._lock:
+                held = dict(self._held)
+            for key, (version, attempt) in held.items():
+                try:
+                    new_version = self.store.replace(key, self._body(attempt), version)
+                except Exception as e:
+                    logging.warning(f"⚠️  Falha ao renovar o lease {key}: {e}")
+                    continue
+                with self._lock:
+                    if key not in self._held:
+                        continue
+                    if new_version:
+                        self._held[key] = (new_version, attempt)
+                    else:
+                        logging.error(f"❌ Lease {key} perdido para outro worker.")
+                        self._held.pop(key)
+                        self.lost.add(key)
+
+
+def ensure_plan(store, leases: LeaseManager, partition: str, list_files, count_rows) -> list:
+    """Plano da partição (criado uma única vez, sob lease; os demais workers leem o mesmo plano).
+
+    `list_files()` -> chaves dos .parquet da partição; `count_rows(key)` -> nº de linhas (rodapé do parquet).
+    Retorna as unidades já conferidas por `verify_coverage`, ou None se outro worker ainda está planejando.
+    """
+    plan_key = f"plan/{partition}.json"
+    body, _ = store.get(plan_key)
+    if body is None:
+        lease_key = f"leases/{partition}/_plan.json"
+        if not leases.acquire(lease_key):
+            return None
+        try:
+            # Conferido depois de pegar o lease: a execução em lote faz o inverso (lease e depois o plano), então
+            # numa disputa pelo menos um dos lados vê o outro
+            if store.get(batch_lease_key(partition))[0] is not None:
+                return None
+            file_rows = {key: count_rows(key) for key in list_files()}
+            units = build_units(partition, file_rows, SETUP["DIST_UNIT_ROWS"])
+            plan = {"partition": partition, "file_rows": file_rows, "unit_rows": SETUP["DIST_UNIT_ROWS"],
+                    "units": [asdict(u) for u in units]}
+            verify_coverage(plan)
+            if store.create(plan_key, json.dumps(plan).encode()):
+                logging.info(f"🗂️  Plano de {partition}: {len(file_rows)} arquivo(s), {len(units)} unidade(s), "
+                             f"{sum(file_rows.values()):,} linhas")
+        finally:
+            leases.release(lease_key)
+        body, _ = store.get(plan_key)
+    return verify_coverage(json.loads(body))
+
+
+def claim_for_batch(store, leases: LeaseManager, partition: str) -> bool:
+    """Reserva uma partição histórica para a execução em lote (sem OSRM_DISTRIBUTED).
+
+    Falso se o modo distribuído já está com ela (plano gravado ou lease de planejamento ativo). O lease
+    `_batch` é renovado enquanto a execução roteia a partição e segue existindo depois de devolvido.
+    """
+    plan_key = f"plan/{partition}.json"
+    if store.get(plan_key)[0] is not None:
+        return False
+    batch_key = batch_lease_key(partition)
+    if not leases.acquire(batch_key):
+        return False
+    plan_lease, _ = store.get(f"leases/{partition}/_plan.json")
+    if store.get(plan_key)[0] is not None or (plan_lease and json.loads(plan_lease)["expires_at"] > time.time()):
+        leases.release(batch_key)
+        store.delete(batch_key)
+        return False
+    return True
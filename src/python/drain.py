@@ -0,0 +1,82 @@
+# drain.py - Drenagem em SIGTERM ou aviso de interrupção spot: para o despacho, deixa as requisições em voo
+# terminarem dentro da carência e deixa o pipeline gravar o que ficou pronto e registrar o progresso
+
+import logging
+import signal
+import threading
+import time
+from multiprocessing.sharedctypes import RawValue
+
+import requests
+
+from config import SETUP
+from metrics import METRICS
+
+# Código de saída do pipeline drenado (o osrm_run.sh não roda o dedupe nem hiberna: a VM já está parando)
+DRAIN_EXIT_CODE = 4
+
+SPOT_NOTICE_URL = "http://169.254.169.254/latest/meta-data/spot/instance-action"
+
+
+class DrainController:
+    """Pedido de drenagem em memória compartilhada (passado aos workers pelo initializer do Pool).
+
+    `requested`: nenhuma requisição nova é despachada e nenhum bloco/unidade novo começa.
+    `expired`: a carência de DRAIN_GRACE_SECONDS acabou; os workers cancelam o que ainda estiver em voo.
+    No processo pai, `rows_skipped` conta as linhas de blocos cortados pela drenagem (o bloco é refeito do início
+    na próxima execução; o dedupe cross-file descarta o que já tiver subido).
+    """
+
+    def __init__(self):
+        self._requested = RawValue('i', 0)
+        self._deadline = RawValue('d', 0.0)
+        self.reason = None
+        self.rows_skipped = 0
+
+    @property
+    def requested(self) -> bool:
+        return bool(self._requested.value)
+
+    @property
+    def expired(self) -> bool:
+        return self.requested and time.time() >= self._deadline.value
+
+    def request(self, reason: str, grace_seconds: float = None):
+        if self.requested:
+            return
+        grace_seconds = SETUP["DRAIN_GRACE_SECONDS"] if grace_seconds is None else grace_seconds
+        self.reason = reason
+        self._deadline.value = time.time() + grace_seconds
+        self._requested.value = 1
+        METRICS.incr(f"drain_{reason}")
+        logging.warning(f"🛑 Drenagem ({reason}): despacho parado; requisições em voo têm {grace_seconds:.0f}s para "
+                        f"terminar. O que já foi roteado é gravado e o progresso vai para o bookmark.")
+
+    def note_skipped(self, rows: int):
+        if rows:
+            self.rows_skipped += rows
+            METRICS.incr("drain_rows_skipped", rows)
+
+    def install(self):
+        """SIGTERM no processo principal e, se habilitado, observação do aviso de interrupção spot."""
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.request("sigterm"))
+        if SETUP["SPOT_NOTICE_POLL_SECONDS"]:
+            threading.Thread(target=self._watch_spot_notice, name="spot-notice", daemon=True).start()
+        return self
+
+    def _watch_spot_notice(self):
+        # O aviso chega ~2 min antes da interrupção; fora do EC2 (sem metadados) a observação para sozinha
+        while not self.requested:
+            try:
+                r = requests.get(SPOT_NOTICE_URL, timeout=2)
+            except requests.exceptions.RequestException as e:
+                logging.debug(f"Aviso de interrupção spot indisponível ({e}); observação encerrada.")
+                return
+            if r.status_code == 200:
+                logging.warning(f"⚠️  Aviso de interrupção spot: {r.text.strip()}")
+                self.request("spot")
+                return
+            time.sleep(SETUP["SPOT_NOTICE_POLL_SECONDS"])
+
+
+DRAIN = DrainController()
@@ -0,0 +1,72 @@
+# error_reporting.py - Erros agregados nos workers e log centralizado no processo pai
+
+import logging
+import logging.handlers
+import multiprocessing
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from config import SETUP
+
+
+@contextmanager
+def queue_logging():
+    """Fila de log para os workers do Pool: o pai é o único que escreve no console/osrm_automation.log.
+
+    Devolve a fila a ser passada ao initializer (ver configure_worker_logging).
+    """
+    log_queue = multiprocessing.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        yield log_queue
+    finally:
+        listener.stop()
+        log_queue.close()
+
+
+def configure_worker_logging(log_queue):
+    """No worker: troca os handlers herdados do pai por um QueueHandler."""
+    if log_queue is None:
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+class ErrorAggregator:
+    """Conta as falhas do hot path por classe e loga um resumo a cada `interval` segundos.
+
+    Guarda até `max_samples` exemplos (coordenadas e mensagem) por classe em cada intervalo,
+    em vez de uma linha de log por tentativa.
+    """
+
+    def __init__(self, worker_idx: int = 0, interval: float = None, max_samples: int = 3):
+        self.worker_idx = worker_idx
+        self.interval = SETUP["ERROR_SUMMARY_INTERVAL_SECONDS"] if interval is None else interval
+        self.max_samples = max_samples
+        self.counts = defaultdict(int)
+        self.samples = defaultdict(list)
+        self._last_flush = time.monotonic()
+
+    def record(self, error_class: str, host: str, start_coords: list, end_coords: list, message: str):
+        self.counts[error_class] += 1
+        if len(self.samples[error_class]) < self.max_samples:
+            self.samples[error_class].append(f"{start_coords} -> {end_coords} @ {host}: {message[:200]}")
+        if time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Loga o resumo do intervalo (se houve falhas) e zera os contadores."""
+        self._last_flush = time.monotonic()
+        if not self.counts:
+            return
+        total = sum(self.counts.values())
+        logging.warning(f"⚠️  Worker {self.worker_idx}: {total:,} falha(s) OSRM no intervalo {dict(self.counts)}")
+        for error_class, examples in self.samples.items():
+            for example in examples:
+                logging.warning(f"   [{error_class}] {example}")
+        self.counts.clear()
+        self.samples.clear()
@@ -0,0 +1,122 @@
+# failures.py - Taxonomia de falhas do OSRM, política de retry por classe e cache negativo persistente
+
+import asyncio
+import logging
+import os
+
+import aiohttp
+import numpy as np
+import osrm
+import pandas as pd
+
+from config import SETUP
+
+# Classes de falha
+NO_ROUTE = "NoRoute"            # pontos válidos, mas sem caminho entre eles no grafo
+NO_SEGMENT = "NoSegment"        # ponto sem via próxima para snap
+INVALID_VALUE = "InvalidValue"  # requisição rejeitada (coordenada inválida etc.)
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+SERVER_ERROR = "server_error"   # 5xx ou outro código 400 inesperado
+
+# Falhas determinísticas para o mesmo par e a mesma versão do mapa: não adianta repetir
+PERMANENT = {NO_ROUTE, NO_SEGMENT, INVALID_VALUE}
+
+# Tentativas totais e backoff base (s, dobra a cada tentativa) por classe
+RETRY_POLICY = {
+    NO_ROUTE: {"max_attempts": 1, "backoff_s": 0.0},
+    NO_SEGMENT: {"max_attempts": 1, "backoff_s": 0.0},
+    INVALID_VALUE: {"max_attempts": 1, "backoff_s": 0.0},
+    TIMEOUT: {"max_attempts": 3, "backoff_s": 0.5},
+    CONNECTION: {"max_attempts": 5, "backoff_s": 0.2},
+    SERVER_ERROR: {"max_attempts": 3, "backoff_s": 0.2},
+}
+
+
+def classify_failure(e: Exception) -> str:
+    """Classe de uma exceção levantada pelo cliente osrm-py."""
+    # O osrm-py confere as coordenadas (lon ±180, lat ±90) com assert antes de montar a requisição
+    if isinstance(e, AssertionError):
+        return INVALID_VALUE
+    if isinstance(e, osrm.OSRMClientException):
+        body = e.args[0] if e.args and isinstance(e.args[0], dict) else {}
+        code = body.get("code")
+        return code if code in PERMANENT else SERVER_ERROR
+    if isinstance(e, osrm.OSRMServerException):
+        return TIMEOUT if "timeout" in str(e.args[-1]).lower() else SERVER_ERROR
+    if isinstance(e, asyncio.TimeoutError):
+        return TIMEOUT
+    if isinstance(e, (aiohttp.ClientConnectionError, ConnectionError)):
+        return CONNECTION
+    return SERVER_ERROR
+
+
+def _pair_keys(df: pd.DataFrame) -> pd.MultiIndex:
+    """Chave do par origem/destino: coordenadas arredondadas a 1e-5° (~1 m) como inteiros."""
+    columns = SETUP["start_coordinates"] + SETUP["end_coordinates"]
+    return pd.MultiIndex.from_arrays(
+        [np.rint(df[c].to_numpy(dtype=np.float64) * 1e5).astype(np.int64) for c in columns], names=columns
+    )
+
+
+class NegativeCache:
+    """Pares sabidamente não roteáveis nesta versão do mapa, persistidos em disco entre execuções.
+
+    Um mapa novo gera outro arquivo, então pares que passam a ter rota são roteados de novo.
+    """
+
+    def __init__(self, map_version: str, cache_dir: str = None):
+        self.map_version = map_version
+        cache_dir = cache_dir or SETUP["NEGATIVE_CACHE_DIR"]
+        self.path = os.path.join(cache_dir, f"negative_cache_{map_version}.parquet")
+        self.pairs = pd.DataFrame(columns=SETUP["start_coordinates"] + SETUP["end_coordinates"] + ["failure_class"])
+        self._keys = _pair_keys(self.pairs)
+        self._dirty = False
+
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                self.pairs = pd.read_parquet(self.path)
+                self._keys = _pair_keys(self.pairs)
+                logging.info(f"🚫 Cache negativo: {len(self.pairs):,} pares não roteáveis (mapa {self.map_version}).")
+            except Exception as e:
+                logging.warning(f"⚠️  Cache negativo ilegível ({e}); começando vazio.")
+        return self
+
+    def split(self, df: pd.DataFrame):
+        """Separa o bloco em (linhas a rotear, linhas já sabidamente não roteáveis com `failure_class`)."""
+        if self.pairs.empty or df.empty:
+            return df, df.iloc[:0]
+        keys = _pair_keys(df)
+        known = keys.isin(self._keys)
+        if not known.any():
+            return df, df.iloc[:0]
+        classes = pd.Series(self.pairs["failure_class"].to_numpy(), index=self._keys)
+        classes = classes[~classes.index.duplicated()]
+        skipped = df[known].assign(failure_class=classes.reindex(keys[known]).to_numpy())
+        return df[~known], skipped
+
+    def add(self, failures: pd.DataFrame):
+        """Registra as falhas permanentes de um bloco (demais classes são ignoradas)."""
+        permanent = failures[failures["failure_class"].isin(PERMANENT)]
+        if permanent.empty:
+            return
+        new = permanent[self.pairs.columns]
+        new = new[~_pair_keys(new).isin(self._keys)]
+        if new.empty:
+            return
+        self.pairs = pd.concat([self.pairs, new], ignore_index=True) if len(self.pairs) else new.reset_index(drop=True)
+        self._keys = _pair_keys(self.pairs)
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            self.pairs.to_parquet(tmp_path, index=False, engine='pyarrow')
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except Exception as e:
+            logging.warning(f"⚠️  Falha ao gravar cache negativo: {e}")
@@ -0,0 +1,130 @@
+# geo.py - Utilitários geográficos vetorizados (numpy) usados antes do roteamento
+
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+from config import SETUP
+
+# Caixa que contém o Brasil (lon_min, lat_min, lon_max, lat_max)
+BRAZIL_BBOX = (-74.0, -34.0, -34.0, 6.0)
+
+# Contorno grosseiro do Brasil (lon, lat), com folga sobre o litoral e as fronteiras.
+# Serve para barrar coordenadas absurdas antes do OSRM, não para decidir nacionalidade na fronteira.
+BRAZIL_POLYGON = np.array([
+    (-61.0, 5.6), (-51.0, 5.0), (-49.0, 1.8), (-47.0, 0.5), (-42.0, -1.8), (-37.0, -3.6),
+    (-34.0, -4.8), (-34.0, -8.5), (-37.5, -12.0), (-38.3, -14.5), (-38.3, -18.5), (-39.5, -21.0),
+    (-41.0, -23.5), (-45.0, -24.5), (-47.8, -26.0), (-48.0, -28.5), (-50.0, -31.0), (-52.5, -34.0),
+    (-53.8, -34.2), (-58.0, -30.3), (-54.8, -25.3), (-55.0, -24.0), (-56.3, -22.0), (-58.3, -21.8),
+    (-58.5, -17.3), (-60.5, -15.8), (-60.5, -13.6), (-62.0, -13.8), (-64.5, -12.7), (-65.7, -11.0),
+    (-65.7, -9.7), (-68.8, -11.3), (-70.3, -11.3), (-72.6, -10.2), (-73.5, -9.3), (-74.3, -7.3),
+    (-72.8, -5.5), (-70.2, -4.0), (-69.3, -1.0), (-70.0, 1.2), (-67.3, 2.2), (-64.2, 4.3),
+])
+
+
+def hilbert_index(lon: np.ndarray, lat: np.ndarray, order: int = 16, bbox: tuple = BRAZIL_BBOX) -> np.ndarray:
+    """Posição de cada ponto na curva de Hilbert de ordem `order` sobre `bbox` (vetorizado).
+
+    Pontos próximos no espaço ficam próximos no índice, o que mantém requisições
+    consecutivas na mesma região do grafo do OSRM.
+    """
+    n = 1 << order
+    lon_min, lat_min, lon_max, lat_max = bbox
+    x = np.clip((np.asarray(lon, dtype=np.float64) - lon_min) / (lon_max - lon_min), 0, 1)
+    y = np.clip((np.asarray(lat, dtype=np.float64) - lat_min) / (lat_max - lat_min), 0, 1)
+    x = np.minimum(np.nan_to_num(x * n).astype(np.int64), n - 1)
+    y = np.minimum(np.nan_to_num(y * n).astype(np.int64), n - 1)
+
+    d = np.zeros(x.shape, dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = ((x & s) > 0).astype(np.int64)
+        ry = ((y & s) > 0).astype(np.int64)
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotaciona o quadrante para que a curva seja contínua
+        flip = (ry == 0) & (rx == 1)
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        swap = ry == 0
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+    return d
+
+
+def sort_spatially(df: pd.DataFrame) -> pd.DataFrame:
+    """Ordena o bloco pela curva de Hilbert do POC e, em seguida, do pedido.
+
+    Os resultados continuam ligados às linhas por `metadata_columns` (order_number),
+    então a ordem de saída não precisa ser restaurada.
+    """
+    start_lon, start_lat = SETUP["start_coordinates"]
+    end_lon, end_lat = SETUP["end_coordinates"]
+    start_key = hilbert_index(df[start_lon].to_numpy(), df[start_lat].to_numpy())
+    end_key = hilbert_index(df[end_lon].to_numpy(), df[end_lat].to_numpy())
+    return df.iloc[np.lexsort((end_key, start_key))]
+
+
+def point_in_polygon(lon: np.ndarray, lat: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """Máscara booleana: quais pontos estão dentro do polígono [(lon, lat), ...] (ray casting vetorizado)."""
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    inside = np.zeros(lon.shape, dtype=bool)
+    x1, y1 = polygon[-1]
+    for x2, y2 in polygon:
+        crosses = (y1 > lat) != (y2 > lat)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = (x2 - x1) * (lat - y1) / (y2 - y1) + x1
+        inside ^= crosses & (lon < x_cross)
+        x1, y1 = x2, y2
+    return inside
+
+
+def load_shards() -> list:
+    """Shards regionais ativos: polígonos de OSRM_SHARDS_FILE com hosts em OSRM_SHARD_HOSTS.
+
+    Sem arquivo ou sem hosts, devolve lista vazia e todo o roteamento vai para a instância nacional.
+    """
+    if not SETUP["OSRM_SHARD_HOSTS"]:
+        return []
+    try:
+        with open(SETUP["OSRM_SHARDS_FILE"]) as f:
+            definitions = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        logging.warning(f"⚠️  Shards configurados mas polígonos indisponíveis ({e}). Usando só a instância nacional.")
+        return []
+
+    shards = []
+    for shard in definitions:
+        if shard["name"] not in SETUP["OSRM_SHARD_HOSTS"]:
+            continue
+        shards.append({"name": shard["name"], "polygon": np.asarray(shard["polygon"], dtype=np.float64)})
+    logging.info(f"🗺️  Shards regionais ativos: {[s['name'] for s in shards]}")
+    return shards
+
+
+def assign_shards(df: pd.DataFrame, shards: list) -> np.ndarray:
+    """Nome do shard cujo polígono contém POC e pedido de cada linha ("" = instância nacional)."""
+    start_lon, start_lat = SETUP["start_coordinates"]
+    end_lon, end_lat = SETUP["end_coordinates"]
+    assigned = np.full(len(df), "", dtype=object)
+    for shard in shards:
+        pending = assigned == ""
+        if not pending.any():
+            break
+        inside = (point_in_polygon(df[start_lon].to_numpy(), df[start_lat].to_numpy(), shard["polygon"]) &
+                  point_in_polygon(df[end_lon].to_numpy(), df[end_lat].to_numpy(), shard["polygon"]))
+        assigned[pending & inside] = shard["name"]
+    return assigned
+
+
+def in_brazil(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """Máscara dos pontos dentro de BRAZIL_POLYGON (a caixa BRAZIL_BBOX descarta o grosso antes)."""
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    lon_min, lat_min, lon_max, lat_max = BRAZIL_BBOX
+    mask = (lon >= lon_min) & (lon <= lon_max) & (lat >= lat_min) & (lat <= lat_max)
+    if mask.any():
+        mask[mask] = point_in_polygon(lon[mask], lat[mask], BRAZIL_POLYGON)
+    return mask
@@ -0,0 +1,53 @@
+# hedging.py - Política de requisições "hedged" para cortar a cauda de latência do OSRM
+
+from config import SETUP
+from metrics import RunMetrics
+
+
+class HedgePolicy:
+    """Decide quando duplicar uma requisição lenta e limita a carga extra.
+
+    O atraso do hedge é o p95 dinâmico das requisições bem-sucedidas deste worker
+    (recalculado a cada `refresh_every` amostras). Hedges disparados nunca passam
+    de `max_pct`% das requisições primárias.
+    """
+
+    def __init__(self, metrics: RunMetrics, enabled: bool = None, max_pct: float = None,
+                 min_samples: int = None, refresh_every: int = 200):
+        self.metrics = metrics
+        self.enabled = SETUP["HEDGE_ENABLED"] if enabled is None else enabled
+        self.max_pct = SETUP["HEDGE_MAX_PCT"] if max_pct is None else max_pct
+        self.min_samples = SETUP["HEDGE_MIN_SAMPLES"] if min_samples is None else min_samples
+        self.refresh_every = refresh_every
+        self.requests = 0
+        self.fired = 0
+        self._delay_s = None
+        self._refreshed_at = 0
+
+    def delay_s(self):
+        """Segundos de espera antes do hedge, ou None enquanto não há amostras suficientes."""
+        if not self.enabled:
+            return None
+        latency = self.metrics.histograms["osrm_request_ms"]
+        if latency.count < self.min_samples:
+            return None
+        if self._delay_s is None or latency.count - self._refreshed_at >= self.refresh_every:
+            p95_ms = max(latency.percentile(95), SETUP["HEDGE_MIN_DELAY_MS"])
+            self._delay_s = p95_ms / 1000
+            self._refreshed_at = latency.count
+        return self._delay_s
+
+    def record_request(self):
+        self.requests += 1
+
+    def try_fire(self) -> bool:
+        """Reserva um hedge se o orçamento de carga duplicada permitir."""
+        if self.fired + 1 > self.requests * self.max_pct / 100:
+            self.metrics.incr("osrm_hedges_over_budget")
+            return False
+        self.fired += 1
+        self.metrics.incr("osrm_hedges_fired")
+        return True
+
+    def record_win(self):
+        self.metrics.incr("osrm_hedges_won")
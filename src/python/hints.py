@@ -0,0 +1,63 @@
+# hints.py - Cache de hints de waypoint do OSRM para as coordenadas de POC (por versão do mapa)
+
+import json
+import logging
+import os
+
+from config import SETUP
+
+
+def poc_key(lon: float, lat: float) -> str:
+    """Chave da coordenada do POC arredondada a 1e-5° (~1 m)."""
+    return f"{round(lon * 1e5)},{round(lat * 1e5)}"
+
+
+class HintCache:
+    """Hints do OSRM por POC: evitam refazer o snap do POC na malha viária a cada requisição.
+
+    O hint só vale para os dados carregados no osrm-routed (o OSRM ignora hints de outro mapa e refaz o
+    snap), por isso o cache é separado por versão do mapa. Os workers recebem `hints` pelo initializer
+    do Pool e devolvem apenas os hints novos, mesclados aqui pelo processo pai.
+    """
+
+    def __init__(self):
+        self.hints = {}
+        self.path = None
+        self._dirty = False
+
+    def load(self, map_version: str, cache_dir: str = None):
+        cache_dir = cache_dir or SETUP["HINT_CACHE_DIR"]
+        self.path = os.path.join(cache_dir, f"hints_{map_version}.json")
+        self.hints = {}
+        self._dirty = False
+        try:
+            with open(self.path) as f:
+                self.hints = json.load(f)
+            logging.info(f"📍 Cache de hints: {len(self.hints):,} POCs (mapa {map_version}).")
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError as e:
+            logging.warning(f"⚠️  Cache de hints ilegível ({e}); começando vazio.")
+        return self
+
+    def update(self, new_hints: dict):
+        if new_hints:
+            self.hints.update(new_hints)
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty or not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.hints, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except Exception as e:
+            logging.warning(f"⚠️  Falha ao gravar cache de hints: {e}")
+
+
+# Cache do processo pai (carregado pelo orquestrador com a versão do mapa)
+HINT_CACHE = HintCache()
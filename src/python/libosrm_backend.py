@@ -0,0 +1,137 @@
+# libosrm_backend.py - Roteamento in-process pelo libosrm (osrm-bindings), sem HTTP, sobre a memória compartilhada do osrm-datastore
+
+import importlib.util
+import logging
+import os
+import sys
+
+import osrm
+
+from config import SETUP
+
+_LIBOSRM = None
+_ENGINE = None
+_OPTIONAL_HINTS = None
+
+
+def load_bindings():
+    """Importa o osrm-bindings com o nome `libosrm`.
+
+    O pacote também se chama `osrm` e colidiria com o cliente osrm-py; por isso ele é instalado num
+    diretório à parte (`pip install --target`) e carregado de SETUP["LIBOSRM_PACKAGE_DIR"].
+    """
+    global _LIBOSRM
+    if _LIBOSRM is None:
+        package_dir = SETUP["LIBOSRM_PACKAGE_DIR"]
+        init_file = os.path.join(package_dir, "__init__.py")
+        if not os.path.exists(init_file):
+            raise ImportError(f"osrm-bindings não encontrado em {package_dir} "
+                              f"(pip install --target {os.path.dirname(package_dir)} osrm-bindings)")
+        spec = importlib.util.spec_from_file_location("libosrm", init_file, submodule_search_locations=[package_dir])
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["libosrm"] = module
+        spec.loader.exec_module(module)
+        _LIBOSRM = module
+    return _LIBOSRM
+
+
+def get_engine():
+    """Engine libosrm do processo (uma por worker), anexada ao dataset carregado pelo osrm-datastore.
+
+    Sem LIBOSRM_DATASET, abre os arquivos .osrm direto do disco (mmap) em cada worker.
+    """
+    global _ENGINE
+    if _ENGINE is None:
+        libosrm = load_bindings()
+        if SETUP["LIBOSRM_DATASET"]:
+            _ENGINE = libosrm.OSRM(algorithm=SETUP["LIBOSRM_ALGORITHM"], use_shared_memory=True,
+                                   dataset_name=SETUP["LIBOSRM_DATASET"])
+        else:
+            _ENGINE = libosrm.OSRM(storage_config=SETUP["LIBOSRM_STORAGE"], algorithm=SETUP["LIBOSRM_ALGORITHM"],
+                                   use_shared_memory=False, use_mmap=True)
+        logging.debug(f"libosrm pronto (dataset={SETUP['LIBOSRM_DATASET'] or SETUP['LIBOSRM_STORAGE']})")
+    return _ENGINE
+
+
+def optional_hints_supported() -> bool:
+    """O binding aceita None (hint vazio, std::optional) numa posição da lista de hints?
+
+    Versões que declaram a lista como strings rejeitam None; a resposta é conferida uma vez por processo.
+    """
+    global _OPTIONAL_HINTS
+    if _OPTIONAL_HINTS is None:
+        try:
+            load_bindings().RouteParameters(coordinates=[(0.0, 0.0), (0.0, 0.0)], hints=[None, None])
+            _OPTIONAL_HINTS = True
+        except (TypeError, ValueError, RuntimeError) as e:
+            logging.debug(f"libosrm sem hint vazio ({e}): hints só com todas as posições preenchidas")
+            _OPTIONAL_HINTS = False
+    return _OPTIONAL_HINTS
+
+
+def route_hints(hints: list) -> list:
+    """Hints no formato do binding: a lista inteira se todas as posições têm hint (ou se o binding aceita None);
+    senão, nenhum hint."""
+    if not hints:
+        return []
+    if all(isinstance(h, str) for h in hints) or optional_hints_supported():
+        return list(hints)
+    return []
+
+
+class LibOSRMEngine:
+    """Mesma interface de route() do backends.BackendPool, atendida pelo libosrm no próprio processo.
+
+    A chamada é síncrona (o binding não solta o GIL): o paralelismo vem dos processos do Pool, e as
+    coroutines do batch_request apenas se revezam. Erros do OSRM ("NoRoute - ...") viram
+    osrm.OSRMClientException com o mesmo corpo da resposta HTTP 400, então failures.classify_failure
+    e o cache negativo tratam os dois caminhos do mesmo jeito.
+    """
+
+    def __init__(self):
+        self.engine = None
+
+    async def open(self):
+        self.engine = get_engine()
+
+    async def close(self):
+        pass
+
+    async def route(self, coordinates: list, hedge=None, avoid=None, hints: list = None, **route_kwargs):
+        libosrm = load_bindings()
+        params = libosrm.RouteParameters(coordinates=[tuple(c) for c in coordinates], hints=route_hints(hints),
+                                         overview="false", **route_kwargs)
+        try:
+            result = self.engine.Route(params)
+        except RuntimeError as e:
+            code, _, message = str(e).partition(" - ")
+            raise osrm.OSRMClientException({"code": code.strip(), "message": message.strip()}) from e
+        route = result["routes"][0]
+        return {
+            "routes": [{"distance": route["distance"], "duration": route["duration"]}],
+            "waypoints": [{"hint": waypoint["hint"]} if "hint" in waypoint else {} for waypoint in result["waypoints"]],
+        }
+
+
+class LibOSRMRouter:
+    """Substitui o backends.ShardRouter quando ROUTING_BACKEND == "libosrm".
+
+    Só há o dataset nacional em memória compartilhada: todas as linhas (inclusive as com `_shard`) vão para ele.
+    """
+
+    def __init__(self):
+        self.national = LibOSRMEngine()
+        self.shards = {}
+
+    async def open(self):
+        await self.national.open()
+        return self
+
+    async def close(self):
+        await self.national.close()
+
+    def reset_health(self):
+        pass
+
+    def pool_for(self, shard: str = None, fallback: bool = False) -> LibOSRMEngine:
+        return self.national
@@ -1,23 +1,41 @@
 import os
 import glob
 import logging
+import time
 import timeit
 import hashlib
+import io
+import json
 import pandas as pd
-import boto3  # ← ADICIONADO
-import shutil  # ← ADICIONADO
-from datetime import datetime, timedelta
+import boto3
+import shutil
+from datetime import datetime, timedelta, timezone
 
 # --- Importações dos Módulos ---
 from config import SOURCE_BUCKET, DESTINATION_BUCKET, SETUP, processing_date
 from s3_io import (
-    get_processed_bookmark, update_processed_bookmark, list_s3_partitions,
-    list_s3_objects, upload_file_to_s3, load_existing_order_numbers  # ← ADICIONADO
+    update_processed_bookmark, list_s3_objects, upload_file_to_s3, load_existing_order_numbers,
+    download_partition_file, parquet_num_rows
 )
 from processing import (
     parallel_osrm_requests, parse_df, make_list_of_coords, 
-    check_disk_space, shutdown_instance
+    check_disk_space, shutdown_instance, get_map_version
 )
+from metrics import METRICS, log_metrics_summary, write_metrics_summary
+from status import StatusReporter
+from tracing import stage, export_trace
+from profiling import profile_stage
+from autotune import load_cached_tuning, calibrate
+from geo import sort_spatially, load_shards, assign_shards
+from validation import validate_coordinates
+from failures import NegativeCache
+from hints import HINT_CACHE
+from warmup import run_warmup
+from boot import BootCoordinator, OSRMNotReadyError
+from work_plan import plan_partitions, select_new_files, last_processed_timestamp, partition_checkpoint, RunBudget
+from notifications import notification_source
+from distributed import lease_store, LeaseManager, ensure_plan, claim_for_batch, batch_lease_key, PARTITION_DONE
+from drain import DRAIN, DRAIN_EXIT_CODE
 # --------------------------------
 
 # --- CONFIGURAÇÃO DE LOG ---
@@ -41,22 +59,11 @@ def generate_file_hash(filename: str, length: int = 8) -> str:
     unique_string = f"{filename}_{datetime.now().isoformat()}"
     return hashlib.md5(unique_string.encode()).hexdigest()[:length]
 
-def download_partition_file(bucket_name, file_key, local_path):
-    """Baixa um único arquivo."""
-    s3 = boto3.client('s3')
-    try:
-        s3.download_file(bucket_name, file_key, local_path)
-        logging.info(f"Downloaded: s3://{bucket_name}/{file_key} -> {local_path}")
-        return True
-    except Exception as e:
-        logging.error(f"❌ Erro no download de {file_key}: {e}")
-        return False
-
 def cleanup_temp_files(local_dir):
     """Limpa o diretório temporário."""
     logging.info(f"🗑️  Limpando diretório temporário: {local_dir}")
     removed = 0
-    for f in glob.glob(os.path.join(local_dir, "part-*.parquet")):
+    for f in glob.glob(os.path.join(local_dir, "part-*.parquet")) + glob.glob(os.path.join(local_dir, "unroutable-*.parquet")):
         try:
             os.remove(f)
             removed += 1
@@ -65,14 +72,538 @@ def cleanup_temp_files(local_dir):
     logging.info(f"✅ {removed} arquivo(s) temporário(s) removidos.")
 
 
+def upload_unroutable(local_dir, output_partition_path, partition_name):
+    """Sobe num único arquivo os pares não roteáveis (falhas definitivas + cache negativo) da partição."""
+    local_parts = glob.glob(os.path.join(local_dir, "unroutable-*.parquet"))
+    if not local_parts:
+        return
+    df_unroutable = pd.concat([pd.read_parquet(p) for p in local_parts], ignore_index=True)
+    df_unroutable = df_unroutable.drop_duplicates(subset=['order_number'], keep='first')
+    logging.info(f"🚫 {len(df_unroutable):,} pares não roteáveis na partição "
+                 f"{partition_name}: {df_unroutable['failure_class'].value_counts().to_dict()}")
+    
+    filename = f"unroutable-{generate_file_hash(f'unroutable_{partition_name}')}.parquet"
+    local_path = os.path.join(local_dir, filename)
+    df_unroutable.to_parquet(local_path, index=False, engine='pyarrow')
+    s3_key = f"{SETUP['unroutable_s3_base_prefix']}/{output_partition_path}/{filename}"
+    if upload_file_to_s3(local_path, DESTINATION_BUCKET, s3_key):
+        for f in local_parts + [local_path]:
+            os.remove(f)
+
+
+def prepare_block(chunk, negative_cache=None, shards=None):
+    """Parse, validação, cache negativo, ordenação espacial e shards de um bloco.
+
+    Retorna (coords_list para roteamento, resultados já resolvidos sem OSRM, pares sabidamente sem rota: cache
+    negativo e coordenadas descartadas pela validação).
+    """
+    with profile_stage("parse_df"):
+        chunk = parse_df(chunk)
+    chunk = chunk.dropna(subset=SETUP["start_coordinates"]+SETUP["end_coordinates"])
+    shortcut_results, invalid = [], chunk.iloc[:0]
+    if SETUP["VALIDATE_COORDINATES"]:
+        chunk, shortcut_results, invalid, _ = validate_coordinates(chunk)
+    known_unroutable = chunk.iloc[:0]
+    if negative_cache is not None:
+        chunk, known_unroutable = negative_cache.split(chunk)
+        METRICS.incr("negative_cache_hits", len(known_unroutable))
+    if not invalid.empty:
+        known_unroutable = pd.concat([invalid, known_unroutable], ignore_index=True)
+    if SETUP["SPATIAL_SORT"]:
+        chunk = sort_spatially(chunk)
+    if shards:
+        chunk = chunk.assign(_shard=assign_shards(chunk, shards))
+        shard_counts = chunk["_shard"].replace("", "nacional").value_counts().to_dict()
+        logging.info(f"🗺️  Linhas por shard: {shard_counts}")
+        for name, count in shard_counts.items():
+            METRICS.incr(f"rows_shard_{name}", count)
+    return make_list_of_coords(chunk), shortcut_results, known_unroutable
+
+
+def build_output_df(_output, ingestion_date: str = processing_date):
+    """DataFrame de saída de um bloco: deduplicado por order_number e com os metadados de ingestão."""
+    with profile_stage("dataframe_build"):
+        output_df = pd.DataFrame(_output)
+    
+    # Deduplicação Garantida
+    output_df = output_df.drop_duplicates(subset=['order_number'], keep='first')
+    
+    # Adiciona metadados
+    output_df['ingestion_date'] = ingestion_date
+    output_df['processing_timestamp'] = datetime.now().isoformat()
+    return output_df
+
+
+def record_partition_progress(partition_name, is_current_month, max_ts_current_run, checkpoint=None):
+    """Bookmark ao fim da partição: checkpoint (parou no prazo), watermark do delta (mês corrente) ou concluída."""
+    with stage("bookmark_update"):
+        if checkpoint:
+            update_processed_bookmark(DESTINATION_BUCKET, SETUP["bookmark_s3_key"],
+                                      partition_name=partition_name, checkpoint=checkpoint)
+        elif is_current_month:
+            update_processed_bookmark(DESTINATION_BUCKET, SETUP["bookmark_s3_key"],
+                                      delta_timestamp=max_ts_current_run.isoformat(),
+                                      partition_name=partition_name, checkpoint={})
+        else:
+            update_processed_bookmark(DESTINATION_BUCKET, SETUP["bookmark_s3_key"],
+                                      completed_partition=partition_name)
+
+
+def finalize_run_metrics(status: str, **extra):
+    """Loga e publica no S3 o resumo de tempos/latências da execução."""
+    prefix_key = "metrics_s3_success_prefix" if status == "success" else "metrics_s3_failed_prefix"
+    log_metrics_summary()
+    write_metrics_summary(DESTINATION_BUCKET, SETUP[prefix_key], extra={"status": status, **extra})
+    export_trace(DESTINATION_BUCKET, SETUP[prefix_key])
+
+
+def route_block(chunk, status, negative_cache, shards, tuned: bool, label: str, block: int, on_route=None,
+                budget=None):
+    """Roteia um bloco: prepare_block, calibração (na primeira vez), OSRM e pares sem rota (cache negativo).
+
+    Passo comum aos modos em lote, daemon e distribuído; o checkpoint e a gravação ficam com quem chama.
+    `on_route()` é chamado antes do roteamento quando há linhas para o OSRM. A calibração roteia o começo do
+    bloco (e para sem cache com drenagem ou sem prazo no `budget`); o resto segue com o tuning escolhido.
+    Retorna (resultados, pares sem rota ou None, tuned); resultados None se não sobrou nada no bloco.
+    """
+    with stage("parse"):
+        coords_list, shortcut_results, known_unroutable = prepare_block(chunk, negative_cache, shards)
+    if not coords_list and not shortcut_results and known_unroutable.empty:
+        return None, None, tuned
+    
+    if coords_list and on_route:
+        on_route()
+    status.block_started(len(coords_list))
+    failures, calibrated = [], []
+    if coords_list and not tuned:
+        status.update(state="calibrating")
+        calibrated, calibrated_rows, tuned = calibrate(coords_list, failures, status.progress, budget)
+        coords_list = coords_list[calibrated_rows:]
+        status.update(state="routing")
+    
+    with stage("routing", file=label, block=block, rows=len(coords_list)):
+        _output = parallel_osrm_requests(coords_list,
+                                        num_processes=SETUP['NUM_PROCESSES'],
+                                        max_concurrent=SETUP['MAX_CONCURRENT'],
+                                        progress=status.progress,
+                                        failures=failures) if coords_list else []
+    status.block_finished()
+    
+    # Pares não roteáveis: alimentam o cache negativo e o relatório da partição
+    unroutable_df = pd.concat([known_unroutable, pd.DataFrame(failures)], ignore_index=True)
+    if unroutable_df.empty:
+        unroutable_df = None
+    else:
+        unroutable_df = unroutable_df.drop(columns=["_shard"], errors="ignore")
+        if negative_cache is not None and failures:
+            negative_cache.add(unroutable_df)
+    METRICS.incr("blocks_routed")
+    return shortcut_results + calibrated + _output, unroutable_df, tuned
+
+
+def route_rows(df, status, negative_cache, shards, tuned: bool, label: str, budget=None):
+    """Roteia um DataFrame em blocos de BLOCK_SIZE (modos daemon e distribuído).
+
+    Retorna (resultados, pares sem rota ou None, tuned).
+    """
+    outputs, unroutable = [], []
+    for k_chunk, i in enumerate(range(0, len(df), SETUP["BLOCK_SIZE"])):
+        if DRAIN.requested:
+            DRAIN.note_skipped(len(df) - i)
+            break
+        _output, unroutable_df, tuned = route_block(df[i:i + SETUP["BLOCK_SIZE"]], status, negative_cache, shards,
+                                                    tuned, label, k_chunk, budget=budget)
+        outputs += _output or []
+        if unroutable_df is not None:
+            unroutable.append(unroutable_df)
+    return outputs, (pd.concat(unroutable, ignore_index=True) if unroutable else None), tuned
+
+
+def daemon_watermark(processed: list, unacked: list, lag_seconds: float):
+    """Watermark do mês corrente depois de um micro-lote (None se não há o que avançar).
+
+    O SQS não garante ordem: com max(last_modified) do lote, um arquivo anterior ainda não entregue (ou devolvido
+    à fila) ficaria atrás do watermark e a execução em lote o pularia. O watermark para logo antes do arquivo mais
+    antigo recebido e ainda não confirmado (`unacked`) e nunca passa de agora − `lag_seconds` (atraso máximo
+    aceito na entrega S3 → SQS). Arquivos depois dele que o daemon já gravou são descartados pelo dedupe cross-file.
+    """
+    if not processed:
+        return None
+    watermark = min(max(datetime.fromisoformat(e.last_modified) for e in processed),
+                    datetime.now(timezone.utc) - timedelta(seconds=lag_seconds))
+    if unacked:
+        watermark = min(watermark, min(datetime.fromisoformat(e.last_modified) for e in unacked)
+                        - timedelta(microseconds=1))
+    return watermark.astimezone(timezone.utc).isoformat()
+
+
+def run_daemon(status, negative_cache, shards, map_version, tuned: bool) -> int:
+    """Modo daemon: roteia cada arquivo novo da source assim que ele chega, em micro-lotes limitados.
+
+    Cada micro-lote vira um dedupe-*.parquet na partição de destino (o dedupe_current_month das execuções em
+    lote compacta os arquivos pequenos). Arquivos do S3 avançam o watermark do mês corrente no bookmark (até o
+    limite de daemon_watermark), e só então as notificações são confirmadas; em erro ou drenagem no meio do lote,
+    voltam para a fila e seguram o watermark até serem confirmadas. O frescor
+    (arquivo na source → distância gravada) vai para o histograma `freshness_ms`. Roda até ser interrompido ou
+    drenado; retorna as linhas gravadas.
+    """
+    source = notification_source()
+    local_dir = os.path.join(SETUP["LOCAL_TEMP_DIR"], "daemon")
+    os.makedirs(local_dir, exist_ok=True)
+    existing_orders = {}
+    unacked = {}
+    total_rows = 0
+    last_metrics_flush = time.monotonic()
+    logging.info(f"📡 Modo daemon: aguardando arquivos novos (fonte: {SETUP['DAEMON_SOURCE']})...")
+    
+    while not DRAIN.requested:
+        status.update(state="daemon_idle")
+        try:
+            events = source.receive(SETUP["DAEMON_BATCH_MAX_FILES"], 20)
+            # Lote limitado: fecha em DAEMON_BATCH_MAX_FILES ou DAEMON_BATCH_MAX_WAIT_SECONDS após o 1º arquivo
+            batch_deadline = time.monotonic() + SETUP["DAEMON_BATCH_MAX_WAIT_SECONDS"]
+            while events and len(events) < SETUP["DAEMON_BATCH_MAX_FILES"] and time.monotonic() < batch_deadline \
+                    and not DRAIN.requested:
+                events += source.receive(SETUP["DAEMON_BATCH_MAX_FILES"] - len(events),
+                                         batch_deadline - time.monotonic())
+        except KeyboardInterrupt:
+            logging.info("🛑 Modo daemon interrompido.")
+            return total_rows
+        
+        if events:
+            status.update(state="routing", files_total=len(events), partition=None, file=None)
+            try:
+                batch_rows = 0
+                drained = False
+                frames = []
+                for event in events:
+                    local_path = event.local_path or os.path.join(local_dir, os.path.basename(event.key))
+                    if event.local_path is None:
+                        with stage("download", file=os.path.basename(event.key)):
+                            if not download_partition_file(event.bucket, event.key, local_path):
+                                raise IOError(f"falha no download de s3://{event.bucket}/{event.key}")
+                    try:
+                        with stage("read_parquet"):
+                            frames.append(pd.read_parquet(local_path).assign(_partition=event.partition))
+                    except Exception as e:
+                        logging.error(f"❌ Erro ao ler Parquet {event.key}: {e}")
+                    finally:
+                        if event.local_path is None:
+                            os.remove(local_path)
+                    METRICS.incr("files_processed")
+                
+                df_batch = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["_partition"])
+                for partition, df_partition in df_batch.groupby("_partition"):
+                    if DRAIN.requested:
+                        drained = True
+                        break
+                    df_partition = df_partition.drop(columns="_partition")
+                    df_partition = df_partition.drop_duplicates(subset=['order_number'], keep='first')
+                    METRICS.incr("rows_read", len(df_partition))
+                    output_partition_path = f"year={partition[:4]}/month={partition[5:]}"
+                    output_s3_prefix = os.path.join(SETUP["output_s3_base_prefix"], output_partition_path)
+                    
+                    # Dedupe cross-file antes de rotear: order_numbers da partição carregados uma vez por daemon
+                    if partition not in existing_orders:
+                        with stage("cross_dedupe"):
+                            existing_orders[partition] = load_existing_order_numbers(DESTINATION_BUCKET,
+                                                                                     output_s3_prefix)
+                    df_partition = df_partition[~df_partition['order_number'].isin(existing_orders[partition])]
+                    
+                    outputs, unroutable_df, tuned = route_rows(df_partition, status, negative_cache, shards,
+                                                               tuned, "microbatch")
+                    drained = drained or DRAIN.rows_skipped > 0
+                    
+                    if unroutable_df is not None:
+                        unroutable_df['map_version'] = map_version
+                        unroutable_df['ingestion_date'] = datetime.now().strftime('%Y-%m-%d')
+                        unroutable_df.to_parquet(
+                            os.path.join(local_dir, f"unroutable-{generate_file_hash(partition)}.parquet"),
+                            index=False, engine='pyarrow')
+                        with stage("upload_unroutable"):
+                            upload_unroutable(local_dir, output_partition_path, partition)
+                    
+                    if outputs:
+                        with stage("build_dataframe"):
+                            output_df = build_output_df(outputs, ingestion_date=datetime.now().strftime('%Y-%m-%d'))
+                        filename = f"dedupe-{generate_file_hash(f'daemon_{partition}')}.parquet"
+                        local_output_path = os.path.join(local_dir, filename)
+                        with stage("write_part"):
+                            output_df.to_parquet(local_output_path, index=False, engine='pyarrow')
+                        with stage("upload"):
+                            uploaded = upload_file_to_s3(local_output_path, DESTINATION_BUCKET,
+                                                         f"{output_s3_prefix}/{filename}")
+                        os.remove(local_output_path)
+                        if not uploaded:
+                            raise IOError(f"falha no upload do micro-lote de {partition}")
+                        existing_orders[partition].update(output_df['order_number'])
+                        batch_rows += len(output_df)
+                        METRICS.incr("rows_routed", len(output_df))
+                    
+                    # Watermark do mês corrente: a próxima execução em lote não reprocessa estes arquivos
+                    s3_events = [e for e in events if e.partition == partition and e.bucket]
+                    batch_keys = {e.key for e in s3_events}
+                    held = [e for k, e in unacked.items() if e.partition == partition and k not in batch_keys]
+                    watermark = daemon_watermark(s3_events, held, SETUP["DAEMON_WATERMARK_LAG_SECONDS"])
+                    if watermark and partition == datetime.now().strftime('%Y-%m') and not drained:
+                        with stage("bookmark_update"):
+                            update_processed_bookmark(DESTINATION_BUCKET, SETUP["bookmark_s3_key"],
+                                                      delta_timestamp=watermark, partition_name=partition)
+                
+                if drained:
+                    # O que já subiu é descartado pelo dedupe cross-file quando as notificações voltarem
+                    source.nack(events)
+                    logging.warning(f"🛑 Drenagem: micro-lote devolvido à fila ({batch_rows:,} linhas já gravadas).")
+                    return total_rows + batch_rows
+                source.ack(events)
+                for event in events:
+                    unacked.pop(event.key, None)
+            except KeyboardInterrupt:
+                source.nack(events)
+                logging.info("🛑 Modo daemon interrompido (micro-lote devolvido à fila).")
+                return total_rows
+            except Exception as e:
+                logging.error(f"❌ Falha no micro-lote ({len(events)} arquivo(s)), devolvido à fila: {e}")
+                METRICS.incr("daemon_batches_failed")
+                source.nack(events)
+                unacked.update({e.key: e for e in events if e.bucket})
+                time.sleep(SETUP["DAEMON_POLL_SECONDS"])
+                continue
+            
+            written_at = time.time()
+            freshness = [written_at - e.landed_at for e in events]
+            for seconds in freshness:
+                METRICS.observe("freshness_ms", seconds * 1000)
+            METRICS.incr("daemon_batches")
+            total_rows += batch_rows
+            status.update(last_batch_files=len(events), last_batch_rows=batch_rows,
+                          last_freshness_s=round(max(freshness), 1), daemon_rows=total_rows)
+            logging.info(f"⚡ Micro-lote: {len(events)} arquivo(s), {batch_rows:,} linhas gravadas; "
+                         f"frescor máx {max(freshness):.0f}s")
+            if negative_cache is not None:
+                negative_cache.save()
+            HINT_CACHE.save()
+        
+        if time.monotonic() - last_metrics_flush >= SETUP["DAEMON_METRICS_INTERVAL_SECONDS"]:
+            write_metrics_summary(DESTINATION_BUCKET, SETUP["metrics_s3_success_prefix"],
+                                  extra={"status": "running", "mode": "daemon"})
+            last_metrics_flush = time.monotonic()
+    
+    logging.info("🛑 Modo daemon drenado.")
+    return total_rows
+
+
+def parquet_bytes(df) -> bytes:
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False, engine='pyarrow')
+    return buffer.getvalue()
+
+
+def finalize_distributed_partition(store, leases, partition, units) -> bool:
+    """Consolida a partição distribuída: lê exatamente as saídas das unidades do plano e grava um único dedupe.
+
+    Roda sob o lease `_finalize` da partição. O arquivo final tem nome determinístico e passa pelo dedupe
+    cross-file, então repetir a consolidação (worker caiu entre o upload e o marcador) não duplica linhas.
+    Retorna True quando a partição fica marcada como concluída (por este ou por outro worker).
+    """
+    partition_done_key = f"done/{partition}/{PARTITION_DONE}"
+    finalize_lease = f"leases/{partition}/_finalize.json"
+    if not leases.acquire(finalize_lease):
+        return False
+    try:
+        if store.get(partition_done_key)[0] is not None:
+            return True
+        unit_rows = {}
+        frames, unroutable_frames = [], []
+        with stage("consolidation"):
+            for unit in units:
+                marker = json.loads(store.get(unit.done_key)[0])
+                body, _ = store.get(unit.output_key)
+                if marker["rows"] and body is None:
+                    raise RuntimeError(f"saída ausente da unidade {unit.unit_id} ({marker['rows']} linhas)")
+                if body is not None:
+                    frames.append(pd.read_parquet(io.BytesIO(body)))
+                body, _ = store.get(unit.unroutable_key)
+                if body is not None:
+                    unroutable_frames.append(pd.read_parquet(io.BytesIO(body)))
+                unit_rows[unit.unit_id] = marker["rows"]
+        
+        output_partition_path = f"year={partition[:4]}/month={partition[5:]}"
+        output_s3_prefix = os.path.join(SETUP["output_s3_base_prefix"], output_partition_path)
+        local_dir = os.path.join(SETUP["LOCAL_TEMP_DIR"], "distributed")
+        os.makedirs(local_dir, exist_ok=True)
+        cleanup_temp_files(local_dir)
+        
+        if unroutable_frames:
+            pd.concat(unroutable_frames, ignore_index=True).to_parquet(
+                os.path.join(local_dir, f"unroutable-{generate_file_hash(partition)}.parquet"),
+                index=False, engine='pyarrow')
+            with stage("upload_unroutable"):
+                upload_unroutable(local_dir, output_partition_path, partition)
+        
+        rows = 0
+        if frames:
+            df_consolidated = pd.concat(frames, ignore_index=True).drop_duplicates(subset=['order_number'],
+                                                                                   keep='first')
+            with stage("cross_dedupe"):
+                existing_orders = load_existing_order_numbers(DESTINATION_BUCKET, output_s3_prefix)
+            df_consolidated = df_consolidated[~df_consolidated['order_number'].isin(existing_orders)]
+            rows = len(df_consolidated)
+            if rows:
+                filename = f"dedupe-dist-{hashlib.md5(partition.encode()).hexdigest()[:8]}.parquet"
+                local_path = os.path.join(local_dir, filename)
+                with stage("write_consolidated"):
+                    df_consolidated.to_parquet(local_path, index=False, engine='pyarrow')
+                with stage("upload"):
+                    uploaded = upload_file_to_s3(local_path, DESTINATION_BUCKET, f"{output_s3_prefix}/{filename}")
+                os.remove(local_path)
+                if not uploaded:
+                    raise IOError(f"falha no upload consolidado de {partition}")
+        
+        record_partition_progress(partition, False, None)
+        
+        store.create(partition_done_key, json.dumps({"owner": leases.worker_id, "rows": rows,
+                                                     "units": unit_rows}).encode())
+        for key in store.list(f"staging/{partition}/") | (store.list(f"leases/{partition}/") - {finalize_lease}):
+            store.delete(key)
+        METRICS.incr("dist_partitions_finalized")
+        logging.info(f"✅ Partição distribuída {partition} consolidada: {len(units)} unidade(s), {rows:,} linhas novas.")
+        return True
+    finally:
+        leases.release(finalize_lease)
+
+
+def run_distributed(partitions, status, negative_cache, shards, map_version, tuned: bool, budget) -> int:
+    """Modo distribuído: várias VMs dividem o backfill histórico em unidades (arquivo + faixa de linhas).
+
+    Cada unidade é pega por lease; a saída vai para uma chave determinística do staging e só depois o marcador
+    `done` é criado (só se ainda não existir e se o lease não foi perdido). Worker que cai deixa o lease
+    expirar e outro retoma a unidade. Quando todas as unidades de uma partição têm marcador, um único worker
+    consolida. Roda até todas as partições estarem concluídas ou o prazo acabar; retorna as linhas roteadas.
+    """
+    store = lease_store()
+    leases = LeaseManager(store).start()
+    file_cache = {}
+    total_rows = 0
+    pending = list(partitions)
+    logging.info(f"🤝 Modo distribuído (worker {leases.worker_id}, armazenamento {SETUP['DIST_STORE']}): {pending}")
+    
+    def list_files(partition):
+        input_key = os.path.join(SETUP["input_s3_base_prefix"], partition)
+        return [f['Key'] for f in select_new_files(list_s3_objects(SOURCE_BUCKET, input_key))]
+    
+    try:
+        while pending:
+            progressed = False
+            for partition in list(pending):
+                if not budget.has_time_for_block():
+                    break
+                done = store.list(f"done/{partition}/")
+                if f"done/{partition}/{PARTITION_DONE}" in done:
+                    pending.remove(partition)
+                    continue
+                if store.get(batch_lease_key(partition))[0] is not None:
+                    logging.info(f"📅 {partition} reservada pela execução em lote: fica com ela.")
+                    pending.remove(partition)
+                    continue
+                with stage("dist_plan"):
+                    units = ensure_plan(store, leases, partition, lambda: list_files(partition),
+                                        lambda key: parquet_num_rows(SOURCE_BUCKET, key))
+                if units is None:
+                    continue
+                todo = [u for u in units if u.done_key not in done]
+                # Cada worker começa num ponto diferente da lista para reduzir a disputa pelos mesmos leases
+                offset = int(hashlib.md5(leases.worker_id.encode()).hexdigest(), 16) % max(len(todo), 1)
+                for unit in todo[offset:] + todo[:offset]:
+                    if not budget.has_time_for_block():
+                        break
+                    if not leases.acquire(unit.lease_key):
+                        continue
+                    try:
+                        if store.get(unit.done_key)[0] is not None:
+                            continue
+                        block_started_at = time.monotonic()
+                        status.update(state="routing", partition=partition, file=os.path.basename(unit.file_key),
+                                      unit=unit.unit_id)
+                        df_file = file_cache.get(unit.file_key)
+                        if df_file is None:
+                            local_path = os.path.join(SETUP["LOCAL_TEMP_DIR"], os.path.basename(unit.file_key))
+                            with stage("download", file=os.path.basename(unit.file_key)):
+                                if not download_partition_file(SOURCE_BUCKET, unit.file_key, local_path):
+                                    raise IOError(f"falha no download de {unit.file_key}")
+                            with stage("read_parquet"):
+                                df_file = pd.read_parquet(local_path)
+                            os.remove(local_path)
+                            file_cache = {unit.file_key: df_file}
+                        
+                        df_unit = df_file.iloc[unit.start_row:unit.end_row]
+                        df_unit = df_unit.drop_duplicates(subset=['order_number'], keep='first')
+                        METRICS.incr("rows_read", len(df_unit))
+                        outputs, unroutable_df, tuned = route_rows(df_unit, status, negative_cache, shards, tuned,
+                                                                   unit.unit_id, budget)
+                        if DRAIN.rows_skipped:
+                            logging.warning(f"🛑 Drenagem: unidade {unit.unit_id} cortada; o lease é devolvido e a "
+                                            f"unidade é refeita por outro worker.")
+                            break
+                        rows = 0
+                        if outputs:
+                            with stage("build_dataframe"):
+                                output_df = build_output_df(outputs)
+                            rows = len(output_df)
+                            with stage("write_part"):
+                                store.put(unit.output_key, parquet_bytes(output_df))
+                        if unroutable_df is not None:
+                            unroutable_df['map_version'] = map_version
+                            unroutable_df['ingestion_date'] = processing_date
+                            store.put(unit.unroutable_key, parquet_bytes(unroutable_df))
+                        
+                        if unit.lease_key in leases.lost:
+                            logging.warning(f"⚠️  Unidade {unit.unit_id} assumida por outro worker durante o "
+                                            f"roteamento; o marcador fica com ele.")
+                            continue
+                        store.create(unit.done_key, json.dumps({"owner": leases.worker_id, "rows": rows}).encode())
+                        total_rows += rows
+                        METRICS.incr("rows_routed", rows)
+                        METRICS.incr("dist_units_done")
+                        budget.block_done(time.monotonic() - block_started_at)
+                        progressed = True
+                    finally:
+                        leases.release(unit.lease_key)
+                
+                if negative_cache is not None:
+                    negative_cache.save()
+                HINT_CACHE.save()
+                done = store.list(f"done/{partition}/")
+                if all(u.done_key in done for u in units):
+                    status.update(state="consolidating", partition=partition)
+                    if finalize_distributed_partition(store, leases, partition, units):
+                        pending.remove(partition)
+                        progressed = True
+            
+            if not budget.has_time_for_block():
+                stop_reason = "🛑 Drenagem" if DRAIN.requested else "⏰ Prazo próximo"
+                logging.warning(f"{stop_reason}: {pending} ficam para os demais workers/próxima execução.")
+                METRICS.incr("partitions_deferred", len(pending))
+                break
+            if pending and not progressed:
+                # Unidades restantes com outros workers: espera concluírem ou o lease expirar
+                status.update(state="dist_waiting")
+                time.sleep(SETUP["DIST_IDLE_POLL_SECONDS"])
+    finally:
+        leases.stop()
+    return total_rows
+
+
 def run_pipeline():
     
     total_samples_processed = 0
     total_duplicates_removed = 0
+    run_started_at = time.time()
     
     logging.info("="*60)
     logging.info("🚀 Iniciando pipeline de processamento OSRM")
     logging.info("="*60)
+    DRAIN.install()
     
     # 1. VERIFICAÇÃO INICIAL
     if not check_disk_space():
@@ -92,39 +623,137 @@ def run_pipeline():
     os.makedirs(LOCAL_TEMP_DIR, exist_ok=True)
     cleanup_temp_files(LOCAL_TEMP_DIR)
     
-    # 3. IDENTIFICAR FILA DE TRABALHO
+    # 2c. Partida: listagem, bookmark e primeiro arquivo em paralelo com o carregamento do osrm-routed
     current_month_partition = datetime.now().strftime('%Y-%m')
+    boot = BootCoordinator(current_month_partition).start()
     
-    available_partitions = list_s3_partitions(SOURCE_BUCKET, SETUP["input_s3_base_prefix"])
+    # 2d. Caches da versão atual do mapa (pares sem rota e hints de POC)
+    map_version = get_map_version()
+    negative_cache = NegativeCache(map_version).load() if SETUP["NEGATIVE_CACHE"] else None
+    if SETUP["HINT_CACHE"]:
+        HINT_CACHE.load(map_version)
     
-    # FILTRO: Processar apenas 2025+
-    available_partitions = [p for p in available_partitions if p.startswith('2025-')]
-    logging.info(f"Filtro aplicado: Processando {len(available_partitions)} partições (2025+).")
+    # 2e. Shards regionais (polígonos carregados uma vez; sem shards, tudo vai para a instância nacional)
+    shards = load_shards()
     
-    full_bookmark = get_processed_bookmark(DESTINATION_BUCKET, SETUP["bookmark_s3_key"])
-    processed_partitions_history = set(full_bookmark.get("completed_partitions", []))
-    delta_timestamps = full_bookmark.get("delta_timestamps", {})
-
-    # Lógica para definir a ordem de processamento
-    historical_work = set(available_partitions) - processed_partitions_history - {current_month_partition}
-    partitions_to_process = sorted(list(historical_work))
+    # 2f. Status ao vivo (arquivo e/ou HTTP)
+    max_workers = max([SETUP["NUM_PROCESSES"]] + SETUP["AUTOTUNE_GRID"]["NUM_PROCESSES"])
+    status = StatusReporter(SETUP["STATUS_FILE"], SETUP["STATUS_INTERVAL_SECONDS"],
+                            SETUP["STATUS_HTTP_PORT"], num_workers=max_workers).start()
+    status.update(state="listing")
     
-    if current_month_partition in available_partitions:
-        partitions_to_process.append(current_month_partition)
+    # 3. IDENTIFICAR FILA DE TRABALHO (listagem e bookmark já em andamento desde a partida)
+    available_partitions, full_bookmark = boot.plan()
+    partitions_to_process = plan_partitions(available_partitions, full_bookmark, current_month_partition)
     
-    if not partitions_to_process:
+    if not partitions_to_process and not SETUP["DAEMON"]:
         logging.info("✅ Nenhuma partição nova para processar. Encerrando.")
+        boot.stop()
+        finalize_run_metrics("success", total_samples_processed=0)
+        status.stop("finished")
         shutdown_instance()
         exit(0)
 
     logging.info(f"📋 Fila de trabalho: {partitions_to_process}")
+    
+    # 3a. Estimativa de backlog feita pela Lambda antes do START (dimensiona a execução)
+    run_plan = boot.run_plan()
+    small_backlog = False
+    if run_plan:
+        backlog_mb = run_plan["total_bytes"] / 1024**2
+        logging.info(f"📦 Backlog estimado pela Lambda: {run_plan['total_files']} arquivo(s), {backlog_mb:.1f}MB")
+        status.update(estimated_files=run_plan["total_files"], estimated_mb=round(backlog_mb, 1))
+        METRICS.incr("run_plan_files", run_plan["total_files"])
+        small_backlog = backlog_mb < SETUP["RUN_PLAN_SMALL_MB"]
+    
+    # 3b. OSRM pronto (o primeiro arquivo continua baixando em segundo plano)
+    status.update(state="waiting_osrm")
+    try:
+        boot.wait_osrm()
+    except OSRMNotReadyError as e:
+        logging.error(f"❌ OSRM indisponível na partida: {e}")
+        boot.stop()
+        finalize_run_metrics("failed", error=str(e), total_samples_processed=0)
+        status.stop("failed")
+        exit(3)
+    
+    # 3c. Aquecimento do OSRM: mapa pré-carregado e latência estável antes do primeiro bloco cronometrado
+    if SETUP["WARMUP"] and small_backlog:
+        logging.info(f"⏩ Backlog abaixo de {SETUP['RUN_PLAN_SMALL_MB']}MB: aquecimento dispensado.")
+    elif SETUP["WARMUP"]:
+        status.update(state="warming_up")
+        with stage("warmup"):
+            run_warmup(sample_df=boot.peek_file())
+    
+    # 3d. Tuning de concorrência (cache por instância/mapa; sem cache, calibra no primeiro bloco)
+    tuned = load_cached_tuning()
+    
+    # 3e. Prazo: a fila já vem com o incremental na frente; o backfill ocupa o tempo que sobrar e, antes do
+    # prazo (contado do boot/retomada da VM), a partição em curso é consolidada e vira checkpoint no bookmark
+    run_deadline = None
+    if SETUP["RUN_DEADLINE_MINUTES"] and not SETUP["DAEMON"]:
+        run_deadline = (SETUP["BOOT_EPOCH"] or run_started_at) + SETUP["RUN_DEADLINE_MINUTES"] * 60
+        logging.info(f"⏰ Prazo da execução: {datetime.fromtimestamp(run_deadline):%H:%M:%S} "
+                     f"(checkpoint até {SETUP['RUN_CHECKPOINT_MARGIN_MINUTES']} min antes)")
+    budget = RunBudget(run_deadline, SETUP["RUN_CHECKPOINT_MARGIN_MINUTES"] * 60)
+    stopped_at = None
+    
+    # 3f. Modo distribuído: este worker só pega unidades do backfill histórico (partições sem watermark); o
+    # incremental fica com a execução agendada, que roda sem OSRM_DISTRIBUTED
+    if SETUP["DISTRIBUTED"]:
+        backfill = [p for p in partitions_to_process
+                    if p != current_month_partition and not last_processed_timestamp(full_bookmark, p)]
+        try:
+            total_samples_processed += run_distributed(backfill, status, negative_cache, shards, map_version,
+                                                       tuned, budget)
+        except Exception as e:
+            logging.error(f"❌ FATAL: Falha no modo distribuído: {e}")
+            boot.stop()
+            finalize_run_metrics("failed", error=str(e), total_samples_processed=total_samples_processed)
+            status.stop("failed")
+            exit(1)
+        partitions_to_process = []
+    
+    # 3g. Execução em lote: cada partição histórica é reservada no armazenamento do modo distribuído (as que já
+    # têm plano ou planejamento em curso ficam com os workers, e os workers deixam de lado as reservadas aqui)
+    batch_leases = None
+    if SETUP["DIST_BATCH_GUARD"] and any(p != current_month_partition and not last_processed_timestamp(full_bookmark, p)
+                                         for p in partitions_to_process):
+        batch_leases = LeaseManager(lease_store()).start()
+    batch_claim = None
 
     # 4. LOOP DE PROCESSAMENTO
     
-    for partition_to_run in partitions_to_process:
+    for partition_idx, partition_to_run in enumerate(partitions_to_process):
+        
+        if batch_claim:
+            batch_leases.release(batch_claim)
+            batch_claim = None
+        if stopped_at or not budget.has_time_for_block():
+            logging.warning(f"⏰ Sem tempo para {partitions_to_process[partition_idx:]}: ficam para a próxima execução.")
+            METRICS.incr("partitions_deferred", len(partitions_to_process) - partition_idx)
+            break
         
         is_current_month = (partition_to_run == current_month_partition)
-        job_type = "INCREMENTAL (mês corrente)" if is_current_month else "HISTÓRICO"
+        last_processed_ts = last_processed_timestamp(full_bookmark, partition_to_run)
+        checkpoint = partition_checkpoint(full_bookmark, partition_to_run)
+        if batch_leases and not is_current_month and not last_processed_ts:
+            try:
+                claimed = claim_for_batch(batch_leases.store, batch_leases, partition_to_run)
+            except Exception as e:
+                logging.error(f"❌ Falha ao reservar {partition_to_run} no armazenamento distribuído: {e}")
+                claimed = False
+            if not claimed:
+                logging.info(f"🤝 {partition_to_run} está com o modo distribuído: pulando.")
+                METRICS.incr("partitions_skipped_distributed")
+                continue
+            batch_claim = batch_lease_key(partition_to_run)
+        if is_current_month:
+            job_type = "INCREMENTAL (mês corrente)"
+        else:
+            job_type = "INCREMENTAL (mês anterior)" if last_processed_ts else "HISTÓRICO"
+        status.update(partition=partition_to_run, job_type=job_type,
+                      partitions_done=partition_idx, partitions_total=len(partitions_to_process))
         
         logging.info("="*60)
         logging.info(f"📅 Partição: {partition_to_run} ({job_type})")
@@ -134,37 +763,24 @@ def run_pipeline():
         output_partition_path = f"year={partition_to_run[:4]}/month={partition_to_run[5:]}"
         output_s3_prefix = os.path.join(SETUP["output_s3_base_prefix"], output_partition_path)
         
-        last_processed_ts = None
-        if partition_to_run in delta_timestamps:
-            last_processed_ts = datetime.fromisoformat(delta_timestamps[partition_to_run]) 
-        
         try:
             # 5. LISTAR E FILTRAR ARQUIVOS
-            all_s3_files = list_s3_objects(SOURCE_BUCKET, input_key)
-            files_to_download_filtered = []
+            all_s3_files = boot.listing_for(partition_to_run)
+            if all_s3_files is None:
+                with stage("list_files"):
+                    all_s3_files = list_s3_objects(SOURCE_BUCKET, input_key)
+            done_files = list(checkpoint.get("done_files", []))
+            files_to_download_filtered = select_new_files(all_s3_files, last_processed_ts, done_files)
             max_ts_current_run = None
             
-            for file_data in all_s3_files:
-                file_key = file_data['Key']
-                last_mod_dt = datetime.fromisoformat(file_data['LastModified'])
-                
-                if not file_key.endswith(".parquet"): continue
-                
-                if is_current_month and last_processed_ts and last_mod_dt <= last_processed_ts:
-                    logging.warning(f"Delta: Ignorando arquivo já processado: {os.path.basename(file_key)}")
-                    continue
-                
-                files_to_download_filtered.append(file_data)
-            
-            files_to_download_filtered.sort(key=lambda x: datetime.fromisoformat(x['LastModified']))
-            
             if files_to_download_filtered:
                 max_ts_current_run = datetime.fromisoformat(files_to_download_filtered[-1]['LastModified'])
             else:
                 logging.info(f"✅ Nenhuma atualização na partição {partition_to_run}.")
                 if not is_current_month: 
-                    update_processed_bookmark(DESTINATION_BUCKET, SETUP["bookmark_s3_key"], 
-                                            completed_partition=partition_to_run)
+                    with stage("bookmark_update"):
+                        update_processed_bookmark(DESTINATION_BUCKET, SETUP["bookmark_s3_key"], 
+                                                completed_partition=partition_to_run)
                 continue
 
             # 6. LOOP DE PROCESSAMENTO DE ARQUIVOS
@@ -172,72 +788,118 @@ def run_pipeline():
                 
                 source_filename = os.path.basename(file_data['Key'])
                 local_file_path = source_filename
+                start_row = checkpoint.get("next_row", 0) if file_data['Key'] == checkpoint.get("partial_file") else 0
+                if not budget.has_time_for_block():
+                    stopped_at = {"done_files": done_files, "partial_file": file_data['Key'], "next_row": start_row}
+                    break
                 file_hash = generate_file_hash(source_filename.replace('.parquet', ''))
+                status.update(state="downloading", file=source_filename, files_done=k_file,
+                              files_total=len(files_to_download_filtered), blocks_done=0, blocks_total=None)
                 
-                if not download_partition_file(SOURCE_BUCKET, file_data['Key'], local_file_path): 
-                    continue
-                
-                try:
-                    df_full = pd.read_parquet(local_file_path)
-                    df_full = df_full.drop_duplicates(subset=['order_number'], keep='first')
-                except Exception as e:
-                    logging.error(f"❌ Erro ao ler Parquet {local_file_path}: {e}")
-                    os.remove(local_file_path)
-                    continue
+                df_full = boot.take_file(file_data['Key'])
+                if df_full is None:
+                    with stage("download", file=source_filename):
+                        downloaded = download_partition_file(SOURCE_BUCKET, file_data['Key'], local_file_path)
+                    if not downloaded: 
+                        continue
+                    
+                    try:
+                        with stage("read_parquet"):
+                            df_full = pd.read_parquet(local_file_path)
+                            df_full = df_full.drop_duplicates(subset=['order_number'], keep='first')
+                    except Exception as e:
+                        logging.error(f"❌ Erro ao ler Parquet {local_file_path}: {e}")
+                        os.remove(local_file_path)
+                        continue
                 
                 num_records = len(df_full)
+                METRICS.incr("files_processed")
+                METRICS.incr("rows_read", num_records)
+                status.update(state="routing", file_rows=num_records,
+                              blocks_total=-(-num_records // SETUP["BLOCK_SIZE"]))
                 
-                for k_chunk, i in enumerate(range(0, num_records, SETUP["BLOCK_SIZE"])):
-                    
-                    chunk = df_full[i:i + SETUP["BLOCK_SIZE"]]
-                    chunk = parse_df(chunk)
-                    chunk = chunk.dropna(subset=SETUP["start_coordinates"]+SETUP["end_coordinates"])
-                    coords_list = make_list_of_coords(chunk)
-
-                    if not coords_list: continue
-
-                    _output = parallel_osrm_requests(coords_list, 
-                                                    num_processes=SETUP['NUM_PROCESSES'], 
-                                                    max_concurrent=SETUP['MAX_CONCURRENT'])
+                if start_row:
+                    logging.info(f"↪️  Retomando {source_filename} do checkpoint (linha {start_row:,})")
+                for k_chunk, i in enumerate(range(start_row, num_records, SETUP["BLOCK_SIZE"])):
                     
-                    if not _output: continue
+                    if stopped_at:
+                        break
+                    if not budget.has_time_for_block():
+                        stopped_at = {"done_files": done_files, "partial_file": file_data['Key'], "next_row": i}
+                        break
+                    block_started_at = time.monotonic()
+                    status.update(file_rows_after_block=max(num_records - i - SETUP["BLOCK_SIZE"], 0))
+                    _output, unroutable_df, tuned = route_block(df_full[i:i + SETUP["BLOCK_SIZE"]], status,
+                                                                negative_cache, shards, tuned, source_filename,
+                                                                k_chunk, on_route=boot.mark_first_route,
+                                                                budget=budget)
+                    if _output is None: continue
+                    if DRAIN.rows_skipped:
+                        # Bloco cortado pela drenagem: grava o que ficou pronto e o checkpoint volta ao início do
+                        # bloco (na próxima execução, o dedupe cross-file descarta o que já subiu)
+                        stopped_at = {"done_files": done_files, "partial_file": file_data['Key'], "next_row": i}
                     
-                    output_df = pd.DataFrame(_output)
+                    if unroutable_df is not None:
+                        unroutable_df['map_version'] = map_version
+                        unroutable_df['ingestion_date'] = processing_date
+                        unroutable_df.to_parquet(
+                            os.path.join(LOCAL_TEMP_DIR, f"unroutable-{file_hash}-{k_file:03d}-{k_chunk:05d}.parquet"),
+                            index=False, engine='pyarrow')
                     
-                    # Deduplicação Garantida
-                    output_df = output_df.drop_duplicates(subset=['order_number'], keep='first')
+                    if not _output: continue
                     
-                    # Adiciona metadados
-                    output_df['ingestion_date'] = processing_date
-                    output_df['processing_timestamp'] = datetime.now().isoformat()
+                    with stage("build_dataframe"):
+                        output_df = build_output_df(_output)
                     
                     # Salvar Localmente
                     part_filename = f"part-{file_hash}-{k_file:03d}-{k_chunk:05d}.parquet"
                     local_part_path = os.path.join(LOCAL_TEMP_DIR, part_filename)
-                    output_df.to_parquet(local_part_path, index=False, engine='pyarrow')
+                    with stage("write_part"):
+                        output_df.to_parquet(local_part_path, index=False, engine='pyarrow')
                     
                     total_samples_processed += len(output_df)
+                    METRICS.incr("rows_routed", len(output_df))
+                    budget.block_done(time.monotonic() - block_started_at)
                     
                 os.remove(local_file_path)
+                if negative_cache is not None:
+                    negative_cache.save()
+                HINT_CACHE.save()
+                if stopped_at:
+                    break
+                done_files.append(file_data['Key'])
+            
+            if stopped_at:
+                stop_reason = "🛑 Drenagem" if DRAIN.requested else "⏰ Prazo próximo"
+                logging.warning(f"{stop_reason}: checkpoint de {partition_to_run} em "
+                                f"{os.path.basename(stopped_at['partial_file'])} (linha {stopped_at['next_row']:,}), "
+                                f"{len(done_files)} arquivo(s) concluído(s). Consolidando o que já foi roteado.")
+                METRICS.incr("drain_checkpoints" if DRAIN.requested else "deadline_checkpoints")
             
             # ===== 7. CONSOLIDAR E FAZER UPLOAD COM DEDUPE CROSS-FILE =====
             logging.info("="*60)
             logging.info("📦 Consolidando arquivos part-* locais...")
+            status.update(state="consolidating")
             logging.info("="*60)
             
+            with stage("upload_unroutable"):
+                upload_unroutable(LOCAL_TEMP_DIR, output_partition_path, partition_to_run)
+            
             local_parts = glob.glob(os.path.join(LOCAL_TEMP_DIR, "part-*.parquet"))
             
             if local_parts:
                 logging.info(f"📋 Encontrados {len(local_parts)} arquivos part-* para consolidar")
                 
                 # Ler todos os parts
-                dfs = [pd.read_parquet(p) for p in local_parts]
-                df_consolidated = pd.concat(dfs, ignore_index=True)
-                
-                logging.info(f"📊 Total ANTES dedupe interno: {len(df_consolidated):,} registros")
-                
-                # Dedupe interno
-                df_consolidated = df_consolidated.drop_duplicates(subset=['order_number'], keep='first')
+                with stage("consolidation"):
+                    dfs = [pd.read_parquet(p) for p in local_parts]
+                    df_consolidated = pd.concat(dfs, ignore_index=True)
+                    
+                    logging.info(f"📊 Total ANTES dedupe interno: {len(df_consolidated):,} registros")
+                    
+                    # Dedupe interno
+                    with profile_stage("consolidation_dedupe"):
+                        df_consolidated = df_consolidated.drop_duplicates(subset=['order_number'], keep='first')
                 
                 logging.info(f"📊 Total APÓS dedupe interno: {len(df_consolidated):,} registros")
                 
@@ -247,13 +909,15 @@ def run_pipeline():
                 logging.info("="*60)
                 
                 # Carregar order_numbers já existentes
-                existing_orders = load_existing_order_numbers(DESTINATION_BUCKET, output_s3_prefix)
+                with stage("cross_dedupe"):
+                    existing_orders = load_existing_order_numbers(DESTINATION_BUCKET, output_s3_prefix)
                 
                 if existing_orders:
                     total_antes_cross = len(df_consolidated)
                     
                     # Filtrar: manter apenas orders que NÃO existem
-                    df_consolidated = df_consolidated[~df_consolidated['order_number'].isin(existing_orders)]
+                    with stage("cross_dedupe"), profile_stage("consolidation_dedupe", tag="cross_file"):
+                        df_consolidated = df_consolidated[~df_consolidated['order_number'].isin(existing_orders)]
                     
                     total_depois_cross = len(df_consolidated)
                     cross_duplicatas = total_antes_cross - total_depois_cross
@@ -275,13 +939,7 @@ def run_pipeline():
                     cleanup_temp_files(LOCAL_TEMP_DIR)
                     
                     # Atualizar bookmark
-                    if is_current_month:
-                        update_processed_bookmark(DESTINATION_BUCKET, SETUP["bookmark_s3_key"], 
-                                                delta_timestamp=max_ts_current_run.isoformat(), 
-                                                partition_name=partition_to_run)
-                    else:
-                        update_processed_bookmark(DESTINATION_BUCKET, SETUP["bookmark_s3_key"], 
-                                                completed_partition=partition_to_run)
+                    record_partition_progress(partition_to_run, is_current_month, max_ts_current_run, stopped_at)
                     continue
                 
                 logging.info("="*60)
@@ -293,33 +951,60 @@ def run_pipeline():
                 consolidated_filename = f"dedupe-{consolidated_hash}.parquet"
                 local_consolidated_path = os.path.join(LOCAL_TEMP_DIR, consolidated_filename)
                 
-                df_consolidated.to_parquet(local_consolidated_path, index=False, engine='pyarrow')
+                with stage("write_consolidated"):
+                    df_consolidated.to_parquet(local_consolidated_path, index=False, engine='pyarrow')
                 
                 s3_consolidated_key = f"{output_s3_prefix}/{consolidated_filename}"
                 
-                if upload_file_to_s3(local_consolidated_path, DESTINATION_BUCKET, s3_consolidated_key):
+                with stage("upload"):
+                    uploaded = upload_file_to_s3(local_consolidated_path, DESTINATION_BUCKET, s3_consolidated_key)
+                if uploaded:
                     logging.info(f"✅ Upload consolidado bem-sucedido!")
                     cleanup_temp_files(LOCAL_TEMP_DIR)
                     
                 # 8. ATUALIZAR BOOKMARK
-                if is_current_month:
-                    update_processed_bookmark(DESTINATION_BUCKET, SETUP["bookmark_s3_key"], 
-                                            delta_timestamp=max_ts_current_run.isoformat(), 
-                                            partition_name=partition_to_run)
-                else:
-                    update_processed_bookmark(DESTINATION_BUCKET, SETUP["bookmark_s3_key"], 
-                                            completed_partition=partition_to_run)
+                record_partition_progress(partition_to_run, is_current_month, max_ts_current_run, stopped_at)
+            
+            elif stopped_at:
+                record_partition_progress(partition_to_run, is_current_month, max_ts_current_run, stopped_at)
 
         except Exception as e:
             logging.error(f"❌ FATAL: Falha ao processar {partition_to_run}: {e}")
+            boot.stop()
             cleanup_temp_files(LOCAL_TEMP_DIR)
+            finalize_run_metrics("failed", failed_partition=partition_to_run, error=str(e),
+                                 total_samples_processed=total_samples_processed)
+            status.stop("failed")
             exit(1)
 
+    if batch_leases:
+        if batch_claim:
+            batch_leases.release(batch_claim)
+        batch_leases.stop()
+    boot.stop()
+    
+    # 9. MODO DAEMON: fila em dia, segue roteando os arquivos novos conforme chegam
+    if SETUP["DAEMON"]:
+        total_samples_processed += run_daemon(status, negative_cache, shards, map_version, tuned)
+    
+    # 10. DRENAGEM: o que ficou pronto já foi gravado e o progresso está no bookmark; a VM já está parando
+    if DRAIN.requested:
+        logging.warning(f"🛑 Pipeline drenado ({DRAIN.reason}): {total_samples_processed:,} linhas gravadas; "
+                        f"o restante fica para a próxima execução.")
+        finalize_run_metrics("drained", drain_reason=DRAIN.reason, drain_rows_skipped=DRAIN.rows_skipped,
+                             total_samples_processed=total_samples_processed)
+        status.stop("drained")
+        exit(DRAIN_EXIT_CODE)
+    
     logging.info("="*60)
     logging.info("🎉 Pipeline OSRM concluído com sucesso!")
     logging.info(f"🗑️  Total de duplicatas removidas: {total_duplicates_removed:,}")
     logging.info("="*60)
-    shutdown_instance()
+    finalize_run_metrics("success", total_samples_processed=total_samples_processed,
+                         total_duplicates_removed=total_duplicates_removed)
+    status.stop("finished")
+    if not SETUP["DAEMON"]:
+        shutdown_instance()
 
 if __name__ == "__main__":
     run_pipeline()
\ No newline at end of file
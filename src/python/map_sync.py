@@ -0,0 +1,313 @@
+# map_sync.py - Sincroniza os arquivos do mapa OSRM com o S3, baixando só o que falta ou está corrompido
+#
+# Uso (recuperação do container, no lugar do `aws s3 cp --recursive`):
+#   python map_sync.py --s3-path s3://bucket/prefixo/            # confia no manifesto local (tamanho/mtime inalterados)
+#   python map_sync.py --s3-path s3://bucket/prefixo/ --verify   # reconfere o conteúdo de todos os arquivos locais
+#
+# Conteúdo conferido pelo ETag quando ele é o MD5 (sem criptografia ou SSE-S3). Com SSE-KMS/SSE-C o ETag não é o
+# MD5: vale o x-amz-checksum-* do objeto (SHA256, SHA1 ou CRC32) ou o SHA256 publicado em
+# <prefixo>/map_checksums.json ({caminho relativo: sha256 hex}); sem nenhum dos dois, só o tamanho.
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import os
+import sys
+import timeit
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError as BotoClientError
+
+from config import SETUP
+
+MANIFEST_NAME = ".map_manifest.json"
+REMOTE_CHECKSUMS_NAME = "map_checksums.json"
+# Criptografias em que o ETag deixa de ser o MD5 do conteúdo
+NON_MD5_ENCRYPTION = ("aws:kms", "aws:kms:dsse")
+
+
+class CRC32:
+    """CRC32 com a interface de hashlib (update/digest), no formato big-endian do x-amz-checksum-crc32."""
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def digest(self) -> bytes:
+        return self.value.to_bytes(4, "big")
+
+
+# x-amz-checksum-* que dá para recalcular sem dependência extra (CRC32C e CRC64NVME ficam só com o tamanho)
+CHECKSUM_ALGORITHMS = {"ChecksumSHA256": hashlib.sha256, "ChecksumSHA1": hashlib.sha1, "ChecksumCRC32": CRC32}
+
+
+def parse_s3_path(s3_path: str):
+    """s3://bucket/prefixo/ -> (bucket, prefixo)."""
+    if not s3_path.startswith("s3://"):
+        raise ValueError(f"caminho S3 inválido: {s3_path}")
+    bucket, _, prefix = s3_path[len("s3://"):].partition("/")
+    return bucket, prefix
+
+
+def list_remote_files(s3, bucket: str, prefix: str) -> dict:
+    """{caminho relativo: {"etag", "size", "key"}} dos objetos do mapa no S3."""
+    remote = {}
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            rel_path = obj['Key'][len(prefix):].lstrip('/')
+            if rel_path and rel_path != REMOTE_CHECKSUMS_NAME and not obj['Key'].endswith('/'):
+                remote[rel_path] = {"etag": obj['ETag'].strip('"'), "size": obj['Size'], "key": obj['Key']}
+    return remote
+
+
+def part_size_of(s3, bucket: str, key: str, sse_c: dict = None) -> int:
+    """Tamanho das partes do upload original, lido do HeadObject da parte 1 (`sse_c`: cabeçalhos da chave SSE-C).
+
+    Baixar em faixas com esse mesmo tamanho permite recompor o ETag (ou o checksum composto) durante o download.
+    """
+    return s3.head_object(Bucket=bucket, Key=key, PartNumber=1, **(sse_c or {}))['ContentLength']
+
+
+def combine_etag(part_md5s: list, multipart: bool = None) -> str:
+    """ETag do S3 a partir dos MD5 das partes (upload simples: o próprio MD5)."""
+    if not (len(part_md5s) > 1 if multipart is None else multipart):
+        return part_md5s[0].hexdigest()
+    return f"{hashlib.md5(b''.join(m.digest() for m in part_md5s)).hexdigest()}-{len(part_md5s)}"
+
+
+def combine_digest(part_hashes: list, reference: dict) -> str:
+    """Valor a comparar com `reference["value"]` a partir dos hashes das partes."""
+    if reference["kind"] == "etag":
+        return combine_etag(part_hashes, reference["composite"])
+    if reference["kind"] == "sha256":
+        return part_hashes[0].hexdigest()
+    if not reference["composite"]:
+        return base64.b64encode(part_hashes[0].digest()).decode()
+    combined = reference["factory"]()
+    combined.update(b''.join(h.digest() for h in part_hashes))
+    return f"{base64.b64encode(combined.digest()).decode()}-{len(part_hashes)}"
+
+
+def local_part_hashes(path: str, part_size: int, factory=hashlib.md5, chunk_mb: int = 8) -> list:
+    """Hashes (`factory`) de cada parte de `part_size` bytes de um arquivo local."""
+    part_hashes = []
+    buffer = bytearray(chunk_mb << 20)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            part_hash, remaining = factory(), part_size
+            while remaining:
+                n = f.readinto(memoryview(buffer)[:min(len(buffer), remaining)])
+                if not n:
+                    break
+                part_hash.update(memoryview(buffer)[:n])
+                remaining -= n
+            if remaining == part_size:
+                break
+            part_hashes.append(part_hash)
+            if remaining:
+                break
+    return part_hashes or [factory()]
+
+
+def local_etag(path: str, part_size: int, chunk_mb: int = 8) -> str:
+    """Recalcula o ETag de um arquivo local com o tamanho de parte do objeto no S3."""
+    return combine_etag(local_part_hashes(path, part_size, hashlib.md5, chunk_mb))
+
+
+class MapSync:
+    """Compara o mapa local com o S3 (manifesto local + ETag/checksum) e baixa só os arquivos faltantes ou divergentes.
+
+    O manifesto (`<map_dir>/.map_manifest.json`) guarda ETag, tamanho e mtime de cada arquivo verificado:
+    arquivo com o mesmo tamanho/mtime do manifesto e o mesmo ETag do S3 é aceito sem reler o disco.
+    Downloads em faixas paralelas (do tamanho das partes do upload original quando o ETag/checksum é composto,
+    recomposto na hora); o arquivo só substitui o antigo depois de conferido.
+    """
+
+    def __init__(self, map_dir: str = None, bucket: str = None, prefix: str = None, workers: int = None,
+                 sse_customer_key: str = None):
+        self.map_dir = map_dir or SETUP["OSRM_MAP_DIR"]
+        self.bucket = bucket or SETUP["MAP_S3_BUCKET"]
+        self.prefix = SETUP["MAP_S3_PREFIX"] if prefix is None else prefix
+        self.workers = workers or SETUP["MAP_SYNC_WORKERS"]
+        self.manifest_path = os.path.join(self.map_dir, MANIFEST_NAME)
+        self.s3 = boto3.client('s3')
+        # Objetos com SSE-C só são lidos com a chave do cliente
+        sse_customer_key = sse_customer_key or SETUP["MAP_SSE_C_KEY"]
+        self.sse_c = {"SSECustomerAlgorithm": "AES256", "SSECustomerKey": sse_customer_key} if sse_customer_key else {}
+        self.remote_checksums = {}
+        self._references = {}
+
+    def _load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self, manifest: dict):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _load_remote_checksums(self) -> dict:
+        """SHA256 publicados junto com o mapa (opcional; usados quando o ETag não é o MD5 e não há checksum)."""
+        key = f"{self.prefix.rstrip('/')}/{REMOTE_CHECKSUMS_NAME}".lstrip('/')
+        try:
+            return json.loads(self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read())
+        except BotoClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404', 'AccessDenied'):
+                return {}
+            raise
+
+    @staticmethod
+    def _stat(path: str):
+        try:
+            st = os.stat(path)
+            return st.st_size, int(st.st_mtime)
+        except FileNotFoundError:
+            return None, None
+
+    def _reference(self, rel_path: str, remote: dict) -> dict:
+        """Como conferir o conteúdo: ETag (MD5), x-amz-checksum-*, SHA256 publicado ou, sem nada disso, o tamanho.
+
+        {"kind", "value", "factory" (hash das partes), "composite", "part_size"}
+        """
+        if rel_path in self._references:
+            return self._references[rel_path]
+        head = self.s3.head_object(Bucket=self.bucket, Key=remote["key"], ChecksumMode='ENABLED', **self.sse_c)
+        checksum_field = next((f for f in CHECKSUM_ALGORITHMS if head.get(f)), None)
+        if head.get('ServerSideEncryption') not in NON_MD5_ENCRYPTION and not head.get('SSECustomerAlgorithm'):
+            reference = {"kind": "etag", "value": remote["etag"], "factory": hashlib.md5,
+                         "composite": "-" in remote["etag"]}
+        elif checksum_field:
+            reference = {"kind": "checksum", "value": head[checksum_field],
+                         "factory": CHECKSUM_ALGORITHMS[checksum_field],
+                         "composite": head.get('ChecksumType') == 'COMPOSITE' or "-" in head[checksum_field]}
+        elif rel_path in self.remote_checksums:
+            reference = {"kind": "sha256", "value": self.remote_checksums[rel_path], "factory": hashlib.sha256,
+                         "composite": False}
+        else:
+            logging.warning(f"⚠️  {rel_path}: ETag não é o MD5 ({head.get('ServerSideEncryption') or 'SSE-C'}) e não "
+                            f"há checksum nem SHA256 publicado; conferido só pelo tamanho.")
+            reference = {"kind": "size", "factory": hashlib.md5, "composite": False}
+        reference["part_size"] = (part_size_of(self.s3, self.bucket, remote["key"], self.sse_c)
+                                  if reference["composite"] else max(remote["size"], 1))
+        self._references[rel_path] = reference
+        return reference
+
+    def _matches(self, path: str, reference: dict, part_hashes: list = None) -> bool:
+        if reference["kind"] == "size":
+            return True
+        if part_hashes is None:
+            part_hashes = local_part_hashes(path, reference["part_size"], reference["factory"])
+        return combine_digest(part_hashes, reference) == reference["value"]
+
+    def _is_valid(self, rel_path: str, remote: dict, manifest: dict, verify: bool) -> bool:
+        path = os.path.join(self.map_dir, rel_path)
+        size, mtime = self._stat(path)
+        if size != remote["size"]:
+            return False
+        entry = manifest.get(rel_path)
+        if not verify and entry and entry == {"etag": remote["etag"], "size": size, "mtime": mtime}:
+            return True
+        return self._matches(path, self._reference(rel_path, remote))
+
+    def _download_part(self, key: str, tmp_path: str, offset: int, length: int, factory):
+        body = self.s3.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={offset}-{offset + length - 1}",
+                                  **self.sse_c)['Body']
+        part_hash = factory()
+        fd = os.open(tmp_path, os.O_WRONLY)
+        try:
+            position = offset
+            for chunk in body.iter_chunks(chunk_size=1 << 20):
+                part_hash.update(chunk)
+                os.pwrite(fd, chunk, position)
+                position += len(chunk)
+        finally:
+            os.close(fd)
+        if position - offset != length:
+            raise IOError(f"faixa incompleta de {key} em {offset}: {position - offset}/{length} bytes")
+        return part_hash
+
+    def _download(self, executor: ThreadPoolExecutor, rel_path: str, remote: dict):
+        path = os.path.join(self.map_dir, rel_path)
+        tmp_path = f"{path}.partial"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        reference = self._reference(rel_path, remote)
+        # Upload simples: faixas de MAP_SYNC_RANGE_MB e hash do arquivo inteiro no fim
+        part_size = reference["part_size"] if reference["composite"] else SETUP["MAP_SYNC_RANGE_MB"] << 20
+        with open(tmp_path, "wb") as f:
+            f.truncate(remote["size"])
+        try:
+            part_hashes = list(executor.map(
+                lambda offset: self._download_part(remote["key"], tmp_path, offset,
+                                                   min(part_size, remote["size"] - offset), reference["factory"]),
+                range(0, remote["size"], part_size)))
+            if not self._matches(tmp_path, reference, part_hashes if reference["composite"] else None):
+                raise IOError(f"{reference['kind']} divergente em {rel_path} (esperado {reference['value']})")
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+
+    def sync(self, verify: bool = False) -> dict:
+        """Deixa o diretório do mapa igual ao S3. Levanta exceção se algum arquivo não puder ser conferido."""
+        start = timeit.default_timer()
+        remote_files = list_remote_files(self.s3, self.bucket, self.prefix)
+        if not remote_files:
+            raise RuntimeError(f"Nenhum arquivo de mapa em s3://{self.bucket}/{self.prefix}")
+        self.remote_checksums = self._load_remote_checksums()
+        manifest = self._load_manifest()
+        os.makedirs(self.map_dir, exist_ok=True)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            checks = dict(zip(remote_files, executor.map(
+                lambda item: self._is_valid(item[0], item[1], manifest, verify), remote_files.items())))
+        to_download = [p for p, ok in checks.items() if not ok]
+        download_gb = sum(remote_files[p]["size"] for p in to_download) / (1024 ** 3)
+        logging.info(f"🗺️  Mapa: {len(remote_files) - len(to_download)}/{len(remote_files)} arquivo(s) íntegros; "
+                     f"baixando {len(to_download)} ({download_gb:.1f}GB)")
+
+        # Faixas de todos os arquivos no mesmo pool; um pool à parte coordena os arquivos
+        with ThreadPoolExecutor(max_workers=self.workers) as part_executor, \
+                ThreadPoolExecutor(max_workers=max(len(to_download), 1)) as file_executor:
+            list(file_executor.map(lambda p: self._download(part_executor, p, remote_files[p]), to_download))
+
+        for rel_path, remote in remote_files.items():
+            size, mtime = self._stat(os.path.join(self.map_dir, rel_path))
+            manifest[rel_path] = {"etag": remote["etag"], "size": size, "mtime": mtime}
+        manifest = {p: e for p, e in manifest.items() if p in remote_files}
+        self._save_manifest(manifest)
+
+        elapsed = timeit.default_timer() - start
+        logging.info(f"✅ Mapa sincronizado em {elapsed:.0f}s ({download_gb:.1f}GB baixados).")
+        return {"files": len(remote_files), "downloaded": len(to_download), "downloaded_gb": round(download_gb, 2),
+                "elapsed_s": round(elapsed, 1)}
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Sincroniza os arquivos do mapa OSRM com o S3")
+    parser.add_argument("--map-dir", default=SETUP["OSRM_MAP_DIR"])
+    parser.add_argument("--s3-path", default=f"s3://{SETUP['MAP_S3_BUCKET']}/{SETUP['MAP_S3_PREFIX']}",
+                        help="Origem do mapa (s3://bucket/prefixo/)")
+    parser.add_argument("--verify", action="store_true", help="Reconfere o conteúdo de todos os arquivos locais")
+    parser.add_argument("--workers", type=int, default=SETUP["MAP_SYNC_WORKERS"])
+    args = parser.parse_args()
+    try:
+        bucket, prefix = parse_s3_path(args.s3_path)
+        MapSync(args.map_dir, bucket, prefix, workers=args.workers).sync(verify=args.verify)
+    except Exception as e:
+        logging.error(f"❌ Falha na sincronização do mapa: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# metrics.py - Instrumentação leve: timers, contadores e histogramas de latência
+
+import json
+import math
+import logging
+import os
+import timeit
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+import boto3
+
+
+class LatencyHistogram:
+    """Histograma estilo HDR: buckets logarítmicos com erro relativo fixo, mesclável entre processos."""
+
+    def __init__(self, precision: float = 0.01, min_value: float = 0.01):
+        self.precision = precision
+        self.min_value = min_value
+        self._log_base = math.log1p(precision)
+        self.buckets = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value: float):
+        """Registra um valor (ms)."""
+        value = max(value, self.min_value)
+        idx = int(math.log(value / self.min_value) / self._log_base)
+        self.buckets[idx] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p: float) -> float:
+        """Retorna o percentil p (0-100) com erro relativo de `precision`."""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= target:
+                upper = self.min_value * math.exp((idx + 1) * self._log_base)
+                return min(upper, self.max)
+        return self.max
+
+    def merge(self, snapshot: dict):
+        """Soma um snapshot (dict) de outro histograma neste."""
+        if not snapshot or not snapshot["count"]:
+            return
+        for idx, n in snapshot["buckets"].items():
+            self.buckets[int(idx)] += n
+        self.count += snapshot["count"]
+        self.total += snapshot["total"]
+        self.min = snapshot["min"] if self.min is None else min(self.min, snapshot["min"])
+        self.max = snapshot["max"] if self.max is None else max(self.max, snapshot["max"])
+
+    def snapshot(self) -> dict:
+        return {
+            "buckets": dict(self.buckets), "count": self.count, "total": self.total,
+            "min": self.min, "max": self.max,
+        }
+
+    def summary(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3),
+            "min_ms": round(self.min, 3),
+            "p50_ms": round(self.percentile(50), 3),
+            "p90_ms": round(self.percentile(90), 3),
+            "p95_ms": round(self.percentile(95), 3),
+            "p99_ms": round(self.percentile(99), 3),
+            "p999_ms": round(self.percentile(99.9), 3),
+            "max_ms": round(self.max, 3),
+        }
+
+
+class RunMetrics:
+    """Agrega timers por etapa, contadores e histogramas. Snapshots são picklable para o Pool."""
+
+    def __init__(self):
+        self.timers = defaultdict(lambda: {"count": 0, "total_s": 0.0, "max_s": 0.0})
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(LatencyHistogram)
+        self.started_at = datetime.now().isoformat()
+
+    @contextmanager
+    def timer(self, name: str):
+        """Cronometra um bloco e acumula no timer `name`."""
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.add_time(name, timeit.default_timer() - start)
+
+    def add_time(self, name: str, seconds: float):
+        t = self.timers[name]
+        t["count"] += 1
+        t["total_s"] += seconds
+        t["max_s"] = max(t["max_s"], seconds)
+
+    def incr(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def observe(self, name: str, value_ms: float):
+        self.histograms[name].record(value_ms)
+
+    def snapshot(self) -> dict:
+        return {
+            "timers": {k: dict(v) for k, v in self.timers.items()},
+            "counters": dict(self.counters),
+            "histograms": {k: h.snapshot() for k, h in self.histograms.items()},
+        }
+
+    def merge(self, snapshot: dict):
+        """Mescla o snapshot de um worker (ou de outra execução) neste agregador."""
+        if not snapshot:
+            return
+        for name, t in snapshot.get("timers", {}).items():
+            mine = self.timers[name]
+            mine["count"] += t["count"]
+            mine["total_s"] += t["total_s"]
+            mine["max_s"] = max(mine["max_s"], t["max_s"])
+        for name, n in snapshot.get("counters", {}).items():
+            self.counters[name] += n
+        for name, h in snapshot.get("histograms", {}).items():
+            self.histograms[name].merge(h)
+
+    def summary(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "finished_at": datetime.now().isoformat(),
+            "stages": {
+                k: {"count": v["count"], "total_s": round(v["total_s"], 3), "max_s": round(v["max_s"], 3)}
+                for k, v in sorted(self.timers.items(), key=lambda kv: -kv[1]["total_s"])
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "latency": {k: h.summary() for k, h in self.histograms.items()},
+        }
+
+
+# Agregador do processo pai. Workers usam uma instância própria e devolvem snapshot.
+METRICS = RunMetrics()
+
+
+def log_metrics_summary(metrics: RunMetrics = METRICS):
+    """Resume no log o tempo gasto por etapa."""
+    summary = metrics.summary()
+    logging.info("⏱️  Tempo por etapa:")
+    for stage, t in summary["stages"].items():
+        logging.info(f"   {stage}: {t['total_s']:.2f}s ({t['count']}x, máx {t['max_s']:.2f}s)")
+    for name, h in summary["latency"].items():
+        if h["count"]:
+            logging.info(f"   {name}: p50={h['p50_ms']}ms p95={h['p95_ms']}ms p99={h['p99_ms']}ms (n={h['count']:,})")
+    fired = summary["counters"].get("osrm_hedges_fired", 0)
+    if fired:
+        won = summary["counters"].get("osrm_hedges_won", 0)
+        logging.info(f"   hedges: {fired:,} disparados, {won:,} vencedores ({won / fired:.0%})")
+
+
+def write_metrics_summary(bucket: str, prefix: str, run_id: str = None, extra: dict = None,
+                          metrics: RunMetrics = METRICS) -> str:
+    """Grava o resumo JSON da execução localmente e no S3 (ao lado dos logs do osrm_run.sh)."""
+    if run_id is None:
+        run_id = os.environ.get("OSRM_EXECUTION_ID") or datetime.now().strftime('%Y-%m-%d_%Y%m%d_%H%M%S')
+    summary = metrics.summary()
+    if extra:
+        summary.update(extra)
+
+    local_path = f"osrm_metrics_{run_id}.json"
+    s3_key = f"{prefix.rstrip('/')}/{run_id}_metrics.json"
+    try:
+        with open(local_path, "w") as f:
+            json.dump(summary, f, indent=2, default=str)
+        boto3.client('s3').upload_file(local_path, bucket, s3_key)
+        os.remove(local_path)
+        logging.info(f"📈 Métricas da execução salvas em s3://{bucket}/{s3_key}")
+    except Exception as e:
+        logging.warning(f"⚠️  Falha ao salvar métricas da execução: {e}")
+    return s3_key
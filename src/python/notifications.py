@@ -0,0 +1,160 @@
+# notifications.py - Fontes de "arquivo novo na source" para o modo daemon (SQS de eventos do S3 ou diretório local)
+
+import json
+import logging
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from urllib.parse import unquote_plus
+
+import boto3
+
+from config import SETUP
+
+
+@dataclass
+class FileEvent:
+    """Um arquivo .parquet novo. `landed_at` (epoch) é a referência da métrica de frescor."""
+    key: str
+    partition: str
+    landed_at: float
+    last_modified: str
+    bucket: str = None
+    local_path: str = None
+    receipt: str = None
+
+
+def partition_of(key: str) -> str:
+    """Partição YYYY-MM a partir do diretório do arquivo (layout da source: <prefixo>/<YYYY-MM>/<arquivo>)."""
+    name = os.path.basename(os.path.dirname(key))
+    if len(name) == 7 and name[4] == '-':
+        return name
+    return datetime.now().strftime('%Y-%m')
+
+
+class SQSNotificationSource:
+    """Fila SQS assinada nos eventos ObjectCreated do bucket da source (direto ou embrulhados pelo SNS).
+
+    Mensagens sem arquivo relevante (s3:TestEvent, outros prefixos) são confirmadas e descartadas; mensagens
+    não confirmadas voltam para a fila depois de DAEMON_SQS_VISIBILITY_SECONDS.
+    """
+
+    def __init__(self, queue_url: str = None):
+        self.queue_url = queue_url or SETUP["DAEMON_SQS_QUEUE_URL"]
+        if not self.queue_url:
+            raise ValueError("OSRM_DAEMON_QUEUE_URL não configurada para o modo daemon com SQS")
+        self.sqs = boto3.client('sqs')
+
+    @staticmethod
+    def _records(body: dict) -> list:
+        if "Message" in body:
+            body = json.loads(body["Message"])
+        return body.get("Records", [])
+
+    def receive(self, max_files: int, wait_seconds: float) -> list:
+        response = self.sqs.receive_message(
+            QueueUrl=self.queue_url, MaxNumberOfMessages=min(max_files, 10),
+            WaitTimeSeconds=int(min(max(wait_seconds, 0), 20)),
+            VisibilityTimeout=SETUP["DAEMON_SQS_VISIBILITY_SECONDS"])
+        events, ignored = [], []
+        for message in response.get('Messages', []):
+            try:
+                records = self._records(json.loads(message['Body']))
+            except (json.JSONDecodeError, TypeError):
+                records = []
+            found = False
+            for record in records:
+                if not record.get("eventName", "").startswith("ObjectCreated"):
+                    continue
+                key = unquote_plus(record["s3"]["object"]["key"])
+                if not key.startswith(SETUP["input_s3_base_prefix"]) or not key.endswith(".parquet"):
+                    continue
+                event_time = datetime.fromisoformat(record["eventTime"].replace("Z", "+00:00"))
+                events.append(FileEvent(key=key, partition=partition_of(key), landed_at=event_time.timestamp(),
+                                        last_modified=event_time.isoformat(),
+                                        bucket=record["s3"]["bucket"]["name"], receipt=message['ReceiptHandle']))
+                found = True
+            if not found:
+                ignored.append(message['ReceiptHandle'])
+        if ignored:
+            logging.info(f"📭 {len(ignored)} notificação(ões) sem arquivo da source descartada(s).")
+        for receipt in ignored:
+            self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt)
+        return events
+
+    def ack(self, events: list):
+        for receipt in {e.receipt for e in events}:
+            self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt)
+
+    def nack(self, events: list):
+        # Volta para a fila na hora em vez de esperar o visibility timeout
+        for receipt in {e.receipt for e in events}:
+            self.sqs.change_message_visibility(QueueUrl=self.queue_url, ReceiptHandle=receipt, VisibilityTimeout=0)
+
+
+class DirectoryNotificationSource:
+    """Substituto local da fila: observa `<dir>/<YYYY-MM>/*.parquet` (ou arquivos soltos, no mês corrente).
+
+    Um arquivo só entra depois de DAEMON_WATCH_SETTLE_SECONDS sem alteração (cópia em andamento). Confirmados
+    vão para `<dir>/processed/`; os devolvidos com `nack` voltam a ser oferecidos na próxima consulta.
+    """
+
+    PROCESSED_DIR = "processed"
+
+    def __init__(self, watch_dir: str = None):
+        self.watch_dir = watch_dir or SETUP["DAEMON_WATCH_DIR"]
+        os.makedirs(os.path.join(self.watch_dir, self.PROCESSED_DIR), exist_ok=True)
+        self._in_flight = set()
+
+    def _scan(self) -> list:
+        settle = SETUP["DAEMON_WATCH_SETTLE_SECONDS"]
+        found = []
+        for root, dirs, files in os.walk(self.watch_dir):
+            dirs[:] = [d for d in dirs if d != self.PROCESSED_DIR]
+            for name in files:
+                path = os.path.join(root, name)
+                if not name.endswith(".parquet") or path in self._in_flight:
+                    continue
+                try:
+                    mtime = os.stat(path).st_mtime
+                except FileNotFoundError:
+                    continue
+                if time.time() - mtime >= settle:
+                    found.append((mtime, path))
+        return sorted(found)
+
+    def receive(self, max_files: int, wait_seconds: float) -> list:
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            found = self._scan()[:max_files]
+            if found or time.monotonic() >= deadline:
+                break
+            time.sleep(min(SETUP["DAEMON_POLL_SECONDS"], max(deadline - time.monotonic(), 0)))
+        events = []
+        for mtime, path in found:
+            self._in_flight.add(path)
+            rel_path = os.path.relpath(path, self.watch_dir)
+            events.append(FileEvent(key=rel_path, partition=partition_of(rel_path), landed_at=mtime,
+                                    last_modified=datetime.fromtimestamp(mtime).astimezone().isoformat(),
+                                    local_path=path))
+        return events
+
+    def ack(self, events: list):
+        for event in events:
+            target = os.path.join(self.watch_dir, self.PROCESSED_DIR, event.key)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(event.local_path, target)
+            self._in_flight.discard(event.local_path)
+
+    def nack(self, events: list):
+        for event in events:
+            self._in_flight.discard(event.local_path)
+
+
+def notification_source():
+    """Fonte configurada em DAEMON_SOURCE ("sqs" ou "dir")."""
+    if SETUP["DAEMON_SOURCE"] == "dir":
+        return DirectoryNotificationSource()
+    return SQSNotificationSource()
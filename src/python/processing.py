@@ -10,11 +10,27 @@ import os
 import subprocess
 import requests
 import json
+import glob
+import hashlib
+import shutil
+import signal
 import warnings
 from multiprocessing import Pool, cpu_count
 from contextlib import contextmanager
+from typing import List
 
 from config import SETUP, StartEndPair 
+from metrics import METRICS, RunMetrics
+from tracing import TRACER, Tracer
+from profiling import profile_stage
+from backends import ShardRouter, new_client
+from failures import classify_failure, RETRY_POLICY, PERMANENT, CONNECTION, TIMEOUT
+from circuit import SharedCircuit, CircuitMonitor, OSRMUnavailableError
+from error_reporting import ErrorAggregator, queue_logging, configure_worker_logging
+from hints import HINT_CACHE, poc_key
+from hedging import HedgePolicy
+from libosrm_backend import LibOSRMRouter
+from drain import DRAIN
 
 # --- OSRM E REQUISIÇÕES PARALELAS ---
 
@@ -38,68 +54,239 @@ def make_list_of_coords(df):
     return df.to_dict(orient='records')
 
 
-async def get_client() -> osrm.AioHTTPClient:
-    """Cria e retorna o cliente assíncrono OSRM."""
-    return osrm.AioHTTPClient(host='http://localhost:5000', max_retries=10, timeout=10)
+# Estado do worker do Pool (definido por _init_worker / process_chunk)
+_PROGRESS = None
+_CIRCUIT = None
+_WORKER_IDX = 0
+_CONSECUTIVE_DOWN = 0
+_ERRORS = ErrorAggregator()
+_HINTS = None
+_NEW_HINTS = {}
+_DRAIN = None
+_BUSY = False
 
-async def async_request(point: dict, client: osrm.AioHTTPClient = None, max_retries: int = 5):
-    """Faz uma única requisição assíncrona ao OSRM com retries."""
+def _on_worker_sigterm(signum, frame):
+    # Desligamento da VM manda SIGTERM a todos os processos: com um bloco em andamento, o worker segue até o
+    # pai drenar (o pedido chega pelo estado compartilhado); ocioso, sai como no comportamento padrão
+    if not _BUSY:
+        os._exit(128 + signum)
+
+def _init_worker(progress=None, circuit=None, log_queue=None, hints=None, drain=None):
+    """Initializer do Pool: contadores do status ao vivo, circuit breaker compartilhado, fila de log do pai,
+    hints de POC já conhecidos (None desativa o cache de hints) e o pedido de drenagem do pai."""
+    global _PROGRESS, _CIRCUIT, _HINTS, _DRAIN
+    _PROGRESS = progress
+    _CIRCUIT = circuit
+    _HINTS = hints
+    _DRAIN = drain
+    signal.signal(signal.SIGTERM, _on_worker_sigterm)
+    configure_worker_logging(log_queue)
+
+def _track(field: str, n: int = 1):
+    """Atualiza o slot deste worker no progresso compartilhado (no-op sem status ativo)."""
+    if _PROGRESS is not None:
+        _PROGRESS.add(field, _WORKER_IDX, n)
+
+
+async def get_client(host: str = None) -> osrm.AioHTTPClient:
+    """Cria e retorna o cliente assíncrono OSRM (por padrão, o primeiro de SETUP['OSRM_HOSTS'])."""
+    return new_client(host or SETUP["OSRM_HOSTS"][0])
+
+async def async_request(point: dict, router: ShardRouter, max_retries: int = 5,
+                        metrics: RunMetrics = None, hedge: HedgePolicy = None):
+    """Faz uma única requisição assíncrona ao OSRM, com retries conforme a classe da falha (failures.py).
+
+    Linhas com `_shard` vão para o shard regional; a última tentativa sempre usa a instância nacional,
+    assim como a confirmação de uma falha permanente vinda do shard (o extrato pode ter cortado a rota).
+    Em falha definitiva devolve o par com `failure_class` para o relatório de não roteáveis.
+    Com o circuito aberto (OSRM fora do ar), a requisição espera a volta do servidor sem gastar tentativas.
+    Na instância nacional, o hint do POC em cache é enviado para o OSRM pular o snap da origem.
+    """
+    global _CONSECUTIVE_DOWN
     start_coords = [point[c] for c in SETUP["start_coordinates"]]
     end_coords = [point[c] for c in SETUP["end_coordinates"]]
+    shard = point.get("_shard")
+    metrics = metrics or RunMetrics()
+    failed_backend = None
+    failure_class = None
+    attempt = 0
+    columns = SETUP["metadata_columns"] + SETUP["start_coordinates"] + SETUP["end_coordinates"]
+    hint_key = poc_key(*start_coords) if _HINTS is not None else None
     
-    for attempt in range(1, max_retries + 1):
+    while True:
+        if _CIRCUIT is not None and not await _CIRCUIT.wait_closed():
+            return {**{k: point[k] for k in columns}, "failure_class": CONNECTION}
+        attempt += 1
+        if attempt > 1:
+            metrics.incr("osrm_retries")
+        last_try = failure_class is not None and \
+            attempt >= min(RETRY_POLICY[failure_class]["max_attempts"], max_retries)
+        backends = router.pool_for(shard, fallback=last_try or failure_class in PERMANENT)
+        if shard and backends is router.national:
+            metrics.incr("osrm_shard_fallback")
+        route_kwargs = {}
+        use_hint = hint_key is not None and backends is router.national
+        if use_hint and hint_key in _HINTS:
+            route_kwargs["hints"] = [_HINTS[hint_key], None]
+            metrics.incr("osrm_hint_hits")
+        request_start = timeit.default_timer()
         try:
-            response = await client.route(coordinates=[start_coords, end_coords], overview=osrm.overview.false)
+            response = await backends.route([start_coords, end_coords], hedge=hedge, avoid=failed_backend,
+                                            **route_kwargs)
+            metrics.observe("osrm_request_ms", (timeit.default_timer() - request_start) * 1000)
+            metrics.incr("osrm_requests_ok")
+            _CONSECUTIVE_DOWN = 0
+            if use_hint and "hints" not in route_kwargs and response.get("waypoints"):
+                hint = response["waypoints"][0].get("hint")
+                if hint:
+                    _HINTS[hint_key] = _NEW_HINTS[hint_key] = hint
+                    metrics.incr("osrm_hint_captured")
             return {
                 **{k: point[k] for k in SETUP["metadata_columns"]},
                 "distance": float(response['routes'][0]['distance']),
                 "duration": float(response['routes'][0]['duration'])
             }
         except Exception as e:
-            logging.error(f"Error OSRM. {e}. Coords: {start_coords} -> {end_coords}")
-            if attempt < max_retries:
-                await asyncio.sleep(0.1 * (2 ** attempt))
-                if "disconnected" in str(e).lower(): 
-                    client = await get_client()
-                if "no route" in str(e).lower(): 
-                    return None
-            else:
-                logging.error(f"Falha permanente após {max_retries} tentativas.")
-                return None
-
-async def batch_request(points: List[StartEndPair], max_concurrent = 100):
-    """Gerencia requisições assíncronas em paralelo com limite de concorrência."""
-    client = await get_client()
-    semaphore = asyncio.Semaphore(max_concurrent)
+            failed_backend = getattr(e, "osrm_backend", None)
+            failure_class = classify_failure(e)
+            metrics.observe("osrm_failed_attempt_ms", (timeit.default_timer() - request_start) * 1000)
+            metrics.incr(f"osrm_failure_{failure_class}")
+            _ERRORS.record(failure_class, getattr(failed_backend, 'host', '?'), start_coords, end_coords, str(e))
+            if failure_class in PERMANENT and shard and backends is not router.national:
+                continue
+            if _CIRCUIT is not None and failure_class in (CONNECTION, TIMEOUT):
+                _CONSECUTIVE_DOWN += 1
+                if _CONSECUTIVE_DOWN >= SETUP["CIRCUIT_TRIP_AFTER"]:
+                    _CIRCUIT.trip(f"{_CONSECUTIVE_DOWN} falhas de {failure_class} seguidas no worker {_WORKER_IDX}")
+                if _CIRCUIT.is_open:
+                    # Queda geral: a tentativa não conta; espera o servidor voltar e repete no mesmo bloco
+                    metrics.incr("osrm_held_by_circuit")
+                    attempt -= 1
+                    failed_backend = None
+                    if await _CIRCUIT.wait_closed():
+                        _CONSECUTIVE_DOWN = 0
+                        router.reset_health()
+                    continue
+            policy = RETRY_POLICY[failure_class]
+            if attempt >= min(policy["max_attempts"], max_retries):
+                if failure_class not in PERMANENT:
+                    _ERRORS.record("gave_up", getattr(failed_backend, 'host', '?'), start_coords, end_coords,
+                                   f"{failure_class} após {attempt} tentativa(s)")
+                metrics.incr("osrm_requests_failed")
+                return {**{k: point[k] for k in columns}, "failure_class": failure_class}
+            _track("retrying", 1)
+            await asyncio.sleep(policy["backoff_s"] * (2 ** (attempt - 1)))
+            _track("retrying", -1)
+
+async def batch_request(points: List[StartEndPair], max_concurrent = 100, metrics: RunMetrics = None):
+    """Despacha as requisições com `max_concurrent` consumidores fixos.
+
+    Cada consumidor puxa o próximo índice de um iterador compartilhado e grava no buffer de
+    resultados pré-alocado: a memória de tarefas/coroutines não cresce com o tamanho do bloco.
+    Com ROUTING_BACKEND == "libosrm", as rotas saem do libosrm no próprio worker (libosrm_backend.py).
+    Com drenagem pedida, nenhum índice novo é despachado; passada a carência, o que está em voo é cancelado.
+    Retorna (resultados, falhas definitivas, nº de pares não roteados pela drenagem).
+    """
+    metrics = metrics or RunMetrics()
+    if SETUP["ROUTING_BACKEND"] == "libosrm":
+        router = await LibOSRMRouter().open()
+    else:
+        router = await ShardRouter(SETUP["OSRM_SHARD_HOSTS"]).open()
+    hedge = HedgePolicy(metrics)
+    output = [None] * len(points)
+    pending = iter(range(len(points)))
     
-    async def limited_request(point):
-        async with semaphore: 
-            return await async_request(point, client)
-            
-    tasks = [limited_request(point) for point in points]
-    output = await asyncio.gather(*tasks)
-    await client.close()
+    async def consumer():
+        for i in pending:
+            if _DRAIN is not None and _DRAIN.requested:
+                break
+            _track("in_flight", 1)
+            try:
+                output[i] = await async_request(points[i], router, metrics=metrics, hedge=hedge)
+            finally:
+                _track("in_flight", -1)
+                _track("completed", 1)
+    
+    consumers = asyncio.gather(*[consumer() for _ in range(min(max_concurrent, len(points)))])
+    try:
+        while not consumers.done():
+            await asyncio.wait([consumers], timeout=1.0)
+            if _DRAIN is not None and _DRAIN.expired and not consumers.done():
+                consumers.cancel()
+        try:
+            await consumers
+        except asyncio.CancelledError:
+            pass
+    finally:
+        await router.close()
+        _ERRORS.flush()
     
-    return [x for x in output if x is not None]
+    finished = [x for x in output if x is not None]
+    failures = [x for x in finished if "failure_class" in x]
+    return [x for x in finished if "failure_class" not in x], failures, len(output) - len(finished)
+
+def process_chunk(chunk: List[StartEndPair], max_concurrent = 100, worker_idx: int = 0):
+    """Função wrapper para rodar o asyncio dentro do Processo.
 
-def process_chunk(chunk: List[StartEndPair], max_concurrent = 100):
-    """Função wrapper para rodar o asyncio dentro do Processo."""
-    return asyncio.run(batch_request(chunk, max_concurrent=max_concurrent))
+    Devolve os resultados junto com o snapshot de métricas e os eventos de trace do worker.
+    """
+    global _WORKER_IDX, _CONSECUTIVE_DOWN, _ERRORS, _NEW_HINTS, _BUSY
+    _WORKER_IDX = worker_idx
+    _CONSECUTIVE_DOWN = 0
+    _ERRORS = ErrorAggregator(worker_idx)
+    _NEW_HINTS = {}
+    metrics = RunMetrics()
+    tracer = Tracer(enabled=TRACER.enabled, process_name=f"worker {worker_idx}")
+    _BUSY = True
+    try:
+        with metrics.timer("worker_routing"), tracer.span("route_block", worker=worker_idx, rows=len(chunk)), \
+                profile_stage("batch_request", tag=f"worker{worker_idx}"):
+            output, failures, skipped = asyncio.run(batch_request(chunk, max_concurrent=max_concurrent,
+                                                                  metrics=metrics))
+    finally:
+        _BUSY = False
+    return {"results": output, "failures": failures, "skipped": skipped, "hints": _NEW_HINTS,
+            "metrics": metrics.snapshot(), "trace": tracer.events}
 
 def chunk_list(lst, n):
     """Divide a lista em N pedaços para N processos."""
     k, m = divmod(len(lst), n)
     return [lst[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n)]
 
-def parallel_osrm_requests(points: List[StartEndPair], num_processes=None, max_concurrent=100):
-    """Orquestra as requisições paralelas usando Pool de processos."""
+def parallel_osrm_requests(points: List[StartEndPair], num_processes=None, max_concurrent=100, progress=None,
+                           metrics: RunMetrics = METRICS, failures: list = None, hints: bool = True):
+    """Orquestra as requisições paralelas usando Pool de processos.
+
+    `progress` (status.SharedProgress) recebe os contadores ao vivo de cada worker;
+    `metrics` recebe os snapshots dos workers (a calibração usa um agregador próprio);
+    `failures`, se informado, recebe os pares que falharam em definitivo (com `failure_class`);
+    `hints=False` não usa nem alimenta o cache de hints (rotas sintéticas do aquecimento).
+    Levanta OSRMUnavailableError se o circuit breaker desistir: o bloco não é gravado pela metade.
+    Com drenagem (drain.py), devolve só os pares concluídos; os demais somam em DRAIN.rows_skipped.
+    """
     if num_processes is None: num_processes = cpu_count()
     chunks = chunk_list(points, num_processes)
+    if progress is not None and progress.num_workers < num_processes:
+        progress = None
     
-    with Pool(processes=num_processes) as pool:
-        results_nested = pool.starmap(process_chunk, [(chunk, max_concurrent) for chunk in chunks])
-        
-    return [item for sublist in results_nested for item in sublist]
+    circuit = SharedCircuit()
+    with queue_logging() as log_queue, CircuitMonitor(circuit), \
+            Pool(processes=num_processes, initializer=_init_worker,
+                 initargs=(progress, circuit, log_queue,
+                           HINT_CACHE.hints if SETUP["HINT_CACHE"] and hints else None, DRAIN)) as pool:
+        results_nested = pool.starmap(process_chunk, [(chunk, max_concurrent, idx) for idx, chunk in enumerate(chunks)])
+    if circuit.state == SharedCircuit.FAILED:
+        raise OSRMUnavailableError(f"OSRM indisponível por mais de {SETUP['CIRCUIT_MAX_OPEN_SECONDS']}s; bloco abortado")
+    
+    for worker_output in results_nested:
+        metrics.merge(worker_output["metrics"])
+        TRACER.extend(worker_output["trace"])
+        HINT_CACHE.update(worker_output["hints"])
+        if failures is not None:
+            failures.extend(worker_output["failures"])
+    DRAIN.note_skipped(sum(worker_output["skipped"] for worker_output in results_nested))
+    
+    return [item for worker_output in results_nested for item in worker_output["results"]]
 
 # --- VERIFICAÇÕES DE AMBIENTE ---
 
@@ -135,8 +322,31 @@ def check_disk_space():
     
     return True
 
+def get_instance_type() -> str:
+    """Tipo da instância EC2 via metadados (fallback: descrição local de CPUs)."""
+    try:
+        r = requests.get('http://169.254.169.254/latest/meta-data/instance-type', timeout=2)
+        if r.status_code == 200 and r.text:
+            return r.text.strip()
+    except requests.exceptions.RequestException:
+        pass
+    return f"local-{cpu_count()}cpu"
+
+def get_map_version() -> str:
+    """Identifica a versão do mapa OSRM (OSRM_MAP_VERSION ou hash de nome/tamanho/mtime dos arquivos .osrm*)."""
+    if os.environ.get("OSRM_MAP_VERSION"):
+        return os.environ["OSRM_MAP_VERSION"]
+    files = sorted(glob.glob(os.path.join(SETUP["OSRM_MAP_DIR"], "*.osrm*")))
+    if not files:
+        return "unknown"
+    fingerprint = "|".join(f"{os.path.basename(f)}:{os.path.getsize(f)}:{int(os.path.getmtime(f))}" for f in files)
+    return hashlib.md5(fingerprint.encode()).hexdigest()[:12]
+
 def shutdown_instance():
     """Auto-desliga a instância com tratamento robusto de erros."""
+    if SETUP["SHUTDOWN_MODE"] == "hibernate":
+        logging.info("🛌 Nenhum trabalho restante. A hibernação fica a cargo do osrm_run.sh (após dedupe e upload do log).")
+        return
     logging.info("Nenhum trabalho restante. Iniciando auto-desligamento da instância...")
     try:
         r = requests.get('http://169.254.169.254/latest/meta-data/instance-id', timeout=10)
@@ -0,0 +1,78 @@
+# profiling.py - Ganchos de profiling por etapa (cProfile + tracemalloc), ligados por configuração
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import SETUP
+
+
+def _reserve_slot(stage: str):
+    """Reserva atomicamente um dos PROFILE_MAX_REPORTS slots da etapa (None se esgotados).
+
+    O slot é o arquivo {stage}_slot{n} criado com O_CREAT|O_EXCL: workers concorrentes do pool nunca
+    ficam com o mesmo número, ao contrário de contar relatórios já gravados antes de escrever.
+    """
+    os.makedirs(SETUP["PROFILE_DIR"], exist_ok=True)
+    for n in range(SETUP["PROFILE_MAX_REPORTS"]):
+        try:
+            os.close(os.open(os.path.join(SETUP["PROFILE_DIR"], f"{stage}_slot{n}"), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return n
+        except FileExistsError:
+            continue
+    return None
+
+
+@contextmanager
+def profile_stage(stage: str, tag: str = ""):
+    """Envolve a etapa com cProfile e snapshots do tracemalloc se ela estiver em SETUP['PROFILE_STAGES'].
+
+    Grava até PROFILE_MAX_REPORTS relatórios por etapa em PROFILE_DIR (slot n reservado em _reserve_slot;
+    apague os {stage}_slot* junto com os relatórios para liberar novos):
+      - {stage}_{n}_{tag}_{ts}.prof     (pstats binário, para snakeviz/gprof2dot)
+      - {stage}_{n}_{tag}_{ts}_cpu.txt  (top funções por tempo acumulado)
+      - {stage}_{n}_{tag}_{ts}_mem.txt  (top alocações da etapa e pico de memória)
+    """
+    slot = _reserve_slot(stage) if stage in SETUP["PROFILE_STAGES"] else None
+    if slot is None:
+        yield
+        return
+
+    started_tracemalloc = not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start(10)
+    tracemalloc.reset_peak()
+    mem_before = tracemalloc.take_snapshot()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        mem_after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracemalloc:
+            tracemalloc.stop()
+
+        name = "_".join(x for x in [stage, str(slot), tag or f"pid{os.getpid()}", datetime.now().strftime('%Y%m%d%H%M%S%f')] if x)
+        base = os.path.join(SETUP["PROFILE_DIR"], name)
+        try:
+            profiler.dump_stats(f"{base}.prof")
+
+            cpu_report = io.StringIO()
+            pstats.Stats(profiler, stream=cpu_report).sort_stats("cumulative").print_stats(40)
+            with open(f"{base}_cpu.txt", "w") as f:
+                f.write(cpu_report.getvalue())
+
+            with open(f"{base}_mem.txt", "w") as f:
+                f.write(f"Pico de memória rastreada na etapa: {peak / 1024**2:.1f}MB\n\n")
+                for diff in mem_after.compare_to(mem_before, "lineno")[:30]:
+                    f.write(f"{diff}\n")
+            logging.info(f"🔬 Profiling de '{stage}' salvo em {base}_*.txt")
+        except Exception as e:
+            logging.warning(f"⚠️  Falha ao gravar profiling de '{stage}': {e}")
@@ -1,10 +1,13 @@
 # s3_io.py - CÓDIGO FINAL E CORRIGIDO
 
 import boto3
+import io
 import json
 import logging
 import os
+import random
 import shutil
+import time
 from datetime import datetime, timedelta
 from typing import List, Dict
 from pytz import timezone
@@ -47,16 +50,24 @@ def get_processed_bookmark(bucket, key) -> Dict:
         logging.error(f"Erro ao ler bookmark: {e}")
         return {"completed_partitions": [], "delta_timestamps": {}}
 
-def update_processed_bookmark(bucket, key, completed_partition: str = None, delta_timestamp: str = None, partition_name: str = None):
-    """Atualiza bookmark com validação."""
-    s3 = boto3.client('s3')
-    bookmark = get_processed_bookmark(bucket, key)
-    
+# Conflito de escrita condicional (outro processo gravou o bookmark entre a leitura e a escrita)
+CONDITIONAL_WRITE_CONFLICTS = ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409')
+BOOKMARK_WRITE_ATTEMPTS = 10
+
+
+def _apply_bookmark_update(bookmark, completed_partition, delta_timestamp, partition_name, checkpoint):
     if completed_partition:
         if completed_partition not in bookmark.get("completed_partitions", []):
              bookmark["completed_partitions"].append(completed_partition)
              bookmark["completed_partitions"].sort()
         bookmark["delta_timestamps"].pop(completed_partition, None)
+        bookmark.get("checkpoints", {}).pop(completed_partition, None)
+    
+    if checkpoint is not None and partition_name:
+        if checkpoint:
+            bookmark.setdefault("checkpoints", {})[partition_name] = checkpoint
+        else:
+            bookmark.get("checkpoints", {}).pop(partition_name, None)
 
     if delta_timestamp and partition_name:
         current_ts = bookmark["delta_timestamps"].get(partition_name)
@@ -64,13 +75,57 @@ def update_processed_bookmark(bucket, key, completed_partition: str = None, delt
             bookmark["delta_timestamps"][partition_name] = delta_timestamp
     
     bookmark["last_updated"] = datetime.now(timezone('UTC')).isoformat()
-    
+    return bookmark
+
+def update_processed_bookmark(bucket, key, completed_partition: str = None, delta_timestamp: str = None, partition_name: str = None,
+                              checkpoint: dict = None):
+    """Atualiza bookmark com validação. `checkpoint` grava o progresso parcial de `partition_name` ({} o remove).
+
+    Leitura-alteração-escrita condicional (If-Match no ETag lido; If-None-Match no primeiro bookmark): se outro
+    processo (execução agendada, workers do modo distribuído, daemon) gravou no meio, relê e reaplica.
+    """
+    s3 = boto3.client('s3')
+    for attempt in range(1, BOOKMARK_WRITE_ATTEMPTS + 1):
+        try:
+            obj = s3.get_object(Bucket=bucket, Key=key)
+            bookmark, condition = json.loads(obj['Body'].read().decode('utf-8')), {"IfMatch": obj['ETag']}
+        except BotoClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchKey':
+                raise
+            logging.warning(f"Arquivo de bookmark não encontrado. Criando novo.")
+            bookmark, condition = {"completed_partitions": [], "delta_timestamps": {}}, {"IfNoneMatch": '*'}
+        
+        bookmark = _apply_bookmark_update(bookmark, completed_partition, delta_timestamp, partition_name, checkpoint)
+        try:
+            s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(bookmark, indent=2), **condition)
+            logging.info(f"✅ Bookmark atualizado em s3://{bucket}/{key}")
+            return
+        except BotoClientError as e:
+            if e.response['Error']['Code'] not in CONDITIONAL_WRITE_CONFLICTS:
+                logging.error(f"❌ CRÍTICO: Falha ao salvar bookmark: {e}")
+                raise
+            logging.info(f"🔁 Bookmark alterado por outro processo; reaplicando (tentativa {attempt}).")
+            time.sleep(random.uniform(0.2, 1.0) * attempt)
+    raise RuntimeError(f"CRÍTICO: bookmark s3://{bucket}/{key} em conflito após {BOOKMARK_WRITE_ATTEMPTS} tentativas")
+
+def get_run_plan(bucket, key, max_age_hours: float):
+    """Estimativa de backlog gravada pela Lambda no START (None se ausente, ilegível ou antiga)."""
+    s3 = boto3.client('s3')
     try:
-        s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(bookmark, indent=2))
-        logging.info(f"✅ Bookmark atualizado em s3://{bucket}/{key}")
+        obj = s3.get_object(Bucket=bucket, Key=key)
+        run_plan = json.loads(obj['Body'].read().decode('utf-8'))
+        generated_at = datetime.fromisoformat(run_plan["generated_at"])
+    except BotoClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            logging.warning(f"⚠️  Falha ao ler a estimativa de backlog: {e}")
+        return None
     except Exception as e:
-        logging.error(f"❌ CRÍTICO: Falha ao salvar bookmark: {e}")
-        raise
+        logging.warning(f"⚠️  Estimativa de backlog inválida: {e}")
+        return None
+    if datetime.now(timezone('UTC')) - generated_at > timedelta(hours=max_age_hours):
+        logging.info(f"Estimativa de backlog de {run_plan['generated_at']} ignorada (mais de {max_age_hours}h).")
+        return None
+    return run_plan
 
 # --- ARQUIVOS S3 I/O ---
 
@@ -87,6 +142,57 @@ def list_s3_objects(bucket, prefix=''):
                 files.append({'Key': obj['Key'], 'LastModified': obj['LastModified'].isoformat()})
     return files
 
+class S3RangeFile(io.RawIOBase):
+    """Arquivo somente-leitura sobre um objeto S3, lido por GETs com Range (ex.: só o rodapé de um parquet)."""
+
+    def __init__(self, bucket, key):
+        self.s3 = boto3.client('s3')
+        self.bucket, self.key = bucket, key
+        self.size = self.s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = max(base + offset, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size or not len(buffer):
+            return 0
+        end = min(self.position + len(buffer), self.size) - 1
+        data = self.s3.get_object(Bucket=self.bucket, Key=self.key,
+                                  Range=f"bytes={self.position}-{end}")['Body'].read()
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def parquet_num_rows(bucket, key) -> int:
+    """Nº de linhas de um parquet no S3 lendo só o rodapé (metadados), sem baixar o arquivo."""
+    import pyarrow.parquet as pq
+    with S3RangeFile(bucket, key) as f:
+        return pq.ParquetFile(f).metadata.num_rows
+
+def download_partition_file(bucket_name, file_key, local_path):
+    """Baixa um único arquivo."""
+    s3 = boto3.client('s3')
+    try:
+        s3.download_file(bucket_name, file_key, local_path)
+        logging.info(f"Downloaded: s3://{bucket_name}/{file_key} -> {local_path}")
+        return True
+    except Exception as e:
+        logging.error(f"❌ Erro no download de {file_key}: {e}")
+        return False
+
 def check_file_exists_s3(bucket: str, key: str) -> bool:
     """Verifica se arquivo existe no S3."""
     s3 = boto3.client('s3')
@@ -0,0 +1,157 @@
+# status.py - Status ao vivo da execução (arquivo JSON reescrito periodicamente + endpoint HTTP opcional)
+
+import json
+import logging
+import os
+import threading
+import timeit
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.sharedctypes import RawArray
+
+
+class SharedProgress:
+    """Contadores em memória compartilhada com os workers do Pool, um slot por worker.
+
+    Cada worker escreve apenas no próprio slot, por isso não há lock.
+    """
+
+    def __init__(self, num_workers: int):
+        self.num_workers = num_workers
+        self.completed = RawArray('q', num_workers)
+        self.in_flight = RawArray('i', num_workers)
+        self.retrying = RawArray('i', num_workers)
+
+    def add(self, field: str, worker_idx: int, n: int = 1):
+        getattr(self, field)[worker_idx] += n
+
+    def total_completed(self) -> int:
+        return sum(self.completed)
+
+
+class StatusReporter:
+    """Publica o progresso da execução em `path` a cada `interval` segundos e, opcionalmente, via HTTP."""
+
+    def __init__(self, path: str = None, interval: float = 5, http_port: int = None, num_workers: int = 1):
+        self.path = path
+        self.interval = interval
+        self.http_port = http_port
+        self.progress = SharedProgress(num_workers)
+        self.fields = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._server = None
+        self._started_at = timeit.default_timer()
+        self._last_sample = (self._started_at, 0)
+        self._rate = 0.0
+        self._block_start_completed = 0
+        self._block_rows = 0
+
+    # --- Atualizações vindas do orquestrador ---
+
+    def update(self, **fields):
+        with self._lock:
+            self.fields.update(fields)
+
+    def block_started(self, rows: int):
+        with self._lock:
+            self._block_start_completed = self.progress.total_completed()
+            self._block_rows = rows
+
+    def block_finished(self):
+        with self._lock:
+            self.fields["blocks_done"] = self.fields.get("blocks_done", 0) + 1
+            self._block_rows = 0
+
+    # --- Leitura ---
+
+    def _sample_rate(self):
+        now = timeit.default_timer()
+        completed = self.progress.total_completed()
+        last_t, last_completed = self._last_sample
+        if now - last_t >= 1:
+            self._rate = (completed - last_completed) / (now - last_t)
+            self._last_sample = (now, completed)
+        return completed
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            completed = self._sample_rate()
+            status = dict(self.fields)
+            block_done = completed - self._block_start_completed
+            block_remaining = max(self._block_rows - block_done, 0) if self._block_rows else 0
+            file_remaining = block_remaining + status.get("file_rows_after_block", 0)
+
+        eta_block = block_remaining / self._rate if self._rate > 0 else None
+        eta_file = file_remaining / self._rate if self._rate > 0 else None
+        status.update({
+            "updated_at": datetime.now().isoformat(),
+            "elapsed_s": round(timeit.default_timer() - self._started_at, 1),
+            "requests_completed": completed,
+            "requests_per_s": round(self._rate, 1),
+            "block_requests_done": block_done if self._block_rows else 0,
+            "block_requests_remaining": block_remaining,
+            "in_flight_per_worker": list(self.progress.in_flight),
+            "retry_queue_depth": sum(self.progress.retrying),
+            "eta_block_s": round(eta_block, 1) if eta_block is not None else None,
+            "eta_file_s": round(eta_file, 1) if eta_file is not None else None,
+            "eta_file_at": (datetime.now() + timedelta(seconds=eta_file)).isoformat() if eta_file is not None else None,
+        })
+        return status
+
+    # --- Publicação ---
+
+    def _write_file(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2, default=str)
+        os.replace(tmp_path, self.path)
+
+    def _writer_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._write_file()
+            except Exception as e:
+                logging.debug(f"Falha ao gravar status: {e}")
+
+    def _serve(self):
+        reporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(reporter.snapshot(), default=str).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.http_port), Handler)
+        self._server.serve_forever()
+
+    def start(self):
+        if self.path:
+            self._threads.append(threading.Thread(target=self._writer_loop, daemon=True, name="status-writer"))
+            logging.info(f"📡 Status da execução em {os.path.abspath(self.path)}")
+        if self.http_port:
+            self._threads.append(threading.Thread(target=self._serve, daemon=True, name="status-http"))
+            logging.info(f"📡 Endpoint de status em http://127.0.0.1:{self.http_port}/")
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self, final_state: str = None):
+        if final_state:
+            self.update(state=final_state)
+        self._stop.set()
+        if self._server:
+            self._server.shutdown()
+        if self.path:
+            try:
+                self._write_file()
+            except Exception as e:
+                logging.debug(f"Falha ao gravar status final: {e}")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os módulos do pipeline são importados pelo nome (rodam a partir de src/python)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,172 @@
+# Testes do modo distribuído sobre LocalStore (sem S3 nem OSRM)
+
+import json
+import time
+
+import pandas as pd
+import pytest
+
+import main_orchestrator
+from distributed import (LocalStore, LeaseManager, WorkUnit, build_units, verify_coverage, ensure_plan,
+                         claim_for_batch, batch_lease_key, PARTITION_DONE)
+from config import SETUP
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalStore(str(tmp_path / "store"))
+
+
+def plan_for(file_rows, unit_rows):
+    return {"file_rows": file_rows, "units": [vars(u) for u in build_units("2025-01", file_rows, unit_rows)]}
+
+
+# --- verify_coverage ---
+
+def test_verify_coverage_accepts_contiguous_units():
+    units = verify_coverage(plan_for({"a.parquet": 10, "b.parquet": 3}, 4))
+    assert [(u.file_key, u.start_row, u.end_row) for u in units] == [
+        ("a.parquet", 0, 4), ("a.parquet", 4, 8), ("a.parquet", 8, 10), ("b.parquet", 0, 3)]
+
+
+def test_verify_coverage_rejects_gap():
+    plan = plan_for({"a.parquet": 10}, 4)
+    del plan["units"][1]
+    with pytest.raises(ValueError, match="esperado início 4"):
+        verify_coverage(plan)
+
+
+def test_verify_coverage_rejects_overlap():
+    plan = plan_for({"a.parquet": 10}, 4)
+    plan["units"][1]["start_row"] = 3
+    with pytest.raises(ValueError, match="cobertura inválida"):
+        verify_coverage(plan)
+
+
+def test_verify_coverage_rejects_short_and_foreign_files():
+    plan = plan_for({"a.parquet": 10}, 4)
+    plan["file_rows"]["a.parquet"] = 12
+    with pytest.raises(ValueError, match="10/12"):
+        verify_coverage(plan)
+    plan = plan_for({"a.parquet": 10}, 4)
+    plan["units"].append(vars(WorkUnit("2025-01", "x.parquet", 0, 1)))
+    with pytest.raises(ValueError, match="fora do plano"):
+        verify_coverage(plan)
+
+
+# --- LeaseManager ---
+
+def test_lease_is_exclusive_until_it_expires(store):
+    first, second = LeaseManager(store, "w1", ttl=0.2), LeaseManager(store, "w2", ttl=0.2)
+    assert first.acquire("leases/p/u.json")
+    assert not second.acquire("leases/p/u.json")
+    time.sleep(0.3)
+    assert second.acquire("leases/p/u.json")
+    lease = json.loads(store.get("leases/p/u.json")[0])
+    assert (lease["owner"], lease["attempt"]) == ("w2", 2)
+
+
+def test_released_lease_is_free_immediately(store):
+    first, second = LeaseManager(store, "w1", ttl=60), LeaseManager(store, "w2", ttl=60)
+    assert first.acquire("leases/p/u.json")
+    first.release("leases/p/u.json")
+    assert second.acquire("leases/p/u.json")
+
+
+def test_renewal_keeps_lease_and_detects_takeover(store):
+    renewed = LeaseManager(store, "w1", ttl=0.3).start()
+    try:
+        assert renewed.acquire("leases/p/alive.json")
+        time.sleep(0.5)
+        assert not LeaseManager(store, "w2", ttl=0.3).acquire("leases/p/alive.json")
+    finally:
+        renewed.stop()
+
+    stalled = LeaseManager(store, "w3", ttl=0.2)
+    assert stalled.acquire("leases/p/lost.json")
+    time.sleep(0.3)
+    assert LeaseManager(store, "w4", ttl=60).acquire("leases/p/lost.json")
+    stalled.start()
+    try:
+        deadline = time.time() + 2
+        while "leases/p/lost.json" not in stalled.lost and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        stalled.stop()
+    assert "leases/p/lost.json" in stalled.lost
+
+
+# --- Reserva entre a execução em lote e os workers ---
+
+def test_batch_claim_and_plan_exclude_each_other(store):
+    batch, worker = LeaseManager(store, "batch", ttl=60), LeaseManager(store, "w1", ttl=60)
+    assert claim_for_batch(store, batch, "2025-01")
+    assert ensure_plan(store, worker, "2025-01", lambda: ["a.parquet"], lambda key: 10) is None
+
+    assert len(ensure_plan(store, worker, "2025-02", lambda: ["a.parquet"], lambda key: 10)) == 1
+    assert not claim_for_batch(store, batch, "2025-02")
+
+    assert worker.acquire("leases/2025-03/_plan.json")
+    assert not claim_for_batch(store, batch, "2025-03")
+    assert store.get(batch_lease_key("2025-03"))[0] is None
+
+
+# --- Consolidação depois de uma queda ---
+
+@pytest.fixture
+def destination(monkeypatch, tmp_path):
+    """Destino em memória: uploads consolidados e chamadas ao bookmark."""
+    uploaded, bookmark_calls = {}, []
+
+    def upload(local_path, bucket, key):
+        uploaded[key] = pd.read_parquet(local_path)
+        return True
+
+    def existing_orders(bucket, prefix):
+        return {o for key, df in uploaded.items() if key.startswith(prefix) for o in df["order_number"]}
+
+    monkeypatch.setitem(SETUP, "LOCAL_TEMP_DIR", str(tmp_path / "tmp"))
+    monkeypatch.setattr(main_orchestrator, "upload_file_to_s3", upload)
+    monkeypatch.setattr(main_orchestrator, "load_existing_order_numbers", existing_orders)
+    monkeypatch.setattr(main_orchestrator, "upload_unroutable", lambda *a: None)
+    monkeypatch.setattr(main_orchestrator, "record_partition_progress", lambda *a: bookmark_calls.append(a))
+    return uploaded, bookmark_calls
+
+
+def stage_units(store, units):
+    for unit in units:
+        df = pd.DataFrame({"order_number": [f"{unit.file_key}-{i}" for i in range(unit.start_row, unit.end_row)],
+                           "distance_km": 1.0})
+        store.put(unit.output_key, main_orchestrator.parquet_bytes(df))
+        store.create(unit.done_key, json.dumps({"owner": "w1", "rows": len(df)}).encode())
+
+
+def test_finalize_after_crash_writes_each_row_once(store, destination, monkeypatch):
+    uploaded, bookmark_calls = destination
+    units = build_units("2025-01", {"a.parquet": 10, "b.parquet": 5}, 4)
+    stage_units(store, units)
+
+    # Primeiro worker cai depois do upload, antes de marcar o bookmark (o lease _finalize fica para trás)
+    crashed = LeaseManager(store, "w1", ttl=0.2)
+    monkeypatch.setattr(main_orchestrator, "record_partition_progress",
+                        lambda *a: (_ for _ in ()).throw(SystemExit("queda")))
+    monkeypatch.setattr(crashed, "release", lambda key: None)
+    with pytest.raises(SystemExit):
+        main_orchestrator.finalize_distributed_partition(store, crashed, "2025-01", units)
+    assert store.get(f"done/2025-01/{PARTITION_DONE}")[0] is None
+
+    survivor = LeaseManager(store, "w2", ttl=60)
+    monkeypatch.setattr(main_orchestrator, "record_partition_progress", lambda *a: bookmark_calls.append(a))
+    assert not main_orchestrator.finalize_distributed_partition(store, survivor, "2025-01", units)
+    time.sleep(0.3)
+    assert main_orchestrator.finalize_distributed_partition(store, survivor, "2025-01", units)
+
+    routed = pd.concat(uploaded.values(), ignore_index=True)
+    assert len(routed) == 15 and routed["order_number"].is_unique
+    assert bookmark_calls == [("2025-01", False, None)]
+    assert json.loads(store.get(f"done/2025-01/{PARTITION_DONE}")[0])["rows"] == 0
+    assert not store.list("staging/2025-01/")
+
+    # Repetir a consolidação de uma partição já marcada não faz nada
+    assert main_orchestrator.finalize_distributed_partition(store, survivor, "2025-01", units)
+    assert bookmark_calls == [("2025-01", False, None)]
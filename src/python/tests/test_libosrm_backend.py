@@ -0,0 +1,79 @@
+# Testes do LibOSRMEngine com um binding falso (sem osrm-bindings nem dataset)
+
+import asyncio
+import types
+
+import osrm
+import pytest
+
+import libosrm_backend
+from failures import classify_failure, NO_ROUTE
+
+HINT = "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA="
+
+
+def fake_bindings(accept_none: bool):
+    """Binding falso: RouteParameters guarda os argumentos; com accept_none=False, rejeita None em `hints`."""
+    created = []
+
+    class RouteParameters:
+        def __init__(self, coordinates, hints=(), **kwargs):
+            if not accept_none and any(h is None for h in hints):
+                raise TypeError("incompatible function arguments")
+            self.kwargs = {"coordinates": coordinates, "hints": list(hints), **kwargs}
+            created.append(self)
+
+    return types.SimpleNamespace(RouteParameters=RouteParameters), created
+
+
+class FakeEngine:
+    def __init__(self, error: str = None):
+        self.error = error
+        self.calls = []
+
+    def Route(self, params):
+        self.calls.append(params.kwargs)
+        if self.error:
+            raise RuntimeError(self.error)
+        return {"routes": [{"distance": 1234.5, "duration": 99.0}],
+                "waypoints": [{"hint": HINT, "location": [0, 0]}, {"location": [1, 1]}]}
+
+
+@pytest.fixture
+def route(monkeypatch):
+    def _route(accept_none=True, hints=None, error=None):
+        bindings, _ = fake_bindings(accept_none)
+        monkeypatch.setattr(libosrm_backend, "_LIBOSRM", bindings)
+        monkeypatch.setattr(libosrm_backend, "_OPTIONAL_HINTS", None)
+        engine = libosrm_backend.LibOSRMEngine()
+        engine.engine = FakeEngine(error)
+        response = asyncio.run(engine.route([[-46.6, -23.5], [-46.7, -23.6]], hints=hints))
+        return response, engine.engine.calls
+    return _route
+
+
+def test_route_passes_coordinates_and_translates_response(route):
+    response, calls = route()
+    assert calls == [{"coordinates": [(-46.6, -23.5), (-46.7, -23.6)], "hints": [], "overview": "false"}]
+    assert response == {"routes": [{"distance": 1234.5, "duration": 99.0}], "waypoints": [{"hint": HINT}, {}]}
+
+
+def test_poc_hint_with_empty_destination_when_binding_accepts_none(route):
+    _, calls = route(accept_none=True, hints=[HINT, None])
+    assert calls[0]["hints"] == [HINT, None]
+
+
+def test_partial_hints_dropped_when_binding_rejects_none(route):
+    _, calls = route(accept_none=False, hints=[HINT, None])
+    assert calls[0]["hints"] == []
+
+
+def test_complete_hints_always_passed(route):
+    _, calls = route(accept_none=False, hints=[HINT, HINT])
+    assert calls[0]["hints"] == [HINT, HINT]
+
+
+def test_engine_error_becomes_permanent_failure(route):
+    with pytest.raises(osrm.OSRMClientException) as excinfo:
+        route(error="NoRoute - Impossible route between points")
+    assert classify_failure(excinfo.value) == NO_ROUTE
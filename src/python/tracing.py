@@ -0,0 +1,89 @@
+# tracing.py - Linha do tempo da execução no formato Chrome trace-event (chrome://tracing / Perfetto)
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import boto3
+
+from config import SETUP
+from metrics import METRICS, RunMetrics
+
+
+def _now_us() -> int:
+    # Relógio de parede: alinha os eventos do processo pai e dos workers do Pool
+    return time.time_ns() // 1000
+
+
+class Tracer:
+    """Grava spans ("X" events) do processo atual. Desligado, não custa nada além de um if."""
+
+    def __init__(self, enabled: bool = False, process_name: str = None):
+        self.enabled = enabled
+        self.events = []
+        if enabled and process_name:
+            self.name_process(process_name)
+
+    def name_process(self, name: str):
+        self.events.append({"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": name}})
+
+    @contextmanager
+    def span(self, name: str, cat: str = "stage", **args):
+        if not self.enabled:
+            yield
+            return
+        start = _now_us()
+        try:
+            yield
+        finally:
+            self.events.append({
+                "name": name, "cat": cat, "ph": "X", "ts": start, "dur": _now_us() - start,
+                "pid": os.getpid(), "tid": threading.get_ident(), "args": args,
+            })
+
+    def instant(self, name: str, cat: str = "event", **args):
+        if self.enabled:
+            self.events.append({
+                "name": name, "cat": cat, "ph": "i", "s": "p", "ts": _now_us(),
+                "pid": os.getpid(), "tid": threading.get_ident(), "args": args,
+            })
+
+    def extend(self, events: list):
+        """Anexa eventos devolvidos por um worker do Pool."""
+        if self.enabled and events:
+            self.events.extend(events)
+
+    def export(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f, default=str)
+        return path
+
+
+# Tracer do processo pai. Workers criam o próprio e devolvem `events` junto com os resultados.
+TRACER = Tracer(enabled=SETUP["TRACE_ENABLED"], process_name="orchestrator")
+
+
+@contextmanager
+def stage(name: str, metrics: RunMetrics = METRICS, tracer: Tracer = TRACER, **args):
+    """Cronometra a etapa nas métricas e registra o span correspondente no trace."""
+    with metrics.timer(name), tracer.span(name, **args):
+        yield
+
+
+def export_trace(bucket: str, prefix: str, run_id: str = None, tracer: Tracer = TRACER):
+    """Exporta o trace da execução para SETUP['TRACE_DIR'] e o publica ao lado das métricas no S3."""
+    if not tracer.enabled:
+        return None
+    run_id = run_id or os.environ.get("OSRM_EXECUTION_ID") or time.strftime('%Y-%m-%d_%Y%m%d_%H%M%S')
+    os.makedirs(SETUP["TRACE_DIR"], exist_ok=True)
+    local_path = tracer.export(os.path.join(SETUP["TRACE_DIR"], f"{run_id}_trace.json"))
+    s3_key = f"{prefix.rstrip('/')}/{run_id}_trace.json"
+    try:
+        boto3.client('s3').upload_file(local_path, bucket, s3_key)
+        logging.info(f"🧭 Trace ({len(tracer.events):,} eventos) salvo em {local_path} e s3://{bucket}/{s3_key}")
+    except Exception as e:
+        logging.warning(f"⚠️  Trace salvo apenas localmente ({local_path}): {e}")
+    return local_path
@@ -0,0 +1,74 @@
+# validation.py - Validação vetorizada das coordenadas antes do roteamento
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from config import SETUP
+from geo import in_brazil
+from metrics import METRICS
+
+# Classes de validação (contadas por bloco em METRICS como validation_<classe>)
+VALID = "ok"
+SWAP_FIXED = "swap_fixed"          # auto-fix: lat/lon invertidos, corrigidos no próprio bloco
+ZERO = "zero"                      # skip: coordenada zerada
+OUT_OF_BRAZIL = "out_of_brazil"    # skip: fora do contorno do Brasil mesmo após tentar a inversão
+SAME_POINT = "same_point"          # atalho: POC == pedido, distância e duração zero sem chamar o OSRM
+
+# failure_class das linhas descartadas no relatório de não roteáveis
+FAILURE_CLASSES = {ZERO: "invalid_zero", OUT_OF_BRAZIL: "out_of_brazil"}
+
+
+def _check_endpoint(df: pd.DataFrame, lon_col: str, lat_col: str):
+    """Devolve (zerado, dentro, invertido) de um extremo da rota."""
+    lon = df[lon_col].to_numpy(dtype=np.float64)
+    lat = df[lat_col].to_numpy(dtype=np.float64)
+    zero = (lon == 0) | (lat == 0)
+    inside = in_brazil(lon, lat)
+    swapped = ~zero & ~inside & in_brazil(lat, lon)
+    return zero, inside, swapped
+
+
+def validate_coordinates(df: pd.DataFrame):
+    """Classifica cada linha sem chamada HTTP.
+
+    Retorna (linhas a rotear, resultados prontos das linhas com POC == pedido, linhas descartadas com
+    `failure_class`, contagem por classe). Linhas `zero` e `out_of_brazil` não vão para o OSRM e seguem para o
+    relatório de não roteáveis; as invertidas são corrigidas e seguem para o OSRM.
+    """
+    start_lon, start_lat = SETUP["start_coordinates"]
+    end_lon, end_lat = SETUP["end_coordinates"]
+    start_zero, start_inside, start_swapped = _check_endpoint(df, start_lon, start_lat)
+    end_zero, end_inside, end_swapped = _check_endpoint(df, end_lon, end_lat)
+
+    zero = start_zero | end_zero
+    swap_fixed = ~zero & (start_swapped | end_swapped)
+    out_of_brazil = ~zero & ~((start_inside | start_swapped) & (end_inside | end_swapped))
+    keep = ~zero & ~out_of_brazil
+    invalid = df[~keep].assign(failure_class=np.where(zero[~keep], FAILURE_CLASSES[ZERO],
+                                                      FAILURE_CLASSES[OUT_OF_BRAZIL]))
+
+    df = df[keep].copy()
+    for lon_col, lat_col, swapped in ((start_lon, start_lat, start_swapped[keep]), (end_lon, end_lat, end_swapped[keep])):
+        if swapped.any():
+            df.loc[swapped, [lon_col, lat_col]] = df.loc[swapped, [lat_col, lon_col]].to_numpy()
+
+    same_point = (np.isclose(df[start_lon].to_numpy(), df[end_lon].to_numpy(), rtol=0, atol=1e-6) &
+                  np.isclose(df[start_lat].to_numpy(), df[end_lat].to_numpy(), rtol=0, atol=1e-6))
+    shortcut_results = [
+        {**row, "distance": 0.0, "duration": 0.0}
+        for row in df.loc[same_point, SETUP["metadata_columns"]].to_dict(orient="records")
+    ]
+
+    counts = {
+        VALID: int((~swap_fixed[keep] & ~same_point).sum()),
+        SWAP_FIXED: int(swap_fixed.sum()),
+        ZERO: int(zero.sum()),
+        OUT_OF_BRAZIL: int(out_of_brazil.sum()),
+        SAME_POINT: int(same_point.sum()),
+    }
+    for name, n in counts.items():
+        METRICS.incr(f"validation_{name}", n)
+    logging.info(f"🧭 Validação do bloco: {counts}")
+    return df[~same_point], shortcut_results, invalid, counts
@@ -0,0 +1,155 @@
+# warmup.py - Pré-carga do mapa e aquecimento do OSRM antes do roteamento cronometrado
+
+import glob
+import logging
+import os
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from config import SETUP
+from geo import BRAZIL_BBOX, in_brazil
+from hints import HINT_CACHE
+from metrics import METRICS, RunMetrics
+from processing import parallel_osrm_requests
+
+
+def preload_map_files(map_dir: str = None, threads: int = 8, range_mb: int = 256, chunk_mb: int = 16) -> float:
+    """Lê os arquivos .osrm* em paralelo, em faixas sequenciais de `range_mb` por thread.
+
+    O volume EBS restaurado de snapshot busca cada bloco no S3 na primeira leitura; lendo tudo de uma vez
+    (e em sequência) o osrm-routed não paga esse custo em page faults espalhados durante os primeiros blocos.
+    Retorna os GB lidos.
+    """
+    files = sorted(glob.glob(os.path.join(map_dir or SETUP["OSRM_MAP_DIR"], "*.osrm*")))
+    step = range_mb << 20
+    ranges = [(path, offset, min(step, size - offset))
+              for path, size in ((p, os.path.getsize(p)) for p in files) for offset in range(0, size, step)]
+
+    def read_range(path: str, offset: int, length: int) -> int:
+        buffer = bytearray(chunk_mb << 20)
+        done = 0
+        with open(path, "rb", buffering=0) as f:
+            f.seek(offset)
+            while done < length:
+                n = f.readinto(memoryview(buffer)[:min(len(buffer), length - done)])
+                if not n:
+                    break
+                done += n
+        return done
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        total = sum(executor.map(lambda r: read_range(*r), ranges))
+    return total / (1024 ** 3)
+
+
+def _as_points(origins: np.ndarray, destinations: np.ndarray) -> list:
+    (start_lon, start_lat), (end_lon, end_lat) = SETUP["start_coordinates"], SETUP["end_coordinates"]
+    return [
+        {"order_number": f"warmup-{i}", start_lon: o[0], start_lat: o[1], end_lon: d[0], end_lat: d[1]}
+        for i, (o, d) in enumerate(zip(origins.tolist(), destinations.tolist()))
+    ]
+
+
+def real_pairs(df: pd.DataFrame) -> tuple:
+    """(origens, destinos) dos pares de um extrato real com as duas pontas dentro do Brasil e sem zeros."""
+    columns = SETUP["start_coordinates"] + SETUP["end_coordinates"]
+    coords = df[columns].apply(pd.to_numeric, errors="coerce").dropna().to_numpy(dtype=np.float64)
+    valid = np.all(coords != 0, axis=1) & in_brazil(coords[:, 0], coords[:, 1]) & in_brazil(coords[:, 2], coords[:, 3])
+    return coords[valid, :2], coords[valid, 2:]
+
+
+def hint_cache_origins() -> np.ndarray:
+    """Coordenadas dos POCs do cache de hints (origens reais de pedidos nesta versão do mapa)."""
+    origins = np.array([[int(v) / 1e5 for v in key.split(",")] for key in HINT_CACHE.hints], dtype=np.float64)
+    return origins[in_brazil(origins[:, 0], origins[:, 1])] if len(origins) else origins.reshape(0, 2)
+
+
+def warmup_points(n: int, seed: int = 42, max_offset_deg: float = 0.05, sample_df: pd.DataFrame = None) -> tuple:
+    """Pares para aquecer as regiões do grafo que o pipeline vai usar. Retorna (pares, origem dos pares).
+
+    Preferência: pares reais do primeiro arquivo da fila (`sample_df`); sem ele, POCs do cache de hints com
+    destino a poucos km (como um pedido real); sem nenhum dos dois, origens uniformes dentro do contorno do
+    Brasil (várias caem em áreas sem via e só servem para tocar o grafo). Extratos menores que `n` se repetem.
+    """
+    rng = np.random.default_rng(seed)
+    if sample_df is not None and len(sample_df):
+        origins, destinations = real_pairs(sample_df)
+        if len(origins):
+            pick = rng.choice(len(origins), size=n, replace=len(origins) < n)
+            return _as_points(origins[pick], destinations[pick]), "first_file"
+    source = "hint_cache"
+    origins = hint_cache_origins()
+    if len(origins):
+        origins = origins[rng.choice(len(origins), size=n, replace=len(origins) < n)]
+    else:
+        source = "uniform"
+        lon_min, lat_min, lon_max, lat_max = BRAZIL_BBOX
+        while len(origins) < n:
+            candidates = rng.uniform((lon_min, lat_min), (lon_max, lat_max), size=(4 * n, 2))
+            origins = np.vstack([origins, candidates[in_brazil(candidates[:, 0], candidates[:, 1])]])
+        origins = origins[:n]
+    destinations = origins + rng.uniform(-max_offset_deg, max_offset_deg, size=origins.shape)
+    return _as_points(origins, destinations), source
+
+
+def run_warmup(metrics: RunMetrics = METRICS, sample_df: pd.DataFrame = None) -> dict:
+    """Pré-carrega o mapa e dispara rodadas de requisições até a latência estabilizar.
+
+    Estável = p95 de WARMUP_STEADY_ROUNDS rodadas seguidas variando no máximo WARMUP_STEADY_TOLERANCE
+    em relação à anterior (ou WARMUP_MAX_ROUNDS atingido). O p95 é só das requisições com rota; rodada com
+    menos de WARMUP_MIN_OK_RATIO de sucesso não conta para a estabilidade. Falhas aqui nunca abortam o pipeline.
+    `sample_df`: primeiro arquivo da fila, de onde saem os pares (ver warmup_points).
+    """
+    start = timeit.default_timer()
+    report = {}
+    if SETUP["WARMUP_PRELOAD_FILES"]:
+        try:
+            preload_start = timeit.default_timer()
+            gb = preload_map_files()
+            preload_s = timeit.default_timer() - preload_start
+            metrics.add_time("warmup_preload", preload_s)
+            report["preload_gb"] = round(gb, 2)
+            logging.info(f"🔥 Mapa pré-carregado: {gb:.1f}GB em {preload_s:.0f}s ({gb / max(preload_s, 1e-9):.2f}GB/s)")
+        except OSError as e:
+            logging.warning(f"⚠️  Pré-carga dos arquivos do mapa falhou: {e}")
+
+    round_size = SETUP["WARMUP_ROUND_SIZE"]
+    points, source = warmup_points(round_size * SETUP["WARMUP_MAX_ROUNDS"], sample_df=sample_df)
+    report["source"] = source
+    logging.info(f"🔥 Pares do aquecimento: {source}")
+    previous_p95 = None
+    stable_rounds = 0
+    try:
+        for k in range(SETUP["WARMUP_MAX_ROUNDS"]):
+            round_metrics = RunMetrics()
+            parallel_osrm_requests(points[k * round_size:(k + 1) * round_size], num_processes=SETUP["NUM_PROCESSES"],
+                                   max_concurrent=SETUP["MAX_CONCURRENT"], metrics=round_metrics, hints=False)
+            latency = round_metrics.histograms["osrm_request_ms"].summary()
+            p95 = latency.get("p95_ms")
+            ok_ratio = latency["count"] / round_size
+            logging.info(f"🔥 Aquecimento rodada {k + 1}: p50 {latency.get('p50_ms')}ms | p95 {p95}ms | "
+                         f"{ok_ratio:.0%} com rota")
+            if p95 is None or ok_ratio < SETUP["WARMUP_MIN_OK_RATIO"]:
+                continue
+            if previous_p95 and abs(p95 - previous_p95) / previous_p95 <= SETUP["WARMUP_STEADY_TOLERANCE"]:
+                stable_rounds += 1
+            else:
+                stable_rounds = 0
+            previous_p95 = p95
+            report.update(rounds=k + 1, p95_ms=p95)
+            if stable_rounds >= SETUP["WARMUP_STEADY_ROUNDS"]:
+                report["steady"] = True
+                break
+    except Exception as e:
+        logging.warning(f"⚠️  Aquecimento interrompido: {e}")
+
+    elapsed = timeit.default_timer() - start
+    if report.get("steady"):
+        logging.info(f"✅ OSRM aquecido: latência estável após {report['rounds']} rodada(s) "
+                     f"(p95 {report['p95_ms']}ms) em {elapsed:.0f}s.")
+    else:
+        logging.warning(f"⚠️  Aquecimento terminou sem latência estável em {elapsed:.0f}s: {report}")
+    return report
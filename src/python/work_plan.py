@@ -0,0 +1,88 @@
+# work_plan.py - Fila de partições e seleção de arquivos novos a partir do bookmark
+
+import logging
+import os
+import time
+from datetime import datetime
+
+from drain import DRAIN
+
+
+def previous_month(partition: str) -> str:
+    year, month = int(partition[:4]), int(partition[5:])
+    return f"{year - 1}-12" if month == 1 else f"{year}-{month - 1:02d}"
+
+
+def plan_partitions(available_partitions: list, bookmark: dict, current_month_partition: str,
+                    verbose: bool = True) -> list:
+    """Partições a processar, por prioridade: mês corrente, mês anterior ainda não concluído (incremental,
+    pelo watermark do delta) e, depois, o backfill histórico em ordem."""
+    available_partitions = [p for p in available_partitions if p.startswith('2025-')]
+    if verbose:
+        logging.info(f"Filtro aplicado: Processando {len(available_partitions)} partições (2025+).")
+
+    processed_partitions_history = set(bookmark.get("completed_partitions", []))
+    priority = [p for p in (current_month_partition, previous_month(current_month_partition))
+                if p in available_partitions and p not in processed_partitions_history]
+    historical_work = set(available_partitions) - processed_partitions_history - set(priority)
+    return priority + sorted(list(historical_work))
+
+
+def select_new_files(all_s3_files: list, last_processed_ts: datetime = None, done_files=()) -> list:
+    """Arquivos .parquet da partição, em ordem de LastModified, sem os posteriores ao watermark do delta
+    (quando houver) nem os já concluídos num checkpoint."""
+    done_files = set(done_files)
+    files_to_download_filtered = []
+    for file_data in all_s3_files:
+        file_key = file_data['Key']
+        last_mod_dt = datetime.fromisoformat(file_data['LastModified'])
+
+        if not file_key.endswith(".parquet"): continue
+
+        if last_processed_ts and last_mod_dt <= last_processed_ts:
+            logging.warning(f"Delta: Ignorando arquivo já processado: {os.path.basename(file_key)}")
+            continue
+
+        if file_key in done_files:
+            logging.info(f"Checkpoint: Ignorando arquivo já processado: {os.path.basename(file_key)}")
+            continue
+
+        files_to_download_filtered.append(file_data)
+
+    files_to_download_filtered.sort(key=lambda x: datetime.fromisoformat(x['LastModified']))
+    return files_to_download_filtered
+
+
+def last_processed_timestamp(bookmark: dict, partition: str):
+    """Watermark do delta da partição no bookmark (None se nunca processada em modo delta)."""
+    delta_timestamps = bookmark.get("delta_timestamps", {})
+    if partition in delta_timestamps:
+        return datetime.fromisoformat(delta_timestamps[partition])
+    return None
+
+
+def partition_checkpoint(bookmark: dict, partition: str) -> dict:
+    """Checkpoint de uma partição interrompida pelo prazo: {"done_files": [...], "partial_file", "next_row"}."""
+    return bookmark.get("checkpoints", {}).get(partition, {})
+
+
+class RunBudget:
+    """Orçamento de tempo da execução em lote.
+
+    Novos blocos só começam se couberem antes de `deadline - margem` (estimativa: média móvel da duração dos
+    blocos já feitos); a margem cobre consolidação, upload, dedupe e o upload do log antes da parada da Lambda.
+    Sem deadline, o orçamento é ilimitado. Com drenagem pedida (drain.py), nenhum bloco novo cabe.
+    """
+
+    def __init__(self, deadline_epoch: float = None, margin_seconds: float = 0.0):
+        self.stop_at = deadline_epoch - margin_seconds if deadline_epoch else None
+        self._block_seconds = None
+
+    def remaining(self) -> float:
+        return float("inf") if self.stop_at is None else self.stop_at - time.time()
+
+    def has_time_for_block(self) -> bool:
+        return not DRAIN.requested and self.remaining() > (self._block_seconds or 0.0)
+
+    def block_done(self, seconds: float):
+        self._block_seconds = seconds if self._block_seconds is None else 0.7 * self._block_seconds + 0.3 * seconds
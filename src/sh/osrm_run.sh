@@ -3,12 +3,76 @@ cd "$(dirname "$0")"
 
 LOG_FILE="osrm_automation.log"
 CONTAINER_NAME="osrm_server"
+MAP_DIR="${HOME}/osrm-brazil-files"
+OSRM_IMAGE="ghcr.io/project-osrm/osrm-backend"
+OSRM_DATASET="brazil"
+OSRM_BASE_PORT=5000
+# Nº de osrm-routed em paralelo (>1: mapa único em memória compartilhada via osrm-datastore)
+OSRM_NUM_BACKENDS=${OSRM_NUM_BACKENDS:-1}
+# Motor do Python: "http" (osrm-routed) ou "libosrm" (in-process, também exige o mapa no osrm-datastore)
+export OSRM_ROUTING_BACKEND=${OSRM_ROUTING_BACKEND:-http}
+export OSRM_DATASET
+# Shards regionais (ex.: "sudeste,sul"): extratos em ${MAP_DIR}/shards/<nome>/<nome>-latest.osrm
+OSRM_SHARDS=${OSRM_SHARDS:-}
+OSRM_SHARD_BASE_PORT=5100
+# 1: o Python sobe em paralelo com o osrm-routed (listagem/bookmark/1º arquivo durante o carregamento do mapa)
+# e ele mesmo aguarda o /status; 0: espera no shell, como antes
+OSRM_BOOT_OVERLAP=${OSRM_BOOT_OVERLAP:-1}
+# Fim da execução: "stop" (padrão) mantém o desligamento normal pelo Python; "hibernate" (opcional) hiberna a VM
+# (RAM no EBS) e, quando a Lambda der o próximo start, retoma daqui com o osrm-routed/osrm-datastore em memória
+export OSRM_SHUTDOWN_MODE=${OSRM_SHUTDOWN_MODE:-stop}
+# Marcador da auto-hibernação: só existe enquanto o script está congelado esperando a retomada. Sem ele, a Lambda
+# faz stop normal (e, numa VM hibernada sem o script esperando, reinicia) para o @reboot voltar a rodar o pipeline
+HIBERNATE_MARKER="s3://20-ze-datalake-landing/osrm_distance/control/hibernate_marker.json"
+# Referência do timer boot_to_first_route: boot do kernel (partida a frio) ou instante da retomada
+export OSRM_BOOT_KIND=${OSRM_BOOT_KIND:-cold}
+export OSRM_BOOT_EPOCH=${OSRM_BOOT_EPOCH:-$(date -d "$(uptime -s)" +%s)}
 EXECUTION_DATE=$(date '+%Y-%m-%d')
 EXECUTION_TIMESTAMP=$(date '+%Y%m%d_%H%M%S')
+# Mesmo identificador usado pelo Python no resumo de métricas (*_metrics.json)
+export OSRM_EXECUTION_ID="${EXECUTION_DATE}_${EXECUTION_TIMESTAMP}"
 
 log() { echo "$(date '+%Y-%m-%d %H:%M:%S') - $1" | tee -a $LOG_FILE; }
 
-log "--- INICIANDO PIPELINE VIA @REBOOT ---"
+container_running() { [ "$(sudo docker inspect -f '{{.State.Status}}' "$1" 2>/dev/null)" = "running" ]; }
+
+# Hiberna a VM e bloqueia até a retomada (o processo fica congelado; um salto no relógio indica que voltou).
+# Retorna 1 se a hibernação não for possível (cai no stop normal) ou não acontecer em 15 minutos
+hibernate_and_wait() {
+    local INSTANCE_ID REGION LAST NOW WAITED=0
+    INSTANCE_ID=$(curl -s http://169.254.169.254/latest/meta-data/instance-id)
+    REGION=$(curl -s http://169.254.169.254/latest/meta-data/placement/region)
+    log "🛌 Hibernando a instância ${INSTANCE_ID} (osrm-routed e mapa continuam em memória)..."
+    if ! echo "{\"execution_id\": \"${OSRM_EXECUTION_ID}\", \"instance_id\": \"${INSTANCE_ID}\"}" \
+            | aws s3 cp - "$HIBERNATE_MARKER" >> $LOG_FILE 2>&1; then
+        log "⚠️  Marcador de hibernação não gravado. Desligando normalmente."
+        aws ec2 stop-instances --instance-ids "$INSTANCE_ID" --region "$REGION" >> $LOG_FILE 2>&1
+        return 1
+    fi
+    if ! aws ec2 stop-instances --instance-ids "$INSTANCE_ID" --region "$REGION" --hibernate >> $LOG_FILE 2>&1; then
+        log "⚠️  Hibernação indisponível (instância lançada sem hibernação?). Desligando normalmente."
+        aws s3 rm "$HIBERNATE_MARKER" >> $LOG_FILE 2>&1
+        aws ec2 stop-instances --instance-ids "$INSTANCE_ID" --region "$REGION" >> $LOG_FILE 2>&1
+        return 1
+    fi
+    LAST=$(date +%s)
+    while [ $WAITED -lt 900 ]; do
+        sleep 5
+        NOW=$(date +%s)
+        [ $((NOW - LAST)) -gt 60 ] && return 0
+        LAST=$NOW
+        WAITED=$((WAITED + 5))
+    done
+    log "⚠️  A instância não hibernou em 15 minutos."
+    aws s3 rm "$HIBERNATE_MARKER" >> $LOG_FILE 2>&1
+    return 1
+}
+
+if [ "$OSRM_BOOT_KIND" = "resume" ]; then
+    log "--- INICIANDO PIPELINE VIA RETOMADA DA HIBERNAÇÃO ---"
+else
+    log "--- INICIANDO PIPELINE VIA @REBOOT ---"
+fi
 
 # 1. Ativação do ambiente Python
 if [ -f .venv/bin/activate ]; then
@@ -18,13 +82,93 @@ else
     log "⚠️  Ambiente virtual não encontrado."
 fi
 
-# 2. Espera OBRIGATÓRIA (Health Check)
-log "⏳ Aguardando o servidor OSRM na porta 5000..."
+# Na retomada o mapa já está em RAM: o aquecimento do Python pula a pré-carga dos arquivos
+if [ "$OSRM_BOOT_KIND" = "resume" ]; then
+    export OSRM_WARMUP_PRELOAD=0
+fi
+
+# 1b. Múltiplos backends OSRM (opcional)
+OSRM_HOSTS="http://localhost:${OSRM_BASE_PORT}"
+OSRM_CONTAINERS="$CONTAINER_NAME"
+
+if [ "$OSRM_NUM_BACKENDS" -gt 1 ] || [ "$OSRM_ROUTING_BACKEND" = "libosrm" ]; then
+    log "🗺️  Modo memória compartilhada: $OSRM_NUM_BACKENDS osrm-routed (motor Python: $OSRM_ROUTING_BACKEND) sobre o osrm-datastore."
+    
+    # O datastore já lê o mapa inteiro para a RAM: o aquecimento do Python pula a pré-carga dos arquivos
+    export OSRM_WARMUP_PRELOAD=0
+    
+    # O container único (mmap próprio do mapa) sai de cena para liberar RAM e a porta base
+    sudo docker update --restart=no $CONTAINER_NAME > /dev/null 2>&1
+    sudo docker stop $CONTAINER_NAME > /dev/null 2>&1
+    
+    # Memória compartilhada não sobrevive ao reboot: recarrega o dataset a cada boot (na retomada ela continua lá)
+    if [ "$OSRM_BOOT_KIND" = "resume" ]; then
+        log "☀️  Retomada: dataset $OSRM_DATASET continua no osrm-datastore."
+    elif ! sudo docker run --rm --ipc=host -v "${MAP_DIR}:/data" $OSRM_IMAGE \
+            osrm-datastore --dataset-name $OSRM_DATASET /data/brazil-latest.osrm >> $LOG_FILE 2>&1; then
+        log "❌ Falha no osrm-datastore. Abortando."
+        aws s3 cp $LOG_FILE "s3://20-ze-datalake-landing/osrm_distance/osrm_failed/${EXECUTION_DATE}_${EXECUTION_TIMESTAMP}_datastore_failed.log"
+        exit 1
+    fi
+    
+    OSRM_HOSTS=""
+    OSRM_CONTAINERS=""
+    for i in $(seq 0 $((OSRM_NUM_BACKENDS - 1))); do
+        PORT=$((OSRM_BASE_PORT + i))
+        if [ "$OSRM_BOOT_KIND" != "resume" ] || ! container_running "${CONTAINER_NAME}_${i}"; then
+            sudo docker rm -f "${CONTAINER_NAME}_${i}" > /dev/null 2>&1
+            sudo docker run -d --ipc=host --name "${CONTAINER_NAME}_${i}" -p ${PORT}:5000 $OSRM_IMAGE \
+                osrm-routed --algorithm mld --shared-memory --dataset-name $OSRM_DATASET > /dev/null
+        fi
+        OSRM_HOSTS="${OSRM_HOSTS:+${OSRM_HOSTS},}http://localhost:${PORT}"
+        OSRM_CONTAINERS="${OSRM_CONTAINERS:+${OSRM_CONTAINERS},}${CONTAINER_NAME}_${i}"
+    done
+fi
+export OSRM_HOSTS
+
+# 1c. Shards regionais (opcional): um osrm-routed por extrato; pares entre shards vão para a instância nacional
+OSRM_SHARD_HOSTS=""
+ALL_HOSTS="$OSRM_HOSTS"
+SHARD_IDX=0
+for SHARD in ${OSRM_SHARDS//,/ }; do
+    SHARD_DIR="${MAP_DIR}/shards/${SHARD}"
+    if [ ! -f "${SHARD_DIR}/${SHARD}-latest.osrm.mldgr" ]; then
+        log "⚠️  Shard ${SHARD} sem extrato em ${SHARD_DIR}. Ignorando (linhas vão para a instância nacional)."
+        continue
+    fi
+    PORT=$((OSRM_SHARD_BASE_PORT + SHARD_IDX))
+    if [ "$OSRM_BOOT_KIND" != "resume" ] || ! container_running "osrm_shard_${SHARD}"; then
+        sudo docker rm -f "osrm_shard_${SHARD}" > /dev/null 2>&1
+        sudo docker run -d --name "osrm_shard_${SHARD}" -p ${PORT}:5000 -v "${SHARD_DIR}:/data" $OSRM_IMAGE \
+            osrm-routed --algorithm mld "/data/${SHARD}-latest.osrm" > /dev/null
+    fi
+    OSRM_SHARD_HOSTS="${OSRM_SHARD_HOSTS:+${OSRM_SHARD_HOSTS};}${SHARD}=http://localhost:${PORT}"
+    OSRM_CONTAINERS="${OSRM_CONTAINERS},osrm_shard_${SHARD}"
+    ALL_HOSTS="${ALL_HOSTS},http://localhost:${PORT}"
+    SHARD_IDX=$((SHARD_IDX + 1))
+done
+if [ -n "$OSRM_SHARD_HOSTS" ]; then
+    log "🗺️  Shards regionais: ${OSRM_SHARD_HOSTS}"
+fi
+export OSRM_SHARD_HOSTS
+export OSRM_CONTAINERS
+
+# 2. Espera OBRIGATÓRIA (Health Check) - com OSRM_BOOT_OVERLAP=1 fica a cargo do Python (boot.py)
 MAX_TRIES=60
 TRY=0
+if [ "$OSRM_BOOT_OVERLAP" = "1" ]; then
+    log "⏩ Partida sobreposta: o Python aguarda o OSRM (${ALL_HOSTS}) enquanto prepara o primeiro arquivo."
+    MAX_TRIES=0
+else
+    log "⏳ Aguardando o(s) servidor(es) OSRM: ${ALL_HOSTS}..."
+fi
 
 while [ $TRY -lt $MAX_TRIES ]; do
-    if curl -s http://localhost:5000/status > /dev/null; then
+    ALL_READY=1
+    for HOST in ${ALL_HOSTS//,/ }; do
+        curl -s "${HOST}/status" > /dev/null || ALL_READY=0
+    done
+    if [ $ALL_READY -eq 1 ]; then
         log "✅ Servidor OSRM está pronto! Começando o processamento."
         break
     fi
@@ -45,7 +189,7 @@ while [ $TRY -lt $MAX_TRIES ]; do
     TRY=$((TRY+1))
 done
 
-if [ $TRY -eq $MAX_TRIES ]; then
+if [ $MAX_TRIES -gt 0 ] && [ $TRY -eq $MAX_TRIES ]; then
     log "❌ TIMEOUT: Servidor OSRM não respondeu após $MAX_TRIES tentativas."
     
     # SALVAR LOG DE FALHA NO S3
@@ -57,8 +201,16 @@ fi
 
 # 3. Execução do Pipeline Principal
 log "🚀 Executando pipeline principal (osrm-request.py)..."
-python osrm-request.py
+# Em segundo plano para o SIGTERM do desligamento (stop forçado, interrupção spot) chegar ao Python, que drena:
+# grava o que já foi roteado, registra o checkpoint no bookmark e sai com código 4
+python osrm-request.py &
+PIPELINE_PID=$!
+trap 'log "🛑 SIGTERM recebido: drenando o pipeline..."; kill -TERM $PIPELINE_PID 2>/dev/null' TERM
+wait $PIPELINE_PID
+while kill -0 $PIPELINE_PID 2>/dev/null; do wait $PIPELINE_PID; done
+wait $PIPELINE_PID
 EXIT_CODE=$?
+trap - TERM
 
 if [ $EXIT_CODE -eq 0 ]; then
     log "✅ SUCESSO: Pipeline principal concluído."
@@ -101,12 +253,23 @@ if [ $EXIT_CODE -eq 0 ]; then
     aws s3 cp $LOG_FILE "s3://20-ze-datalake-landing/osrm_distance/osrm_success/${EXECUTION_DATE}_${EXECUTION_TIMESTAMP}_success.log"
     log "📤 Log de sucesso enviado para S3"
     
-    log "🔌 Lambda irá desligar a VM automaticamente."
+    if [ "$OSRM_SHUTDOWN_MODE" = "hibernate" ]; then
+        log "🛌 VM será hibernada ao fim do script (a Lambda hiberna como garantia)."
+    else
+        log "🔌 Lambda irá desligar a VM automaticamente."
+    fi
+elif [ $EXIT_CODE -eq 4 ]; then
+    # Drenado: a VM está parando; sem dedupe nem hibernação, só o log (o progresso já está no bookmark)
+    log "🛑 Pipeline drenado (SIGTERM/interrupção spot). O restante fica para a próxima execução."
+    aws s3 cp $LOG_FILE "s3://20-ze-datalake-landing/osrm_distance/osrm_failed/${EXECUTION_DATE}_${EXECUTION_TIMESTAMP}_drained.log"
+    log "📤 Log de drenagem enviado para S3"
 else
     log "❌ FALHA: Pipeline principal falhou. Código de saída: $EXIT_CODE."
     
-    # SALVAR LOG DE FALHA NO S3
-    aws s3 cp $LOG_FILE "s3://20-ze-datalake-landing/osrm_distance/osrm_failed/${EXECUTION_DATE}_${EXECUTION_TIMESTAMP}_pipeline_failed.log"
+    # SALVAR LOG DE FALHA NO S3 (código 3: OSRM não ficou pronto na partida sobreposta)
+    FAILURE_KIND="pipeline_failed"
+    [ $EXIT_CODE -eq 3 ] && FAILURE_KIND="osrm_timeout"
+    aws s3 cp $LOG_FILE "s3://20-ze-datalake-landing/osrm_distance/osrm_failed/${EXECUTION_DATE}_${EXECUTION_TIMESTAMP}_${FAILURE_KIND}.log"
     log "📤 Log de falha enviado para S3"
     
     log "⚠️  VM não será desligada automaticamente devido à falha."
@@ -119,4 +282,14 @@ fi
 
 log "--- FIM DA EXECUÇÃO AUTOMÁTICA ---"
 
+# 7. Hibernação: na retomada (próximo start da Lambda) o script recomeça com o OSRM já carregado
+if [ $EXIT_CODE -eq 0 ] && [ "$OSRM_SHUTDOWN_MODE" = "hibernate" ]; then
+    if hibernate_and_wait; then
+        aws s3 rm "$HIBERNATE_MARKER" >> $LOG_FILE 2>&1
+        export OSRM_BOOT_KIND=resume
+        export OSRM_BOOT_EPOCH=$(date +%s)
+        exec "./$(basename "$0")"
+    fi
+fi
+
 exit $EXIT_CODE
\ No newline at end of file
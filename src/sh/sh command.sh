@@ -27,6 +27,7 @@ else
 fi
 
 # --- 3. FUNÇÃO DE RECUPERAÇÃO DO MAPA E DOCKER ---
+# $1 = "--verify" recalcula o ETag de todos os arquivos locais (container em restart: mapa possivelmente corrompido)
 recover_docker_and_maps() {
     log "Iniciando recuperação: Parando, removendo e restaurando arquivos de mapa."
     
@@ -34,16 +35,16 @@ recover_docker_and_maps() {
     sudo docker stop $CONTAINER_NAME 2>/dev/null
     sudo docker rm $CONTAINER_NAME 2>/dev/null
 
-    # Restaurar arquivos do S3
-    log "Baixando arquivos OSRM do S3 para ${MAP_DIR}..."
+    # Restaurar do S3 só os arquivos ausentes ou com ETag divergente (manifesto em ${MAP_DIR}/.map_manifest.json)
+    log "Sincronizando arquivos OSRM de ${MAP_S3_PATH} para ${MAP_DIR}..."
     mkdir -p "${MAP_DIR}" # Garante que o diretório exista
-    aws s3 cp $MAP_S3_PATH $MAP_DIR --recursive
+    python map_sync.py --map-dir "${MAP_DIR}" --s3-path "${MAP_S3_PATH}" $1 2>&1 | tee -a $LOG_FILE
     
-    if [ $? -ne 0 ]; then
-        log "ERRO: Falha ao baixar arquivos do S3. Verifique as permissões IAM. Abortando."
+    if [ ${PIPESTATUS[0]} -ne 0 ]; then
+        log "ERRO: Falha ao sincronizar/verificar os arquivos do S3. Verifique as permissões IAM. Abortando."
         exit 1
     fi
-    log "Download concluído."
+    log "Mapa íntegro."
 
     # Iniciar novo container
     log "Iniciando o container Docker novamente."
@@ -65,7 +66,7 @@ if [ -z "$CONTAINER_STATUS" ]; then
     recover_docker_and_maps
 elif [ "$CONTAINER_STATUS" = "restarting" ]; then
     log "Container em status 'restarting'. Presumindo arquivos ausentes/corrompidos. Iniciando recuperação..."
-    recover_docker_and_maps
+    recover_docker_and_maps --verify
 elif [ "$CONTAINER_STATUS" = "exited" ]; then
     log "Container ${CONTAINER_NAME} está 'exited'. Iniciando o container."
     sudo docker start $CONTAINER_NAME
@@ -19,6 +19,17 @@ variable "schedule_expressions" {
   ]
 }
 
+variable "stop_action" {
+  description = "Ação dos agendamentos de parada: \"stop\" (padrão) ou \"hibernate\", que mantém o osrm-routed em RAM até o próximo start (requer hibernação habilitada no lançamento da instância e OSRM_SHUTDOWN_MODE=hibernate na VM)"
+  type = string
+  default = "stop"
+
+  validation {
+    condition     = contains(["hibernate", "stop"], var.stop_action)
+    error_message = "stop_action deve ser \"hibernate\" ou \"stop\"."
+  }
+}
+
 # Provider AWS
 provider "aws" {
   region = var.aws_region
@@ -53,10 +64,31 @@ resource "aws_iam_role_policy" "lambda_ec2_policy" {
         Action = [
           "ec2:StartInstances",
           "ec2:StopInstances",
+          "ec2:RebootInstances",
           "ec2:DescribeInstances"
         ]
         Resource = "*"
       },
+      {
+        # Checagem de backlog antes do START: listagem da source e leitura do bookmark
+        Effect = "Allow"
+        Action = ["s3:ListBucket"]
+        Resource = "arn:aws:s3:::50-ze-datalake-refined"
+      },
+      {
+        Effect = "Allow"
+        Action = ["s3:GetObject"]
+        Resource = [
+          "arn:aws:s3:::20-ze-datalake-landing/osrm_distance/control/bookmark.json",
+          "arn:aws:s3:::20-ze-datalake-landing/osrm_distance/control/hibernate_marker.json",
+        ]
+      },
+      {
+        # Estimativa do trabalho repassada à VM
+        Effect = "Allow"
+        Action = ["s3:PutObject"]
+        Resource = "arn:aws:s3:::20-ze-datalake-landing/osrm_distance/control/run_plan.json"
+      },
       {
         Effect = "Allow"
         Action = [
@@ -84,11 +116,12 @@ resource "aws_lambda_function" "ec2_scheduler" {
   handler = "lambda_function.lambda_handler"
   source_code_hash = data.archive_file.lambda_zip.output_base64sha256
   runtime = "python3.11"
-  timeout = 60
+  timeout = 660 # waiters de até 10 min (a hibernação grava a RAM no EBS antes de chegar a "stopped")
 
   environment {
     variables = {
       INSTANCE_ID = var.instance_id
+      BACKLOG_CHECK = "1"
     }
   }
 }
@@ -142,14 +175,14 @@ resource "aws_cloudwatch_event_target" "lambda_target_morning_stop" {
   rule = aws_cloudwatch_event_rule.ec2_scheduler_morning_stop.name
   target_id = "ec2-scheduler-lambda-morning-stop"
   arn  = aws_lambda_function.ec2_scheduler.arn
-  input= jsonencode({ action = "stop" })
+  input= jsonencode({ action = var.stop_action })
 }
 
 resource "aws_cloudwatch_event_target" "lambda_target_noon_stop" {
   rule = aws_cloudwatch_event_rule.ec2_scheduler_noon_stop.name
   target_id = "ec2-scheduler-lambda-noon-stop"
   arn = aws_lambda_function.ec2_scheduler.arn
-  input= jsonencode({ action = "stop" })
+  input= jsonencode({ action = var.stop_action })
 }
 
 